@@ -0,0 +1,177 @@
+import contextlib
+import io
+import os
+import sys
+import warnings
+
+from brewparse import PARSERS, thread_parser
+
+# The Brewin programs in corpus/, and checks that the parsers and the execution
+# engines agree on them. p*.br run to the end, e*.br stop with an error, q*.br
+# lean on the quirks of the v3 semantics (struct defaults, nil, field and
+# argument aliasing, the type a struct variable gives the value assigned to it)
+# and s*.br are p03_structs.br with one character deleted, so they have syntax
+# errors the LALR parser recovers from or stops at. Every program reads its
+# input from CORPUS_INPUT, and its .expected file has what the baseline tree
+# walker output and the error it stopped with.
+#
+# python brewcorpus.py [parsers | engines] runs both checks, or the one named:
+#
+#   parsers  parses every program, and every copy of it with one character
+#            deleted, with each of brewparse.PARSERS, and reports the sources
+#            whose str(tree) or printed syntax errors differ
+#   engines  runs every program on the tree walking interpreter and on each of
+#            ENGINE_OPTIONS, and reports the programs whose output, printed
+#            text, error type or exception differ, and the programs whose
+#            tree walker output or error isn't the one in their .expected file. A lazily parsed program
+#            reports a syntax error in a body when the body is loaded (see
+#            brewlazy), so the lazy_parse options are only checked on the
+#            programs that parse without errors. The struct_heap options
+#            check that the programs structheap.heap_hazard lets use the
+#            columnar heap run as they do without it.
+#   expected writes the .expected file of each program that has none, from
+#            the tree walker's run; check what it wrote before committing it
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus")
+CORPUS_INPUT = ["7", "hello"]
+
+# the Interpreter options the tree walker is checked against
+ENGINE_OPTIONS = [
+    {"engine": "closure"},
+    {"engine": "bytecode"},
+    {"engine": "python"},
+    {"engine": "tree", "lazy_parse": True},
+    {"engine": "closure", "lazy_parse": True},
+    {"engine": "bytecode", "lazy_parse": True},
+    {"engine": "tree", "parser": "pratt"},
+    {"engine": "tree", "struct_heap": True},
+    {"engine": "bytecode", "struct_heap": True},
+    {"engine": "python", "struct_heap": True},
+]
+
+
+# (file name, source) of each corpus program, in name order
+def corpus_programs():
+    programs = []
+    for name in sorted(os.listdir(CORPUS_DIR)):
+        if name.endswith(".br"):
+            with open(os.path.join(CORPUS_DIR, name)) as f:
+                programs.append((name, f.read()))
+    return programs
+
+
+# source with each one of its characters deleted in turn
+def deletion_variants(source):
+    return [source[:i] + source[i + 1:] for i in range(len(source))]
+
+
+# the str of the tree parser builds from source, or "SyntaxError", and the
+# syntax errors it printed
+def parse_outcome(parser, source):
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        try:
+            tree = str(thread_parser(parser).parse(source))
+        except SyntaxError:
+            tree = "SyntaxError"
+    return tree, out.getvalue()
+
+
+# (program name, index of the deletion variant or None, outcome of each
+# parser) of each source the parsers disagree on
+def check_parsers(programs):
+    mismatches = []
+    for name, source in programs:
+        variants = [(None, source)] + list(enumerate(deletion_variants(source)))
+        for index, variant in variants:
+            outcomes = [parse_outcome(parser, variant) for parser in PARSERS]
+            if any(outcome != outcomes[0] for outcome in outcomes):
+                mismatches.append((name, index, outcomes))
+    return mismatches
+
+
+def expected_path(name):
+    return os.path.join(CORPUS_DIR, name[:-len(".br")] + ".expected")
+
+
+# the text of a .expected file: the lines the program output, then "# " and the
+# error type it stopped with, or the exception if it stopped without one
+def expected_text(outcome):
+    output, _, error_type, exception = outcome
+    lines = list(output)
+    if error_type is not None:
+        lines.append(f"# {error_type}")
+    elif exception is not None:
+        lines.append(f"# {exception}")
+    return "".join(line + "\n" for line in lines)
+
+
+# the output of running source, what it printed (syntax errors), the error type
+# it reported and the name of the exception it stopped with
+def run_outcome(source, **options):
+    from interpreterv3 import Interpreter
+    interpreter = Interpreter(console_output=False, inp=list(CORPUS_INPUT), **options)
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out), warnings.catch_warnings():
+        # struct_heap warns about the programs it runs with slotted structs
+        warnings.simplefilter("ignore", RuntimeWarning)
+        try:
+            interpreter.run(source)
+            exception = None
+        except Exception as e:
+            exception = type(e).__name__
+    error_type, _ = interpreter.get_error_type_and_line()
+    return interpreter.get_output(), out.getvalue(), error_type, exception
+
+
+# (program name, options, expected outcome, outcome) of each run that didn't
+# behave like the tree walker, and of each tree walker run that didn't give its
+# .expected file
+def check_engines(programs, engine_options=ENGINE_OPTIONS):
+    mismatches = []
+    for name, source in programs:
+        expected = run_outcome(source)
+        if os.path.exists(expected_path(name)):
+            with open(expected_path(name)) as f:
+                text = f.read()
+            if expected_text(expected) != text:
+                mismatches.append((name, {"engine": "tree"}, text, expected_text(expected)))
+        syntax_errors = parse_outcome("lalr", source)[1]
+        for options in engine_options:
+            if syntax_errors and options.get("lazy_parse"):
+                continue
+            outcome = run_outcome(source, **options)
+            if outcome != expected:
+                mismatches.append((name, options, expected, outcome))
+    return mismatches
+
+
+if __name__ == "__main__":
+    sys.setrecursionlimit(10000)
+    checks = sys.argv[1:] or ["parsers", "engines"]
+    programs = corpus_programs()
+    failed = False
+    if "parsers" in checks:
+        mismatches = check_parsers(programs)
+        for name, index, outcomes in mismatches:
+            where = name if index is None else f"{name} without character {index}"
+            print(f"MISMATCH {where}")
+            for parser, outcome in zip(PARSERS, outcomes):
+                print(f"  {parser}: {outcome}")
+        sources = len(programs) + sum(len(source) for _, source in programs)
+        print(f"parsers: {sources} sources, {len(mismatches)} mismatches")
+        failed = failed or bool(mismatches)
+    if "engines" in checks:
+        mismatches = check_engines(programs)
+        for name, options, expected, outcome in mismatches:
+            print(f"MISMATCH {name} {options}\n  expected: {expected!r}\n  got:      {outcome!r}")
+        print(f"engines: {len(programs)} programs, {len(ENGINE_OPTIONS)} configurations, "
+              f"{len(mismatches)} mismatches")
+        failed = failed or bool(mismatches)
+    if "expected" in checks:
+        for name, source in programs:
+            if not os.path.exists(expected_path(name)):
+                with open(expected_path(name), "w") as f:
+                    f.write(expected_text(run_outcome(source)))
+                print(f"wrote {expected_path(name)}")
+    sys.exit(1 if failed else 0)
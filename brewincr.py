@@ -0,0 +1,212 @@
+import brewparse
+from brewlazy import top_level_groups
+from brewparallel import parse_definitions
+from intbase import InterpreterBase
+
+# Incremental re-parsing for tools that parse a source again after every edit:
+#
+#   ast = parse_incremental(source)
+#   ast = reparse(ast, offset, length, replacement)
+#
+# reparse replaces source[offset:offset + length] with replacement and returns
+# the tree parse_program would build for the new source. Only the top-level
+# struct and func definitions the edit touches are lexed and parsed again; the
+# other definitions' nodes are reused as they are, so the old and new trees
+# share them. Whenever that could give a different result from parsing the
+# whole source (a syntax error, an edit that opens a comment or string or
+# unbalances the braces, a struct moved after a function) reparse parses the
+# whole source instead, which also reports any errors.
+#
+# The program node's "source_map" annotation is a SourceMap of where each
+# definition is in the source.
+
+# definitions[i] is (start, end, lineno, node) for the i-th struct or function
+# in source order: it spans from the end of the one before (so it includes any
+# comments before its header) to its closing brace, and starts on line lineno.
+# definitions is None if the source couldn't be split into definitions, and the
+# next edit parses the whole source.
+class SourceMap:
+    __slots__ = ("source", "parser", "definitions")
+
+    def __init__(self, source, parser, definitions):
+        self.source = source
+        self.parser = parser
+        self.definitions = definitions
+
+    def __str__(self):
+        count = "no" if self.definitions is None else len(self.definitions)
+        return f"<{count} definitions in {len(self.source)} characters>"
+
+
+def is_func(node):
+    return node.elem_type == InterpreterBase.FUNC_NODE
+
+
+def parse_incremental(source, parser="lalr"):
+    ast = brewparse.parse_program(source, parser=parser)
+    nodes = ast.get("structs") + ast.get("functions")
+    groups = top_level_groups(source, strict=True)
+    definitions = None
+    if groups is not None and len(groups) == len(nodes):
+        definitions = []
+        start = 0
+        lineno = 1
+        for (_, end), node in zip(groups, nodes):
+            definitions.append((start, end, lineno, node))
+            lineno += source.count("\n", start, end)
+            start = end
+    ast.set("source_map", SourceMap(source, parser, definitions))
+    return ast
+
+
+def reparse(ast, offset, length, replacement):
+    source_map = ast.get("source_map")
+    old_source = source_map.source
+    source = old_source[:offset] + replacement + old_source[offset + length:]
+    definitions = source_map.definitions
+    if not definitions:
+        return parse_incremental(source, source_map.parser)
+    new_definitions = reparse_definitions(definitions, old_source, source, offset, length, replacement,
+                                          source_map.parser)
+    if new_definitions is None:
+        return parse_incremental(source, source_map.parser)
+    nodes = [definition[3] for definition in new_definitions]
+    structs = [node for node in nodes if not is_func(node)]
+    new_ast = brewparse.ProgramNode(structs, nodes[len(structs):])
+    new_ast.set("source_map", SourceMap(source, source_map.parser, new_definitions))
+    return new_ast
+
+
+# the definitions of source after the edit, or None if only a whole parse will do
+def reparse_definitions(definitions, old_source, source, offset, length, replacement, parser):
+    # the definitions the edit touches, first to last - 1; an edit on the
+    # boundary between two touches both
+    edit_end = offset + length
+    first = 0
+    while first < len(definitions) and definitions[first][1] < offset:
+        first += 1
+    last = first
+    while last < len(definitions) and definitions[last][0] <= edit_end:
+        last += 1
+    # the text after the last definition is parsed again with it if the edit reaches it
+    includes_tail = last == len(definitions) and edit_end >= definitions[-1][1]
+    if first == len(definitions):
+        region_start = definitions[-1][1]
+        lineno = definitions[-1][2] + old_source.count("\n", definitions[-1][0], region_start)
+    else:
+        region_start = definitions[first][0]
+        lineno = definitions[first][2]
+    old_region_end = len(old_source) if includes_tail else definitions[last - 1][1]
+    region_end = old_region_end + len(replacement) - length
+    region = source[region_start:region_end]
+
+    groups = top_level_groups(region, strict=True)
+    if groups is None:
+        return None
+    if not includes_tail and (groups[-1][1] if groups else 0) != len(region):
+        return None  # text left after the last group would join the next definition
+    if groups:
+        result = parse_definitions(region, lineno, parser)
+        if result is None:
+            return None
+        nodes = result[0] + result[1]
+        if len(nodes) != len(groups):
+            return None
+    else:
+        nodes = []
+        if region.strip():
+            return None
+
+    new_definitions = definitions[:first]
+    start = region_start
+    for (_, group_end), node in zip(groups, nodes):
+        end = region_start + group_end
+        new_definitions.append((start, end, lineno, node))
+        lineno += source.count("\n", start, end)
+        start = end
+    if last < len(definitions):
+        # the rest only move
+        shift = len(replacement) - length
+        line_shift = lineno - definitions[last][2]
+        for start, end, def_lineno, node in definitions[last:]:
+            new_definitions.append((start + shift, end + shift, def_lineno + line_shift, node))
+
+    # the structs must still all come before the functions, and there must be a
+    # function; the definitions either side of the region were in order already
+    neighbours = [definition[3] for definition in definitions[max(first - 1, 0):first] + definitions[last:last + 1]]
+    kinds = [is_func(node) for node in neighbours[:1 if first else 0] + nodes + neighbours[1 if first else 0:]]
+    if not new_definitions or not is_func(new_definitions[-1][3]) or kinds != sorted(kinds):
+        return None
+    return new_definitions
+
+
+# python brewincr.py [functions] [edits]: makes random edits to a generated
+# program, checks each reparse against parsing the whole new source, and
+# compares their times
+if __name__ == "__main__":
+    import contextlib
+    import io
+    import random
+    import sys
+    import time
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    edits = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    func = """
+/* helper {n} {{ */
+func f_{n}(a : int, b : string) : int {{
+  var i : int;
+  for (i = 0; i < a; i = i + 1) {{
+    if (i >= 10 && !(b == "}} {n}") || i != a) {{ print(a * (b - i) / 3, "{{"); }}
+    else {{ x.y.z = new node; return nil; }}
+  }}
+  return -a;
+}}
+"""
+    source = "struct node { x : int; }\n" + "".join(func.format(n=n) for n in range(count)) + \
+        "func main() {\n  print(f_0(1, \"a\"));\n}\n"
+    snippets = ["x", " ", "\n", ";", "{", "}", "\"", "/*", "*/", "1", "print(1);", "var q : int;",
+                "func g() { print(2); }", "struct t { y : int; }"]
+
+    # (tree or "SyntaxError", printed errors, seconds spent parsing, new ast)
+    def outcome(parse, *args):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            start = time.perf_counter()
+            try:
+                new_ast = parse(*args)
+            except SyntaxError:
+                new_ast = None
+            elapsed = time.perf_counter() - start
+        if new_ast is None:
+            return "SyntaxError", out.getvalue(), elapsed, None
+        tree = str(brewparse.ProgramNode(new_ast.get("structs"), new_ast.get("functions")))
+        return tree, out.getvalue(), elapsed, new_ast
+
+    rand = random.Random(0)
+    ast = parse_incremental(source)
+    mismatches = 0
+    kept = 0
+    full_time = 0
+    incremental_time = 0
+    for _ in range(edits):
+        old_source = ast.get("source_map").source
+        offset = rand.randrange(len(old_source))
+        length = rand.choice((0, 0, 1, 2, 10))
+        replacement = rand.choice(snippets) if rand.random() < 0.7 else ""
+        new_source = old_source[:offset] + replacement + old_source[offset + length:]
+
+        expected = outcome(brewparse.parse_program, new_source)
+        got = outcome(reparse, ast, offset, length, replacement)
+        if got[:2] != expected[:2]:
+            mismatches += 1
+            print("MISMATCH at", offset, repr(old_source[offset:offset + length]), "->", repr(replacement))
+        if got[3] is not None and not got[1]:
+            # edits that break the program are checked but not kept
+            ast = got[3]
+            kept += 1
+            full_time += expected[2]
+            incremental_time += got[2]
+    print(f"{edits} edits of a {len(source)} character program, {mismatches} mismatches")
+    print(f"{kept} valid edits: whole parse {full_time / kept * 1000:.1f} ms per edit, "
+          f"reparse {incremental_time / kept * 1000:.2f} ms")
@@ -0,0 +1,151 @@
+import re
+
+import brewparse
+from brewscan import Scanner
+from intbase import InterpreterBase
+
+# Lazy parsing (parse_program(program, lazy=True)): struct definitions and
+# function signatures are parsed up front, but each function body is only
+# located, by matching braces in the source, and is parsed the first time the
+# function is called (see load_body). A program's unused functions then cost
+# little more than a scan for braces.
+#
+# Until its body is loaded a func node's statements are None and its
+# "lazy_body" annotation is a LazyBody. A syntax error in a body is reported
+# when the body is loaded, not when the program is parsed; so is an error the
+# parser recovers from by dropping the placeholder of a body (see parse_lazy).
+
+# the braces in a program, and the comments and strings they can hide in (the
+# same patterns as brewlex; anything else containing a brace is a brace). The
+# last two alternatives match a comment or string left open.
+BRACES_RE = re.compile(r'/\*[\s\S]*?\*/|"[^"\n]*"|[{}]|/\*|"')
+
+
+# (start, end) of each brace-delimited group at the top level of program, that
+# is the field list of each struct and the body of each function. A group left
+# open at the end is not reported, and a stray "}" at the top level is skipped.
+# If strict, the result is None instead unless every comment and string is
+# closed, every brace matched, and the program ends outside a group.
+def top_level_groups(program, strict=False):
+    groups = []
+    depth = 0
+    start = 0
+    for match in BRACES_RE.finditer(program):
+        lexeme = match.group()
+        if lexeme == "{":
+            if depth == 0:
+                start = match.start()
+            depth += 1
+        elif lexeme == "}":
+            if depth > 0:
+                depth -= 1
+                if depth == 0:
+                    groups.append((start, match.end()))
+            elif strict:
+                return None
+        elif strict and (lexeme == "/*" or lexeme == '"'):
+            return None
+    if strict and depth != 0:
+        return None
+    return groups
+
+
+# Where the source of a function body is: program[start:end] is the body,
+# braces included, and begins on line lineno. parser is the one to parse it with.
+class LazyBody:
+    __slots__ = ("program", "start", "end", "lineno", "parser")
+
+    def __init__(self, program, start, end, lineno, parser):
+        self.program = program
+        self.start = start
+        self.end = end
+        self.lineno = lineno
+        self.parser = parser
+
+    def __str__(self):
+        return f"<unparsed body on line {self.lineno}>"
+
+
+def parse_lazy(program, parser="lalr"):
+    # Parse a skeleton of the program, with each function body replaced by
+    # "{<n>;" and then as many newlines as the body has, so every line number
+    # outside the bodies stays the same. Body n then parses to the statement
+    # list [int n], and its func node gets a LazyBody for it.
+    bodies = []
+    pieces = []
+    copied = 0
+    lineno = 1
+    for start, end in top_level_groups(program):
+        lineno += program.count("\n", copied, start)
+        newlines = program.count("\n", start, end)
+        # the text between the previous group and this one is its header
+        if any(tok.type == "FUNC" for tok in Scanner().scan(program[copied:start])):
+            pieces.append(program[copied:start])
+            pieces.append(f"{{{len(bodies)};{chr(10) * newlines}}}")
+            bodies.append(LazyBody(program, start, end, lineno, parser))
+        else:
+            pieces.append(program[copied:end])
+        lineno += newlines
+        copied = end
+    pieces.append(program[copied:])
+    ast = brewparse.parse_program("".join(pieces), parser=parser)
+    for func_ast in ast.get("functions"):
+        statements = func_ast.get("statements")
+        if len(statements) != 1 or statements[0].elem_type != InterpreterBase.INT_NODE:
+            # the parser recovered from an error, and this is not the function a body was cut from
+            raise SyntaxError("Syntax error")
+        func_ast.set("statements", None)
+        func_ast.set("lazy_body", bodies[statements[0].get("val")])
+    return ast
+
+
+# Parses the body of a function that parse_lazy left unparsed. The body is
+# parsed as the only function of a program so that either parser can do it.
+def load_body(func_ast):
+    body = func_ast.get("lazy_body")
+    source = "func _() " + body.program[body.start:body.end]
+    ast = brewparse.thread_parser(body.parser).parse(source, body.lineno)
+    functions = ast.get("functions")
+    if len(functions) != 1 or functions[0].get("name") != "_":
+        # the parser recovered from an error in the body
+        raise SyntaxError("Syntax error")
+    func_ast.set("statements", functions[0].get("statements"))
+    func_ast.set("lazy_body", None)
+
+
+# python brewlazy.py [functions]: compares parsing a program of many functions
+# eagerly and lazily, and checks the lazily parsed bodies match
+if __name__ == "__main__":
+    import sys
+    import time
+    import tracemalloc
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    func = """
+/* helper {n} {{ */
+func f_{n}(a : int, b : string) : int {{
+  var i : int;
+  for (i = 0; i < a; i = i + 1) {{
+    if (i >= 10 && !(b == "}} {n}") || i != a) {{ print(a * (b - i) / 3, "{{"); }}
+    else {{ x.y.z = new node; return nil; }}
+  }}
+  return -a;
+}}
+"""
+    program = "struct node { x : int; }\n" + "".join(func.format(n=n) for n in range(count)) + \
+        "func main() {\n  print(f_0(1, \"a\"));\n}\n"
+
+    for lazy in (False, True):
+        start = time.perf_counter()
+        brewparse.parse_program(program, lazy=lazy)
+        elapsed = time.perf_counter() - start
+        tracemalloc.start()
+        ast = brewparse.parse_program(program, lazy=lazy)
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print(f"{'lazy' if lazy else 'eager':5}  {elapsed:.3f} s  {memory / 1e6:.1f} MB")
+
+    eager = brewparse.parse_program(program)
+    for func_ast in ast.get("functions"):
+        load_body(func_ast)
+    print("same tree after loading every body:", str(ast) == str(eager))
@@ -1,6 +1,14 @@
+import os
 
 from ply import lex
 
+# Fast-start mode (BREWIN_FAST_START=1): the lexer and parser are built from the
+# prebuilt lextab.py and parsetab.py through ply's optimize mode, which skips
+# validating the rules and checking the tables against the grammar. After
+# changing the grammar, import brewparse once without it to refresh parsetab,
+# and delete lextab.py and import once with it to rebuild lextab.
+FAST_START = os.environ.get("BREWIN_FAST_START") == "1"
+
 reserved = (
     "VAR",
     "FUNC",
@@ -133,4 +141,4 @@ def reset_lineno():
     lexer.lineno = 1
 
 # Build the lexer
-lexer = lex.lex()
+lexer = lex.lex(optimize=FAST_START, lextab="lextab")
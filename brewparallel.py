@@ -0,0 +1,130 @@
+import contextlib
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import brewparse
+from brewlazy import top_level_groups
+from flatast import FlatAST
+
+# Parallel parsing (parse_program(program, workers=n)): the source is cut after
+# top-level struct and function definitions into about CHUNKS_PER_WORKER chunks
+# per worker, the chunks are parsed in a process pool, and their structs and
+# functions are joined into one program node.
+#
+# A chunk is parsed as a program of its own, starting on its own line, with
+# CHUNK_END appended so that a chunk of structs alone is a program too. If any
+# chunk has a syntax error, or the chunks only parse because they were parsed
+# apart (e.g. a struct after a function), the whole program is parsed again in
+# this process, which reports the errors exactly as a plain parse would.
+
+# sources shorter than this are parsed in this process; a pool doesn't pay off
+MIN_PARALLEL_SIZE = 256 * 1024
+CHUNKS_PER_WORKER = 4
+CHUNK_END = " func _() { 0; }"
+
+
+# the source of each chunk, and the line it starts on
+def split_chunks(program, count):
+    target = len(program) // count + 1
+    chunks = []
+    start = 0
+    lineno = 1
+    for _, end in top_level_groups(program):
+        if end - start >= target:
+            chunks.append((program[start:end], lineno))
+            lineno += program.count("\n", start, end)
+            start = end
+    if start < len(program) or not chunks:
+        chunks.append((program[start:], lineno))
+    return chunks
+
+
+# the (structs, functions) of a chunk of whole top-level definitions that
+# starts on line lineno, or None if it has a syntax error; errors aren't printed
+def parse_definitions(chunk, lineno, parser="lalr"):
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        try:
+            ast = brewparse.thread_parser(parser).parse(chunk + CHUNK_END, lineno)
+        except SyntaxError:
+            return None
+    if out.getvalue():
+        return None  # the parser printed an error and recovered from it
+    functions = ast.get("functions")
+    if not functions or functions[-1].get("name") != "_":
+        return None
+    return ast.get("structs"), functions[:-1]
+
+
+# runs in a worker: the chunk's definitions as a program node in a FlatAST,
+# which is quicker to send back and rebuild than a pickled tree
+def parse_chunk(chunk, lineno, parser):
+    result = parse_definitions(chunk, lineno, parser)
+    if result is None:
+        return None
+    return FlatAST.from_tree(brewparse.ProgramNode(*result))
+
+
+def parse_parallel(program, parser="lalr", workers=None):
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(program) < MIN_PARALLEL_SIZE:
+        return brewparse.thread_parser(parser).parse(program)
+    chunks = split_chunks(program, workers * CHUNKS_PER_WORKER)
+    with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as pool:
+        results = list(pool.map(parse_chunk, *zip(*chunks), [parser] * len(chunks)))
+    structs = []
+    functions = []
+    for result in results:
+        if result is None:
+            return brewparse.thread_parser(parser).parse(program)
+        chunk_ast = result.to_tree()
+        if chunk_ast.get("structs") and functions:
+            return brewparse.thread_parser(parser).parse(program)
+        structs += chunk_ast.get("structs")
+        functions += chunk_ast.get("functions")
+    if not functions:
+        return brewparse.thread_parser(parser).parse(program)
+    return brewparse.ProgramNode(structs, functions)
+
+
+# python brewparallel.py [megabytes] [workers]: times a plain and a parallel
+# parse of a generated program and checks they build the same tree
+if __name__ == "__main__":
+    import sys
+    import time
+
+    megabytes = float(sys.argv[1]) if len(sys.argv) > 1 else 4
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    func = """
+/* helper {n} {{ */
+struct s_{n} {{ x : int; }}
+"""
+    structs = "".join(func.format(n=n) for n in range(100))
+    func = """
+func f_{n}(a : int, b : string) : int {{
+  var i : int;
+  for (i = 0; i < a; i = i + 1) {{
+    if (i >= 10 && !(b == "}} {n}") || i != a) {{ print(a * (b - i) / 3, "{{"); }}
+    else {{ x.y.z = new node; return nil; }}
+  }}
+  return -a;
+}}
+"""
+    chunks = [structs]
+    size = len(structs)
+    n = 0
+    while size < megabytes * 1e6:
+        chunks.append(func.format(n=n))
+        size += len(chunks[-1])
+        n += 1
+    program = "".join(chunks) + "func main() {\n  print(f_0(1, \"a\"));\n}\n"
+
+    start = time.perf_counter()
+    plain = brewparse.parse_program(program)
+    print(f"{len(program) / 1e6:.1f} MB  plain     {time.perf_counter() - start:.2f} s")
+    start = time.perf_counter()
+    parallel = brewparse.parse_program(program, workers=workers)
+    print(f"{len(program) / 1e6:.1f} MB  parallel  {time.perf_counter() - start:.2f} s  "
+          f"({workers or os.cpu_count()} workers)")
+    print("same tree:", str(plain) == str(parallel))
@@ -1,4 +1,9 @@
-from element import Element
+import copy
+import mmap
+import os
+import threading
+
+from element import FieldPath, node_class
 from brewlex import *
 from intbase import InterpreterBase
 from ply import yacc
@@ -14,6 +19,83 @@ precedence = (
     ("right", "UMINUS", "NOT"),
 )
 
+# Every node kind, in the order of their kind codes. Each node stores its code as
+# node.kind, next to the elem_type string, so interpreters can dispatch on it
+# with a list index (see dispatch_table).
+NODE_KINDS = (
+    InterpreterBase.PROGRAM_NODE, InterpreterBase.STRUCT_NODE, InterpreterBase.FIELD_DEF_NODE,
+    InterpreterBase.FUNC_NODE, InterpreterBase.ARG_NODE, "=", InterpreterBase.VAR_DEF_NODE,
+    InterpreterBase.IF_NODE, InterpreterBase.TRY_NODE, InterpreterBase.CATCH_NODE,
+    InterpreterBase.FOR_NODE, InterpreterBase.RAISE_NODE, InterpreterBase.RETURN_NODE,
+    InterpreterBase.NOT_NODE, InterpreterBase.NEG_NODE, InterpreterBase.NEW_NODE,
+    InterpreterBase.INT_NODE, InterpreterBase.BOOL_NODE, InterpreterBase.NIL_NODE,
+    InterpreterBase.STRING_NODE, InterpreterBase.VAR_NODE, InterpreterBase.FCALL_NODE,
+    "+", "-", "*", "/", "==", "!=", "<", "<=", ">", ">=", "&&", "||",
+)
+KIND_CODES = {kind: code for code, kind in enumerate(NODE_KINDS)}
+
+
+# a list indexed by kind code holding each kind's handler, or default
+def dispatch_table(handlers, default=None):
+    table = [default] * len(NODE_KINDS)
+    for kind, handler in handlers.items():
+        table[KIND_CODES[kind]] = handler
+    return table
+
+
+def node(class_name, elem_type, fields, annotations=()):
+    return node_class(class_name, elem_type, fields, annotations, KIND_CODES, __name__)
+
+
+# AST node classes, one per node kind, with their fields and the annotations
+# that resolverv3 and typecheckv3 fill in after parsing
+ProgramNode = node("ProgramNode", InterpreterBase.PROGRAM_NODE, ("structs", "functions"), ("source_map",))
+StructNode = node("StructNode", InterpreterBase.STRUCT_NODE, ("name", "fields"))
+FieldDefNode = node("FieldDefNode", InterpreterBase.FIELD_DEF_NODE, ("name", "var_type"))
+FuncNode = node(
+    "FuncNode", InterpreterBase.FUNC_NODE, ("name", "args", "return_type", "statements"),
+    ("layout", "body_layout", "checked_return", "lazy_body", "copy_args"),
+)
+ArgNode = node("ArgNode", InterpreterBase.ARG_NODE, ("name", "var_type"))
+AssignNode = node("AssignNode", "=", ("name", "expression"), ("slot", "checked"))
+VarDefNode = node("VarDefNode", InterpreterBase.VAR_DEF_NODE, ("name", "var_type"))
+IfNode = node(
+    "IfNode", InterpreterBase.IF_NODE, ("condition", "statements", "else_statements"),
+    ("layout", "else_layout", "checked"),
+)
+TryNode = node("TryNode", InterpreterBase.TRY_NODE, ("statements", "catchers"))
+CatchNode = node("CatchNode", InterpreterBase.CATCH_NODE, ("exception_type", "statements"))
+ForNode = node(
+    "ForNode", InterpreterBase.FOR_NODE, ("init", "condition", "update", "statements"),
+    ("layout", "checked"),
+)
+RaiseNode = node("RaiseNode", InterpreterBase.RAISE_NODE, ("exception_type",))
+ReturnNode = node("ReturnNode", InterpreterBase.RETURN_NODE, ("expression",), ("copy",))
+NotNode = node("NotNode", InterpreterBase.NOT_NODE, ("op1",), ("checked",))
+NegNode = node("NegNode", InterpreterBase.NEG_NODE, ("op1",), ("checked",))
+NewNode = node("NewNode", InterpreterBase.NEW_NODE, ("var_type",))
+# every binary operator; elem_type is the operator
+BinOpNode = node("BinOpNode", None, ("op1", "op2"), ("checked",))
+IntNode = node("IntNode", InterpreterBase.INT_NODE, ("val",))
+BoolNode = node("BoolNode", InterpreterBase.BOOL_NODE, ("val",))
+NilNode = node("NilNode", InterpreterBase.NIL_NODE, ())
+StringNode = node("StringNode", InterpreterBase.STRING_NODE, ("val",))
+VarNode = node("VarNode", InterpreterBase.VAR_NODE, ("name",), ("slot",))
+FCallNode = node("FCallNode", InterpreterBase.FCALL_NODE, ("name", "args"), ("checked_args", "alias_args"))
+
+# the node class for each node kind
+NODE_CLASSES = {
+    node_cls.elem_type: node_cls
+    for node_cls in (
+        ProgramNode, StructNode, FieldDefNode, FuncNode, ArgNode, AssignNode, VarDefNode, IfNode,
+        TryNode, CatchNode, ForNode, RaiseNode, ReturnNode, NotNode, NegNode, NewNode, IntNode,
+        BoolNode, NilNode, StringNode, VarNode, FCallNode,
+    )
+}
+for kind in NODE_KINDS:
+    NODE_CLASSES.setdefault(kind, BinOpNode)
+
+
 def collapse_items(p, group_index, singleton_index):
     if len(p) == 2:
         p[0] = [p[1]]
@@ -26,9 +108,9 @@ def p_program(p):
     """program : structs funcs
     | funcs"""
     if len(p) == 2:
-        p[0] = Element(InterpreterBase.PROGRAM_NODE, structs=[], functions=p[1])
+        p[0] = ProgramNode([], p[1])
     else:
-        p[0] = Element(InterpreterBase.PROGRAM_NODE, structs=p[1], functions=p[2])
+        p[0] = ProgramNode(p[1], p[2])
 
 def p_structs(p):
     """structs : structs struct
@@ -37,7 +119,7 @@ def p_structs(p):
 
 def p_struct(p):
    "struct : STRUCT NAME LBRACE fields RBRACE"
-   p[0] = Element(InterpreterBase.STRUCT_NODE, name=p[2], fields=p[4])
+   p[0] = StructNode(p[2], p[4])
 
 def p_fields(p):
    """fields : fields field
@@ -46,7 +128,7 @@ def p_fields(p):
 
 def p_field(p):
   "field : NAME COLON NAME SEMI"  # field_name: type
-  p[0] = Element(InterpreterBase.FIELD_DEF_NODE, name=p[1], var_type=p[3])
+  p[0] = FieldDefNode(p[1], p[3])
 
 def p_funcs(p):
     """funcs : funcs func
@@ -58,17 +140,17 @@ def p_func(p):
     """func : FUNC NAME LPAREN formal_args RPAREN COLON NAME LBRACE statements RBRACE
     | FUNC NAME LPAREN RPAREN COLON NAME LBRACE statements RBRACE"""
     if len(p) == 11:  # handle with 1+ formal args
-        p[0] = Element(InterpreterBase.FUNC_NODE, name=p[2], args=p[4], return_type = p[7], statements=p[9])
+        p[0] = FuncNode(p[2], p[4], p[7], p[9])
     else:  # handle no formal args
-        p[0] = Element(InterpreterBase.FUNC_NODE, name=p[2], args=[], return_type = p[6], statements=p[8])
+        p[0] = FuncNode(p[2], [], p[6], p[8])
 
 def p_func2(p):
     """func : FUNC NAME LPAREN formal_args RPAREN LBRACE statements RBRACE
     | FUNC NAME LPAREN RPAREN LBRACE statements RBRACE"""
     if len(p) == 9:  # handle with 1+ formal args
-        p[0] = Element(InterpreterBase.FUNC_NODE, name=p[2], args=p[4], return_type = None, statements=p[7])
+        p[0] = FuncNode(p[2], p[4], None, p[7])
     else:  # handle no formal args
-        p[0] = Element(InterpreterBase.FUNC_NODE, name=p[2], args=[], return_type = None, statements=p[6])
+        p[0] = FuncNode(p[2], [], None, p[6])
 
 def p_formal_args(p):
     """formal_args : formal_args COMMA formal_arg
@@ -80,9 +162,9 @@ def p_formal_arg(p):
     """formal_arg : NAME COLON NAME
     | NAME"""
     if len(p) == 2:
-      p[0] = Element(InterpreterBase.ARG_NODE, name=p[1], var_type = None)
+      p[0] = ArgNode(p[1], None)
     else:
-      p[0] = Element(InterpreterBase.ARG_NODE, name=p[1], var_type = p[3])
+      p[0] = ArgNode(p[1], p[3])
 
 def p_statements(p):
     """statements : statements statement
@@ -96,15 +178,15 @@ def p_statement___assign(p):
 
 def p_assign(p):
     "assign : variable_w_dot ASSIGN expression"
-    p[0] = Element("=", name=p[1], expression=p[3])
+    p[0] = AssignNode(p[1], p[3])
 
 def p_statement___var(p):
     """statement : VAR variable COLON NAME SEMI
     | VAR variable SEMI"""
     if len(p) == 6:
-      p[0] = Element(InterpreterBase.VAR_DEF_NODE, name=p[2], var_type=p[4])
+      p[0] = VarDefNode(p[2], p[4])
     else:
-      p[0] = Element(InterpreterBase.VAR_DEF_NODE, name=p[2], var_type=None)
+      p[0] = VarDefNode(p[2], None)
 
 def p_variable(p):
     "variable : NAME"
@@ -114,7 +196,8 @@ def p_variable_w_dot(p):
     """variable_w_dot : variable_w_dot DOT NAME
     | NAME"""
     if len(p) == 4:
-        p[0] = p[1] + "." + p[3]
+        base, fields = FieldPath.split(p[1])
+        p[0] = FieldPath(base, fields + (p[3],))
     else:
         p[0] = p[1]
 
@@ -123,23 +206,13 @@ def p_statement_if(p):
     | IF LPAREN expression RPAREN LBRACE statements RBRACE ELSE LBRACE statements RBRACE
     """
     if len(p) == 8:
-        p[0] = Element(
-            InterpreterBase.IF_NODE,
-            condition=p[3],
-            statements=p[6],
-            else_statements=None,
-        )
+        p[0] = IfNode(p[3], p[6], None)
     else:
-        p[0] = Element(
-            InterpreterBase.IF_NODE,
-            condition=p[3],
-            statements=p[6],
-            else_statements=p[10],
-        )
+        p[0] = IfNode(p[3], p[6], p[10])
 
 def p_statement_try(p):
     """statement : TRY LBRACE statements RBRACE catchers"""
-    p[0] = Element(InterpreterBase.TRY_NODE, statements=p[3], catchers=p[5])
+    p[0] = TryNode(p[3], p[5])
 
 def p_catches(p):
     """catchers : catchers catch
@@ -148,15 +221,15 @@ def p_catches(p):
 
 def p_catch(p):
     "catch : CATCH STRING LBRACE statements RBRACE"
-    p[0] = Element(InterpreterBase.CATCH_NODE, exception_type=p[2], statements=p[4])
+    p[0] = CatchNode(p[2], p[4])
 
 def p_statement_for(p):
     "statement : FOR LPAREN assign SEMI expression SEMI assign RPAREN LBRACE statements RBRACE"
-    p[0] = Element(InterpreterBase.FOR_NODE, init=p[3], condition=p[5], update=p[7], statements=p[10])
+    p[0] = ForNode(p[3], p[5], p[7], p[10])
 
 def p_statement_raise(p):
     "statement : RAISE expression SEMI"
-    p[0] = Element(InterpreterBase.RAISE_NODE, exception_type=p[2])
+    p[0] = RaiseNode(p[2])
 
 def p_statement_expr(p):
     "statement : expression SEMI"
@@ -170,21 +243,21 @@ def p_statement_return(p):
         expr = p[2]
     else:
         expr = None
-    p[0] = Element(InterpreterBase.RETURN_NODE, expression=expr)
+    p[0] = ReturnNode(expr)
 
 
 def p_expression_not(p):
     "expression : NOT expression"
-    p[0] = Element(InterpreterBase.NOT_NODE, op1=p[2])
+    p[0] = NotNode(p[2])
 
 
 def p_expression_uminus(p):
     "expression : MINUS expression %prec UMINUS"
-    p[0] = Element(InterpreterBase.NEG_NODE, op1=p[2])
+    p[0] = NegNode(p[2])
 
 def p_expression_new(p):
     "expression : NEW NAME"
-    p[0] = Element(InterpreterBase.NEW_NODE, var_type=p[2])
+    p[0] = NewNode(p[2])
 
 
 def p_arith_expression_binop(p):
@@ -198,7 +271,7 @@ def p_arith_expression_binop(p):
     | expression MINUS expression
     | expression MULTIPLY expression
     | expression DIVIDE expression"""
-    p[0] = Element(p[2], op1=p[1], op2=p[3])
+    p[0] = BinOpNode(p[2], p[1], p[3])
 
 
 def p_expression_group(p):
@@ -209,43 +282,43 @@ def p_expression_group(p):
 def p_expression_and_or(p):
     """expression : expression OR expression
     | expression AND expression"""
-    p[0] = Element(p[2], op1=p[1], op2=p[3])
+    p[0] = BinOpNode(p[2], p[1], p[3])
 
 
 def p_expression_number(p):
     "expression : NUMBER"
-    p[0] = Element(InterpreterBase.INT_NODE, val=p[1])
+    p[0] = IntNode(p[1])
 
 
 def p_expression_bool(p):
     """expression : TRUE
     | FALSE"""
     bool_val = p[1] == InterpreterBase.TRUE_DEF
-    p[0] = Element(InterpreterBase.BOOL_NODE, val=bool_val)
+    p[0] = BoolNode(bool_val)
 
 
 def p_expression_nil(p):
     "expression : NIL"
-    p[0] = Element(InterpreterBase.NIL_NODE)
+    p[0] = NilNode()
 
 
 def p_expression_string(p):
     "expression : STRING"
-    p[0] = Element(InterpreterBase.STRING_NODE, val=p[1])
+    p[0] = StringNode(p[1])
 
 
 def p_expression_variable(p):
     "expression : variable_w_dot"
-    p[0] = Element(InterpreterBase.VAR_NODE, name=p[1])
+    p[0] = VarNode(p[1])
 
 
 def p_func_call(p):
     """expression : NAME LPAREN args RPAREN
     | NAME LPAREN RPAREN"""
     if len(p) == 5:
-        p[0] = Element(InterpreterBase.FCALL_NODE, name=p[1], args=p[3])
+        p[0] = FCallNode(p[1], p[3])
     else:
-        p[0] = Element(InterpreterBase.FCALL_NODE, name=p[1], args=[])
+        p[0] = FCallNode(p[1], [])
 
 
 def p_expression_args(p):
@@ -256,19 +329,106 @@ def p_expression_args(p):
 
 def p_error(p):
     if p:
-        print(f"Syntax error at '{p.value}' on line {p.lineno}")
+        report_syntax_error(f"Syntax error at '{p.value}' on line {p.lineno}")
     else:
-        print("Syntax error at EOF")
+        report_syntax_error("Syntax error at EOF")
+
+
+# Every parser prints its syntax errors with report_syntax_error, which also
+# counts them per thread. The parser can recover from some errors and still
+# return a tree, so the caches compare syntax_error_count() before and after a
+# parse and don't keep one that printed errors, which a hit wouldn't print.
+_syntax_errors = threading.local()
+
+
+def report_syntax_error(message):
+    print(message)
+    _syntax_errors.count = syntax_error_count() + 1
+
+
+def syntax_error_count():
+    return getattr(_syntax_errors, "count", 0)
+
+
+# A parser with its own clone of the lexer and its own LR parser state (the
+# parse tables are shared, read only), so threads that each use their own
+# Parser can parse at the same time. A single Parser is not meant to be shared
+# between threads. scanner, if given, is used as the lexer instead of a clone
+# of brewlex's, e.g. a brewscan.Scanner.
+class Parser:
+    def __init__(self, scanner=None):
+        self.lexer = lexer.clone() if scanner is None else scanner
+        self.lr_parser = copy.copy(lr_parser)
+
+    # lineno is the line the program starts on
+    def parse(self, program, lineno=1):
+        self.lexer.lineno = lineno
+        ast = self.lr_parser.parse(program, lexer=self.lexer)
+        if ast is None:
+            raise SyntaxError("Syntax error")
+        return ast
+
+
+# each thread gets its own parser of each kind for parse_program
+_thread_parsers = threading.local()
+
+# the parsers parse_program can use: "lalr" is the Parser above, built by ply
+# from the grammar rules, and "pratt" the hand-written brewpratt.PrattParser.
+# Both produce the same trees and syntax errors.
+PARSERS = ("lalr", "pratt")
+
+
+def new_parser(parser="lalr", scanner=None):
+    if parser == "lalr":
+        return Parser(scanner)
+    if parser == "pratt":
+        from brewpratt import PrattParser  # brewpratt imports the node classes from here
+        return PrattParser(scanner)
+    raise ValueError(f"Unknown parser {parser}")
+
+
+# the calling thread's parser of the given kind
+def thread_parser(parser="lalr"):
+    instance = getattr(_thread_parsers, parser, None)
+    if instance is None:
+        instance = new_parser(parser)
+        setattr(_thread_parsers, parser, instance)
+    return instance
 
 
 # exported function
-def parse_program(program):
-    reset_lineno()
-    ast = yacc.parse(program)
-    if ast is None:
-        raise SyntaxError("Syntax error")
-    return ast
+# cache, if given, is a parsecache.ParseCache to look the program up in first
+# parser is one of PARSERS
+# lazy leaves function bodies to be parsed when first called (see brewlazy);
+# it has no effect with a cache, which already saves the parsing
+# workers is the number of processes to parse a large program with (see
+# brewparallel), or None for one per CPU; lazy parsing doesn't use them
+def parse_program(program, cache=None, parser="lalr", lazy=False, workers=1):
+    if cache is not None:
+        return cache.parse(program, parser)
+    if lazy:
+        from brewlazy import parse_lazy  # brewlazy parses with parse_program
+        return parse_lazy(program, parser)
+    if workers != 1:
+        from brewparallel import parse_parallel
+        return parse_parallel(program, parser, workers)
+    return thread_parser(parser).parse(program)
+
+
+# Parses the UTF-8 source file at path. The file is memory-mapped and lexed
+# from the mapped bytes (Scanner.tokenize_bytes), so no str copy of the whole
+# source is made; token values are decoded as the parser takes them.
+def parse_file(path, parser="lalr"):
+    from brewscan import Scanner
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return new_parser(parser, Scanner()).parse(b"")  # an empty file can't be mapped
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        return new_parser(parser, Scanner()).parse(data)
+    finally:
+        data.close()
 
 
 # generate our parser
-yacc.yacc() # yacc.yacc(debug=True, debuglog=open("parse.log", "w"))
+lr_parser = yacc.yacc(optimize=FAST_START) # yacc.yacc(debug=True, debuglog=open("parse.log", "w"))
@@ -0,0 +1,318 @@
+from brewparse import (
+    ArgNode, AssignNode, BinOpNode, BoolNode, CatchNode, FCallNode, FieldDefNode, ForNode, FuncNode,
+    IfNode, IntNode, NegNode, NewNode, NilNode, NotNode, ProgramNode, RaiseNode, ReturnNode,
+    StringNode, StructNode, TryNode, VarDefNode, VarNode, report_syntax_error,
+)
+from brewscan import TOKEN_CODES, Scanner, TokenBuffer
+from element import FieldPath
+from intbase import InterpreterBase
+
+# the token kinds the parser looks at, as TokenBuffer codes
+(
+    AND, ASSIGN, CATCH, COLON, COMMA, DIVIDE, DOT, ELSE, END, EQ, FALSE, FOR, FUNC, GREATER, GREATER_EQ,
+    IF, LBRACE, LESS, LESS_EQ, LPAREN, MINUS, MULTIPLY, NAME, NEW, NIL, NOT, NOT_EQ, NUMBER, OR, PLUS,
+    RAISE, RBRACE, RETURN, RPAREN, SEMI, STRING, STRUCT, TRUE, TRY, VAR,
+) = (TOKEN_CODES[token_type] for token_type in (
+    "AND", "ASSIGN", "CATCH", "COLON", "COMMA", "DIVIDE", "DOT", "ELSE", "END", "EQ", "FALSE", "FOR",
+    "FUNC", "GREATER", "GREATER_EQ", "IF", "LBRACE", "LESS", "LESS_EQ", "LPAREN", "MINUS", "MULTIPLY",
+    "NAME", "NEW", "NIL", "NOT", "NOT_EQ", "NUMBER", "OR", "PLUS", "RAISE", "RBRACE", "RETURN", "RPAREN",
+    "SEMI", "STRING", "STRUCT", "TRUE", "TRY", "VAR",
+))
+
+# Binding power of each binary operator token, from brewparse.precedence: all
+# of them are left associative, and the unary operators bind tighter than any
+EXPR_POWER = 0
+BINARY_POWERS = {
+    OR: 1,
+    AND: 2,
+    GREATER_EQ: 3, GREATER: 3, LESS_EQ: 3, LESS: 3, EQ: 3, NOT_EQ: 3,
+    PLUS: 4, MINUS: 4,
+    MULTIPLY: 5, DIVIDE: 5,
+}
+UNARY_POWER = 6
+
+
+# A hand-written parser for the brewparse grammar: recursive descent for
+# declarations and statements and precedence climbing (Pratt) for expressions.
+# It builds the same trees as the LALR parser from the same tokens, reports
+# the same syntax errors, and recovers from them the same way.
+#
+# It reads the tokens from a TokenBuffer. A brewscan.Scanner, the default,
+# tokenizes straight into one; the tokens of a ply lexer are copied into one.
+class PrattParser:
+    def __init__(self, scanner=None):
+        self.lexer = Scanner() if scanner is None else scanner
+
+    # lineno is the line the program starts on
+    def parse(self, program, lineno=1):
+        self.lexer.lineno = lineno
+        if isinstance(self.lexer, Scanner):
+            tokens = self.lexer.tokenize(program)
+        else:
+            self.lexer.input(program)
+            tokens = TokenBuffer.from_tokens(iter(self.lexer.token, None))
+        tokens.append(END, None, 0, len(program))
+        tokens.decode()
+        self.kinds = tokens.kinds
+        self.values = tokens.values
+        self.table = tokens.table
+        self.lines = tokens.lines
+        self.start = 0
+        self.recovering = False
+        while True:
+            self.pos = self.start
+            try:
+                return self.__program()
+            except SyntaxError:
+                if self.kinds[self.pos] == END:
+                    raise
+                # recover the way ply does without error rules: drop the bad
+                # token and start over at the next one, as if it began the program
+                self.start = self.pos + 1
+                self.recovering = True
+
+    # the value of token i
+    def __value(self, i):
+        return self.table[self.values[i]]
+
+    def __error(self):
+        if not self.recovering or self.pos - self.start >= 3:
+            if self.kinds[self.pos] == END:
+                report_syntax_error("Syntax error at EOF")
+            else:
+                report_syntax_error(f"Syntax error at '{self.__value(self.pos)}' on line {self.lines[self.pos]}")
+        raise SyntaxError("Syntax error")
+
+    # consumes a token of the given type and returns its value
+    def __expect(self, token_type):
+        if self.kinds[self.pos] != token_type:
+            self.__error()
+        self.pos += 1
+        return self.__value(self.pos - 1)
+
+    def __program(self):
+        structs = []
+        while self.kinds[self.pos] == STRUCT:
+            structs.append(self.__struct())
+        funcs = [self.__func()]
+        while self.kinds[self.pos] == FUNC:
+            funcs.append(self.__func())
+        if self.kinds[self.pos] != END:
+            self.__error()
+        return ProgramNode(structs, funcs)
+
+    def __struct(self):
+        self.pos += 1
+        name = self.__expect(NAME)
+        self.__expect(LBRACE)
+        fields = [self.__field()]
+        while self.kinds[self.pos] != RBRACE:
+            fields.append(self.__field())
+        self.pos += 1
+        return StructNode(name, fields)
+
+    def __field(self):
+        name = self.__expect(NAME)
+        self.__expect(COLON)
+        var_type = self.__expect(NAME)
+        self.__expect(SEMI)
+        return FieldDefNode(name, var_type)
+
+    def __func(self):
+        self.__expect(FUNC)
+        name = self.__expect(NAME)
+        self.__expect(LPAREN)
+        args = []
+        if self.kinds[self.pos] != RPAREN:
+            args.append(self.__formal_arg())
+            while self.kinds[self.pos] == COMMA:
+                self.pos += 1
+                args.append(self.__formal_arg())
+        self.__expect(RPAREN)
+        return_type = None
+        if self.kinds[self.pos] == COLON:
+            self.pos += 1
+            return_type = self.__expect(NAME)
+        return FuncNode(name, args, return_type, self.__block())
+
+    def __formal_arg(self):
+        name = self.__expect(NAME)
+        if self.kinds[self.pos] != COLON:
+            return ArgNode(name, None)
+        self.pos += 1
+        return ArgNode(name, self.__expect(NAME))
+
+    # LBRACE statements RBRACE, with at least one statement
+    def __block(self):
+        self.__expect(LBRACE)
+        statements = [self.__statement()]
+        while self.kinds[self.pos] != RBRACE:
+            statements.append(self.__statement())
+        self.pos += 1
+        return statements
+
+    def __statement(self):
+        token_type = self.kinds[self.pos]
+        if token_type == NAME and self.kinds[self.pos + 1] != LPAREN:
+            # an assignment, or an expression statement that starts with a variable
+            name = self.__variable_w_dot()
+            if self.kinds[self.pos] == ASSIGN:
+                self.pos += 1
+                statement = AssignNode(name, self.__expression(EXPR_POWER))
+            else:
+                statement = self.__binary(VarNode(name), EXPR_POWER)
+            self.__expect(SEMI)
+            return statement
+        if token_type == VAR:
+            self.pos += 1
+            name = self.__expect(NAME)
+            var_type = None
+            if self.kinds[self.pos] == COLON:
+                self.pos += 1
+                var_type = self.__expect(NAME)
+            self.__expect(SEMI)
+            return VarDefNode(name, var_type)
+        if token_type == IF:
+            self.pos += 1
+            self.__expect(LPAREN)
+            condition = self.__expression(EXPR_POWER)
+            self.__expect(RPAREN)
+            statements = self.__block()
+            else_statements = None
+            if self.kinds[self.pos] == ELSE:
+                self.pos += 1
+                else_statements = self.__block()
+            return IfNode(condition, statements, else_statements)
+        if token_type == FOR:
+            self.pos += 1
+            self.__expect(LPAREN)
+            init = self.__assign()
+            self.__expect(SEMI)
+            condition = self.__expression(EXPR_POWER)
+            self.__expect(SEMI)
+            update = self.__assign()
+            self.__expect(RPAREN)
+            return ForNode(init, condition, update, self.__block())
+        if token_type == RETURN:
+            self.pos += 1
+            expression = None
+            if self.kinds[self.pos] != SEMI:
+                expression = self.__expression(EXPR_POWER)
+            self.__expect(SEMI)
+            return ReturnNode(expression)
+        if token_type == TRY:
+            self.pos += 1
+            statements = self.__block()
+            catchers = [self.__catch()]
+            while self.kinds[self.pos] == CATCH:
+                catchers.append(self.__catch())
+            return TryNode(statements, catchers)
+        if token_type == RAISE:
+            self.pos += 1
+            exception_type = self.__expression(EXPR_POWER)
+            self.__expect(SEMI)
+            return RaiseNode(exception_type)
+        statement = self.__expression(EXPR_POWER)
+        self.__expect(SEMI)
+        return statement
+
+    def __catch(self):
+        self.__expect(CATCH)
+        exception_type = self.__expect(STRING)
+        return CatchNode(exception_type, self.__block())
+
+    def __assign(self):
+        name = self.__variable_w_dot()
+        self.__expect(ASSIGN)
+        return AssignNode(name, self.__expression(EXPR_POWER))
+
+    def __variable_w_dot(self):
+        base = self.__expect(NAME)
+        if self.kinds[self.pos] != DOT:
+            return base
+        fields = []
+        while self.kinds[self.pos] == DOT:
+            self.pos += 1
+            fields.append(self.__expect(NAME))
+        return FieldPath(base, tuple(fields))
+
+    # an expression whose binary operators all bind tighter than min_power
+    def __expression(self, min_power):
+        return self.__binary(self.__operand(), min_power)
+
+    # extends left with binary operators that bind tighter than min_power
+    def __binary(self, left, min_power):
+        kinds = self.kinds
+        while True:
+            power = BINARY_POWERS.get(kinds[self.pos])
+            if power is None or power <= min_power:
+                return left
+            oper = self.__value(self.pos)
+            self.pos += 1
+            left = BinOpNode(oper, left, self.__expression(power))
+
+    def __operand(self):
+        token_type = self.kinds[self.pos]
+        value = self.__value(self.pos)
+        self.pos += 1
+        if token_type == NAME:
+            if self.kinds[self.pos] == LPAREN:
+                self.pos += 1
+                args = []
+                if self.kinds[self.pos] != RPAREN:
+                    args.append(self.__expression(EXPR_POWER))
+                    while self.kinds[self.pos] == COMMA:
+                        self.pos += 1
+                        args.append(self.__expression(EXPR_POWER))
+                self.__expect(RPAREN)
+                return FCallNode(value, args)
+            self.pos -= 1
+            return VarNode(self.__variable_w_dot())
+        if token_type == NUMBER:
+            return IntNode(value)
+        if token_type == STRING:
+            return StringNode(value)
+        if token_type == TRUE or token_type == FALSE:
+            return BoolNode(value == InterpreterBase.TRUE_DEF)
+        if token_type == NIL:
+            return NilNode()
+        if token_type == LPAREN:
+            expression = self.__expression(EXPR_POWER)
+            self.__expect(RPAREN)
+            return expression
+        if token_type == MINUS:
+            return NegNode(self.__expression(UNARY_POWER))
+        if token_type == NOT:
+            return NotNode(self.__expression(UNARY_POWER))
+        if token_type == NEW:
+            return NewNode(self.__expect(NAME))
+        self.pos -= 1
+        self.__error()
+
+
+# python brewpratt.py: compares the speed of both parsers on a large program
+# and checks they build the same tree for it. python brewcorpus.py parsers
+# checks they give the same trees and errors on the programs in corpus/.
+if __name__ == "__main__":
+    import time
+
+    from brewparse import Parser
+
+    lalr = Parser()
+    pratt = PrattParser()
+    func = """
+func f_{n}(a : int, b : string) : int {{
+  var i : int;
+  for (i = 0; i < a; i = i + 1) {{
+    if (i >= 10 && !(b == "s") || i != a) {{ print(a * (b - i) / 3 + -x.y, "x"); }}
+    else {{ x.y.z = new node; return nil; }}
+  }}
+  return f_{n}(a - 1, b) * 2 + 1 - 3 * 4 / 5;
+}}
+"""
+    program = "".join(func.format(n=n) for n in range(5000)) + "func main() { print(1); }\n"
+    for name, parser in (("lalr", lalr), ("pratt", pratt)):
+        start = time.perf_counter()
+        parser.parse(program)
+        print(f"{name:6} {time.perf_counter() - start:.2f} s")
+    print("same tree:", str(lalr.parse(program)) == str(pratt.parse(program)))
@@ -0,0 +1,483 @@
+import re
+from array import array
+
+from brewlex import reserved_map, tokens
+
+# A hand-written scanner producing the same tokens, values and line numbers as
+# the ply lexer in brewlex, usable as the lexer for yacc.parse (see
+# brewparse.Parser). It dispatches once on each token's first character
+# instead of trying the rules of ply's combined regex in turn. tokenize()
+# returns the tokens as a compact TokenBuffer, which brewpratt parses directly.
+#
+# It reproduces what the brewlex rules do, not just what they were meant to
+# do: t_DOT's pattern is ".", so any character no other rule matches
+# (including an unterminated '"', a lone "&" or "|", or "\r") is a DOT token.
+
+# token kinds in a TokenBuffer: the brewlex token types, and END for a parser
+# to mark the end of the input with
+TOKEN_TYPES = tokens + ("END",)
+TOKEN_CODES = {token_type: code for code, token_type in enumerate(TOKEN_TYPES)}
+RESERVED_CODES = {word: TOKEN_CODES[token_type] for word, token_type in reserved_map.items()}
+NAME_CODE = TOKEN_CODES["NAME"]
+NUMBER_CODE = TOKEN_CODES["NUMBER"]
+STRING_CODE = TOKEN_CODES["STRING"]
+DOT_CODE = TOKEN_CODES["DOT"]
+
+# kinds of the single characters that aren't the start of a longer token
+SINGLE_CHARS = {
+    c: TOKEN_CODES[token_type] for c, token_type in {
+        "(": "LPAREN", ")": "RPAREN", "{": "LBRACE", "}": "RBRACE", ",": "COMMA", ":": "COLON",
+        ";": "SEMI", "+": "PLUS", "-": "MINUS", "*": "MULTIPLY", "/": "DIVIDE", ">": "GREATER",
+        "<": "LESS", "=": "ASSIGN", "!": "NOT",
+    }.items()
+}
+TWO_CHARS = {
+    pair: TOKEN_CODES[token_type] for pair, token_type in {
+        "==": "EQ", ">=": "GREATER_EQ", "<=": "LESS_EQ", "!=": "NOT_EQ", "&&": "AND", "||": "OR",
+    }.items()
+}
+
+# what a token starting with each character can be
+SPACE, NEWLINE, NAME, NUMBER, STRING, SLASH, OPERATOR, SINGLE = range(8)
+CHAR_KINDS = {" ": SPACE, "\t": SPACE, "\n": NEWLINE, '"': STRING, "/": SLASH}
+for c in "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz_":
+    CHAR_KINDS[c] = NAME
+for c in "0123456789":
+    CHAR_KINDS[c] = NUMBER
+for c in "=><!&|":
+    CHAR_KINDS[c] = OPERATOR
+for c in SINGLE_CHARS:
+    CHAR_KINDS.setdefault(c, SINGLE)
+
+# the rest of a name, number or run of newlines (the same patterns as brewlex)
+NAME_RE = re.compile(r"[A-Za-z_][\w_]*")
+NUMBER_RE = re.compile(r"\d+")
+NEWLINES_RE = re.compile(r"\n+")
+
+# The same tables for UTF-8 bytes, indexed by byte. The byte patterns only
+# match ASCII, so tokenize_bytes finishes a name or number that goes on into
+# a non-ASCII character itself.
+BYTE_KINDS = [CHAR_KINDS.get(chr(b)) for b in range(128)] + [None] * 128
+BYTE_VALUES = [chr(b) for b in range(128)]
+RESERVED_BYTE_CODES = {word.encode(): code for word, code in RESERVED_CODES.items()}
+SINGLE_BYTES = {ord(c): code for c, code in SINGLE_CHARS.items()}
+TWO_BYTES = {pair.encode(): (code, pair) for pair, code in TWO_CHARS.items()}
+NAME_BYTES_RE = re.compile(rb"[A-Za-z_]\w*")
+NUMBER_BYTES_RE = re.compile(rb"\d+")
+NEWLINES_BYTES_RE = re.compile(rb"\n+")
+
+
+# the character that starts at data[pos] and the offset after it, for a UTF-8
+# lead byte (one of 0x80 or more)
+def decode_char(data, pos):
+    lead = data[pos]
+    size = 2 if lead < 0xE0 else 3 if lead < 0xF0 else 4
+    return bytes(data[pos:pos + size]).decode("utf-8"), pos + size
+
+
+# the end of the run of characters from pos on that are in ascii_chars or pass
+# test, which is how the str patterns' \w and \d treat non-ASCII characters
+def char_run_end(data, pos, ascii_chars, test):
+    end = len(data)
+    while pos < end:
+        if data[pos] < 0x80:
+            if data[pos] not in ascii_chars:
+                break
+            pos += 1
+        else:
+            c, after = decode_char(data, pos)
+            if not test(c):
+                break
+            pos = after
+    return pos
+
+
+WORD_BYTES = frozenset(b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz_0123456789")
+DIGIT_BYTES = frozenset(b"0123456789")
+
+
+def is_word_char(c):
+    return c.isalnum() or c == "_"
+
+
+class Token:
+    # ply's yacc sets lexer on the token it reports a syntax error at
+    __slots__ = ("type", "value", "lineno", "lexpos", "lexer")
+
+    def __init__(self, type, value, lineno, lexpos):
+        self.type = type
+        self.value = value
+        self.lineno = lineno
+        self.lexpos = lexpos
+
+    def __repr__(self):
+        return f"LexToken({self.type},{self.value!r},{self.lineno},{self.lexpos})"
+
+
+# The tokens of a source as parallel columns instead of one Token per token:
+# token i has kind kinds[i] (a code from TOKEN_CODES), starts at offset
+# offsets[i] on line lines[i], and has value table[values[i]]. Values are
+# interned, so each name, number, string or operator is stored once.
+class TokenBuffer:
+    __slots__ = ("kinds", "offsets", "lines", "values", "table", "interned")
+
+    def __init__(self):
+        self.kinds = array("H")
+        self.offsets = array("I")
+        self.lines = array("I")
+        self.values = array("I")
+        self.table = []
+        self.interned = {}  # value -> index in table
+
+    def append(self, kind, value, lineno, lexpos):
+        index = self.interned.get(value)
+        if index is None:
+            index = self.interned[value] = len(self.table)
+            self.table.append(value)
+        self.kinds.append(kind)
+        self.offsets.append(lexpos)
+        self.lines.append(lineno)
+        self.values.append(index)
+
+    # a buffer of the tokens a lexer with ply's interface (like brewlex.lexer) produces
+    @staticmethod
+    def from_tokens(tokens):
+        buffer = TokenBuffer()
+        for tok in tokens:
+            buffer.append(TOKEN_CODES[tok.type], tok.value, tok.lineno, tok.lexpos)
+        return buffer
+
+    def __len__(self):
+        return len(self.kinds)
+
+    # the value of token i; values tokenize_bytes left as UTF-8 are decoded on first use
+    def value(self, i):
+        value = self.table[self.values[i]]
+        if value.__class__ is bytes:
+            value = self.table[self.values[i]] = value.decode("utf-8")
+        return value
+
+    # decodes every value tokenize_bytes left as UTF-8, each distinct one once,
+    # for a parser that reads the table directly
+    def decode(self):
+        table = self.table
+        for index, value in enumerate(table):
+            if value.__class__ is bytes:
+                table[index] = value.decode("utf-8")
+
+    def token(self, i):
+        return Token(TOKEN_TYPES[self.kinds[i]], self.value(i), self.lines[i], self.offsets[i])
+
+    def __iter__(self):
+        for i in range(len(self.kinds)):
+            yield self.token(i)
+
+
+class Scanner:
+    def __init__(self):
+        self.lineno = 1
+        self.tokens = iter(())
+
+    # like ply, input() doesn't reset lineno
+    def input(self, data):
+        self.tokens = self.scan(data)
+
+    def token(self):
+        return next(self.tokens, None)
+
+    def clone(self):
+        return Scanner()
+
+    def __iter__(self):
+        return self.tokens
+
+    def scan(self, data):
+        return iter(self.tokenize(data))
+
+    # the tokens of data as a TokenBuffer, starting on line self.lineno; data
+    # is a str, or UTF-8 bytes (see tokenize_bytes)
+    def tokenize(self, data):
+        if not isinstance(data, str):
+            return self.tokenize_bytes(data)
+        buffer = TokenBuffer()
+        emit = buffer.append
+        end = len(data)
+        pos = 0
+        lineno = self.lineno
+        kinds = CHAR_KINDS
+        single_chars = SINGLE_CHARS
+        match_name = NAME_RE.match
+        while pos < end:
+            c = data[pos]
+            kind = kinds.get(c)
+            if kind == SPACE:
+                pos += 1
+            elif kind == NAME:
+                value = match_name(data, pos).group()
+                emit(RESERVED_CODES.get(value, NAME_CODE), value, lineno, pos)
+                pos += len(value)
+            elif kind == SINGLE:
+                emit(single_chars[c], c, lineno, pos)
+                pos += 1
+            elif kind == NEWLINE:
+                count = NEWLINES_RE.match(data, pos).end() - pos
+                lineno += count
+                pos += count
+            elif kind == OPERATOR:
+                pair = data[pos:pos + 2]
+                if pair in TWO_CHARS:
+                    emit(TWO_CHARS[pair], pair, lineno, pos)
+                    pos += 2
+                else:
+                    emit(single_chars.get(c, DOT_CODE), c, lineno, pos)
+                    pos += 1
+            elif kind == NUMBER or (kind is None and c.isdecimal()):
+                text = NUMBER_RE.match(data, pos).group()
+                emit(NUMBER_CODE, int(text), lineno, pos)
+                pos += len(text)
+            elif kind == STRING:
+                close = data.find('"', pos + 1)
+                if close == -1 or data.find("\n", pos + 1, close) != -1:
+                    emit(DOT_CODE, c, lineno, pos)
+                    pos += 1
+                else:
+                    emit(STRING_CODE, data[pos + 1:close], lineno, pos)
+                    pos = close + 1
+            elif kind == SLASH:
+                close = data.find("*/", pos + 2) if data.startswith("/*", pos) else -1
+                if close == -1:
+                    emit(single_chars[c], c, lineno, pos)
+                    pos += 1
+                else:
+                    lineno += data.count("\n", pos, close)
+                    pos = close + 2
+            else:
+                emit(DOT_CODE, c, lineno, pos)
+                pos += 1
+        self.lineno = lineno
+        return buffer
+
+    # tokenize for UTF-8 source in a bytes-like object, such as an mmap of a
+    # file, without decoding all of it: names, strings and operators are kept
+    # as bytes in the buffer until their value is asked for. The tokens are
+    # the same as tokenize gives for the decoded source, except that offsets
+    # count bytes rather than characters.
+    def tokenize_bytes(self, data):
+        buffer = TokenBuffer()
+        emit = buffer.append
+        end = len(data)
+        pos = 0
+        lineno = self.lineno
+        kinds = BYTE_KINDS
+        match_name = NAME_BYTES_RE.match
+        while pos < end:
+            b = data[pos]
+            kind = kinds[b]
+            if kind == SPACE:
+                pos += 1
+            elif kind == NAME:
+                name_end = match_name(data, pos).end()
+                if name_end < end and data[name_end] >= 0x80:
+                    name_end = char_run_end(data, name_end, WORD_BYTES, is_word_char)
+                value = data[pos:name_end]
+                emit(RESERVED_BYTE_CODES.get(value, NAME_CODE), value, lineno, pos)
+                pos = name_end
+            elif kind == SINGLE:
+                emit(SINGLE_BYTES[b], BYTE_VALUES[b], lineno, pos)
+                pos += 1
+            elif kind == NEWLINE:
+                count = NEWLINES_BYTES_RE.match(data, pos).end() - pos
+                lineno += count
+                pos += count
+            elif kind == OPERATOR:
+                pair = TWO_BYTES.get(data[pos:pos + 2])
+                if pair is not None:
+                    emit(pair[0], pair[1], lineno, pos)
+                    pos += 2
+                else:
+                    emit(SINGLE_BYTES.get(b, DOT_CODE), BYTE_VALUES[b], lineno, pos)
+                    pos += 1
+            elif kind == NUMBER:
+                number_end = NUMBER_BYTES_RE.match(data, pos).end()
+                if number_end < end and data[number_end] >= 0x80:
+                    number_end = char_run_end(data, number_end, DIGIT_BYTES, str.isdecimal)
+                    emit(NUMBER_CODE, int(bytes(data[pos:number_end]).decode("utf-8")), lineno, pos)
+                else:
+                    emit(NUMBER_CODE, int(data[pos:number_end]), lineno, pos)
+                pos = number_end
+            elif kind == STRING:
+                close = data.find(b'"', pos + 1)
+                if close == -1 or data.find(b"\n", pos + 1, close) != -1:
+                    emit(DOT_CODE, '"', lineno, pos)
+                    pos += 1
+                else:
+                    emit(STRING_CODE, data[pos + 1:close], lineno, pos)
+                    pos = close + 1
+            elif kind == SLASH:
+                close = data.find(b"*/", pos + 2) if data[pos:pos + 2] == b"/*" else -1
+                if close == -1:
+                    emit(SINGLE_BYTES[b], "/", lineno, pos)
+                    pos += 1
+                else:
+                    newline = data.find(b"\n", pos, close)
+                    while newline != -1:
+                        lineno += 1
+                        newline = data.find(b"\n", newline + 1, close)
+                    pos = close + 2
+            elif b < 0x80:
+                emit(DOT_CODE, BYTE_VALUES[b], lineno, pos)
+                pos += 1
+            else:
+                c, after = decode_char(data, pos)
+                if c.isdecimal():
+                    number_end = char_run_end(data, after, DIGIT_BYTES, str.isdecimal)
+                    emit(NUMBER_CODE, int(bytes(data[pos:number_end]).decode("utf-8")), lineno, pos)
+                    pos = number_end
+                else:
+                    emit(DOT_CODE, c, lineno, pos)
+                    pos = after
+        self.lineno = lineno
+        return buffer
+
+
+# python brewscan.py [megabytes]: checks the scanner against the ply lexer on a
+# generated program and compares their throughput, scanning alone and parsing
+if __name__ == "__main__":
+    import sys
+    import time
+    import tracemalloc
+
+    import brewparse
+    from brewlex import lexer
+
+    megabytes = float(sys.argv[1]) if len(sys.argv) > 1 else 4
+    func = """
+/* a comment
+   over two lines */
+func f_{n}(a : int, b : string) : int {{
+  var i : int;
+  for (i = 0; i < a; i = i + 1) {{
+    if (i >= 10 && !(b == "str {n}") || i != a) {{ print(a * (b - i) / 3, "x"); }}
+    else {{ x.y.z = new node; return nil; }}
+  }}
+  return -a;
+}}
+"""
+    chunks = []
+    size = 0
+    n = 0
+    while size < megabytes * 1e6:
+        chunk = func.format(n=n)
+        chunks.append(chunk)
+        size += len(chunk)
+        n += 1
+    source = "".join(chunks) + "\nfunc main() { @ # & | \r \"open\n }\n"
+
+    def ply_tokens(data):
+        ply_lexer = lexer.clone()
+        ply_lexer.lineno = 1
+        ply_lexer.input(data)
+        return list(iter(ply_lexer.token, None))
+
+    def scanner_tokens(data):
+        return list(Scanner().scan(data))
+
+    def fields(tokens):
+        return [(t.type, t.value, t.lineno, t.lexpos) for t in tokens]
+
+    def timed(f, *args):
+        start = time.perf_counter()
+        result = f(*args)
+        return result, time.perf_counter() - start
+
+    def memory(f, *args):
+        tracemalloc.start()
+        result = f(*args)
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del result
+        return size
+
+    def peak_memory(f, *args):
+        tracemalloc.start()
+        f(*args)
+        size = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return size
+
+    expected, ply_time = timed(ply_tokens, source)
+    got, scan_time = timed(scanner_tokens, source)
+    buffer, buffer_time = timed(Scanner().tokenize, source)
+    print(f"{len(source) / 1e6:.1f} MB, {len(got)} tokens, streams match: {fields(got) == fields(expected)}")
+    print(f"ply lexer  {ply_time:.2f} s  {len(source) / 1e6 / ply_time:.1f} MB/s  "
+          f"{memory(ply_tokens, source) / 1e6:.0f} MB of tokens")
+    print(f"scanner    {scan_time:.2f} s  {len(source) / 1e6 / scan_time:.1f} MB/s")
+    print(f"buffer     {buffer_time:.2f} s  {len(source) / 1e6 / buffer_time:.1f} MB/s  "
+          f"{memory(Scanner().tokenize, source) / 1e6:.0f} MB of tokens")
+
+    program = "".join(chunks) + "func main() { print(1); }\n"
+    ply_ast, ply_parse_time = timed(brewparse.Parser().parse, program)
+    scan_ast, scan_parse_time = timed(brewparse.Parser(Scanner()).parse, program)
+    pratt_ast, pratt_parse_time = timed(brewparse.new_parser("pratt").parse, program)
+    print(f"LALR parse with ply lexer {ply_parse_time:.2f} s, with scanner {scan_parse_time:.2f} s; "
+          f"pratt parse from a buffer {pratt_parse_time:.2f} s; "
+          f"same tree: {str(ply_ast) == str(scan_ast) == str(pratt_ast)}")
+
+    # lexing and parsing a file from its memory-mapped bytes against reading it into a str
+    import gc
+    import mmap
+    import os
+    import tempfile
+
+    del expected, got, buffer, ply_ast, scan_ast, pratt_ast
+
+    # the best of a few runs, each with the garbage collected first: a full
+    # collection set off by the last run's tree is otherwise charged to
+    # whichever run comes next
+    def best_time(f, *args):
+        times = []
+        for _ in range(3):
+            gc.collect()
+            start = time.perf_counter()
+            result = f(*args)
+            times.append(time.perf_counter() - start)
+            del result
+        return min(times)
+
+    with tempfile.NamedTemporaryFile("w", suffix=".br", delete=False, encoding="utf-8") as f:
+        f.write(program)
+    try:
+        bytes_buffer, bytes_time = timed(Scanner().tokenize, program.encode())
+        same = [(t.type, t.value, t.lineno) for t in bytes_buffer] == \
+            [(t.type, t.value, t.lineno) for t in Scanner().tokenize(program)]
+        print(f"bytes      {bytes_time:.2f} s  {len(program) / 1e6 / bytes_time:.1f} MB/s  "
+              f"same tokens: {same}")
+        del bytes_buffer
+
+        def read_and_tokenize(path):
+            with open(path, encoding="utf-8") as source_file:
+                return Scanner().tokenize(source_file.read())
+
+        def map_and_tokenize(path):
+            with open(path, "rb") as source_file:
+                with mmap.mmap(source_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    return Scanner().tokenize(data)
+
+        print(f"tokens only: read + tokenize {best_time(read_and_tokenize, f.name):.2f} s  "
+              f"peak {peak_memory(read_and_tokenize, f.name) / 1e6:.1f} MB; "
+              f"mmap + tokenize {best_time(map_and_tokenize, f.name):.2f} s  "
+              f"peak {peak_memory(map_and_tokenize, f.name) / 1e6:.1f} MB")
+
+        def read_and_parse(path, parser):
+            with open(path, encoding="utf-8") as source_file:
+                return brewparse.parse_program(source_file.read(), parser=parser)
+
+        for parser in brewparse.PARSERS:
+            same = str(read_and_parse(f.name, parser)) == str(brewparse.parse_file(f.name, parser))
+            print(f"{parser:5} read + parse {best_time(read_and_parse, f.name, parser):.2f} s  "
+                  f"peak {peak_memory(read_and_parse, f.name, parser) / 1e6:.1f} MB; "
+                  f"parse_file {best_time(brewparse.parse_file, f.name, parser):.2f} s  "
+                  f"peak {peak_memory(brewparse.parse_file, f.name, parser) / 1e6:.1f} MB; "
+                  f"same tree: {same}")
+    finally:
+        os.unlink(f.name)
@@ -0,0 +1,329 @@
+from intbase import InterpreterBase
+from runtimev3 import Runtime
+from type_valuev3 import Type, Value, bool_value, create_value_from_type, int_value
+
+# Opcodes. Each instruction is an opcode in CodeObject.ops plus one operand in
+# CodeObject.args (None when the opcode doesn't need one).
+LOAD_VAR = 0  # (name, slot)
+STORE_VAR = 1  # (name, slot)
+PUSH_INT = 2  # int
+PUSH_STRING = 3  # str
+PUSH_BOOL = 4  # bool
+PUSH_NIL = 5
+BINARY_OP = 6  # (oper, function from Runtime.make_binary_op)
+NEG = 7
+NOT = 8
+NEW = 9  # struct name
+JUMP = 10  # target pc
+JUMP_IF_FALSE = 11  # (target pc, "if" | "for")
+PUSH_BLOCK = 12  # layout
+POP_BLOCK = 13
+VAR_DEF = 14  # (name, type)
+RESOLVE = 15  # (name, num args): pushes a call record for the callee
+BIND_ARG = 16  # (arg index, the call node's alias_args flag): pops a value into the call record below it
+CALL = 17
+RETURN = 18  # the return node's copy flag
+RETURN_NIL = 19  # "return;"
+RETURN_END = 20  # falling off the end of a function body
+POP = 21
+PRINT_START = 22
+PRINT_ARG = 23
+PRINT_END = 24
+INPUT = 25  # (name, has prompt)
+INPUT_ERROR = 26  # num args
+TRACE = 27  # statement AST
+INC_VAR = 28  # (name, slot, int, add function): fused "name = name + int"
+RESOLVED = 29  # CodeObject: what a RESOLVE becomes once it has found its callee
+
+OPCODE_NAMES = {
+    value: name for name, value in list(globals().items()) if name.isupper() and isinstance(value, int)
+}
+
+
+# The bytecode for one Brewin function
+class CodeObject:
+    def __init__(self, func_ast, coerce_return):
+        self.name = func_ast.get("name")
+        self.formal_names = [arg.get("name") for arg in func_ast.get("args")]
+        self.layout = func_ast.get("layout")
+        self.formal_types = [arg.get("var_type") for arg in func_ast.get("args")]
+        self.copy_args = func_ast.get("copy_args")
+        self.return_type = func_ast.get("return_type")
+        self.coerce_return = coerce_return  # Runtime.return_coercion of the return type
+        self.ops = []
+        self.args = []
+
+    def emit(self, op, arg=None):
+        self.ops.append(op)
+        self.args.append(arg)
+        return len(self.ops) - 1
+
+    def patch(self, pc, arg):
+        self.args[pc] = arg
+
+    def here(self):
+        return len(self.ops)
+
+    def disassemble(self):
+        lines = [f"{self.name}/{len(self.formal_names)}:"]
+        for pc, (op, arg) in enumerate(zip(self.ops, self.args)):
+            lines.append(f"{pc:5} {OPCODE_NAMES[op]:<14} {'' if arg is None else arg}")
+        return "\n".join(lines)
+
+    def __repr__(self):
+        return f"{self.name}/{len(self.formal_names)}"
+
+
+# Lowers function ASTs to CodeObjects
+class BytecodeCompiler:
+    def __init__(self, runtime, trace_output=False):
+        self.runtime = runtime
+        self.trace_output = trace_output
+
+    def compile_func(self, func_ast):
+        code = CodeObject(func_ast, self.runtime.return_coercion(func_ast.get("return_type")))
+        self.__compile_block(code, func_ast.get("statements"), func_ast.get("body_layout"))
+        code.emit(RETURN_END)
+        return code
+
+    def __compile_block(self, code, statements, layout):
+        code.emit(PUSH_BLOCK, layout)
+        for statement in statements:
+            if self.trace_output:
+                code.emit(TRACE, statement)
+            self.__compile_statement(code, statement)
+        code.emit(POP_BLOCK)
+
+    def __compile_statement(self, code, statement):
+        kind = statement.elem_type
+        if kind == InterpreterBase.FCALL_NODE:
+            self.__compile_expr(code, statement)
+            code.emit(POP)
+        elif kind == "=":
+            self.__compile_assign(code, statement)
+        elif kind == InterpreterBase.VAR_DEF_NODE:
+            code.emit(VAR_DEF, (statement.get("name"), statement.get("var_type")))
+        elif kind == InterpreterBase.RETURN_NODE:
+            expr_ast = statement.get("expression")
+            if expr_ast is None:
+                code.emit(RETURN_NIL)
+            else:
+                self.__compile_expr(code, expr_ast)
+                code.emit(RETURN, statement.get("copy"))
+        elif kind == InterpreterBase.IF_NODE:
+            self.__compile_expr(code, statement.get("condition"))
+            jump_else = code.emit(JUMP_IF_FALSE)
+            self.__compile_block(code, statement.get("statements"), statement.get("layout"))
+            else_statements = statement.get("else_statements")
+            if else_statements is None:
+                code.patch(jump_else, (code.here(), InterpreterBase.IF_NODE))
+            else:
+                jump_end = code.emit(JUMP)
+                code.patch(jump_else, (code.here(), InterpreterBase.IF_NODE))
+                self.__compile_block(code, else_statements, statement.get("else_layout"))
+                code.patch(jump_end, code.here())
+        elif kind == InterpreterBase.FOR_NODE:
+            self.__compile_assign(code, statement.get("init"))
+            loop_start = code.here()
+            self.__compile_expr(code, statement.get("condition"))
+            jump_end = code.emit(JUMP_IF_FALSE)
+            self.__compile_block(code, statement.get("statements"), statement.get("layout"))
+            self.__compile_assign(code, statement.get("update"))
+            code.emit(JUMP, loop_start)
+            code.patch(jump_end, (code.here(), InterpreterBase.FOR_NODE))
+        # any other statement (e.g. a bare expression) is ignored, as in the tree walker
+
+    def __compile_assign(self, code, assign_ast):
+        var_name = assign_ast.get("name")
+        slot = assign_ast.get("slot")
+        expr_ast = assign_ast.get("expression")
+        # fuse "name = name + <int>" into a single instruction
+        if expr_ast.elem_type == "+":
+            op1 = expr_ast.get("op1")
+            op2 = expr_ast.get("op2")
+            if op1.elem_type == InterpreterBase.VAR_NODE and op1.get("name") == var_name \
+                    and op2.elem_type == InterpreterBase.INT_NODE:
+                code.emit(INC_VAR, (var_name, slot, op2.get("val"), self.runtime.make_binary_op("+")))
+                return
+        self.__compile_expr(code, expr_ast)
+        code.emit(STORE_VAR, (var_name, slot))
+
+    def __compile_expr(self, code, expr_ast):
+        kind = expr_ast.elem_type
+        if kind == InterpreterBase.NIL_NODE:
+            code.emit(PUSH_NIL)
+        elif kind == InterpreterBase.INT_NODE:
+            code.emit(PUSH_INT, expr_ast.get("val"))
+        elif kind == InterpreterBase.STRING_NODE:
+            code.emit(PUSH_STRING, expr_ast.get("val"))
+        elif kind == InterpreterBase.BOOL_NODE:
+            code.emit(PUSH_BOOL, expr_ast.get("val"))
+        elif kind == InterpreterBase.VAR_NODE:
+            code.emit(LOAD_VAR, (expr_ast.get("name"), expr_ast.get("slot")))
+        elif kind == InterpreterBase.FCALL_NODE:
+            self.__compile_call(code, expr_ast.get("name"), expr_ast.get("args"), expr_ast.get("alias_args"))
+        elif kind in self.runtime.interpreter.BIN_OPS:
+            self.__compile_expr(code, expr_ast.get("op1"))
+            self.__compile_expr(code, expr_ast.get("op2"))
+            code.emit(BINARY_OP, (kind, self.runtime.make_binary_op(kind)))
+        elif kind == InterpreterBase.NEG_NODE:
+            self.__compile_expr(code, expr_ast.get("op1"))
+            code.emit(NEG)
+        elif kind == InterpreterBase.NOT_NODE:
+            self.__compile_expr(code, expr_ast.get("op1"))
+            code.emit(NOT)
+        elif kind == InterpreterBase.NEW_NODE:
+            code.emit(NEW, expr_ast.get("var_type"))
+
+    def __compile_call(self, code, func_name, actual_args, alias_args=()):
+        if func_name == "print":
+            code.emit(PRINT_START)
+            for arg in actual_args:
+                self.__compile_expr(code, arg)
+                code.emit(PRINT_ARG)
+            code.emit(PRINT_END)
+        elif func_name == "inputi" or func_name == "inputs":
+            if len(actual_args) > 1:
+                code.emit(INPUT_ERROR, len(actual_args))
+                return
+            for arg in actual_args:
+                self.__compile_expr(code, arg)
+            code.emit(INPUT, (func_name, len(actual_args) == 1))
+        else:
+            code.emit(RESOLVE, (func_name, len(actual_args)))
+            for index, arg in enumerate(actual_args):
+                self.__compile_expr(code, arg)
+                code.emit(BIND_ARG, (index, alias_args[index]))
+            code.emit(CALL)
+
+
+# Runs CodeObjects with an explicit operand stack and call stack, so neither
+# expression evaluation nor Brewin function calls recurse in python
+class VM:
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.runtime = Runtime(interpreter)
+        self.env = interpreter.env
+        self.compiler = BytecodeCompiler(self.runtime, interpreter.trace_output)
+        self.code_objects = {}  # id(func_ast) -> CodeObject
+
+    def get_code(self, name, num_params):
+        func_ast = self.runtime.get_func_by_name(name, num_params)
+        code = self.code_objects.get(id(func_ast))
+        if code is None:
+            code = self.compiler.compile_func(func_ast)
+            self.code_objects[id(func_ast)] = code
+        return code
+
+    def run(self):
+        runtime = self.runtime
+        env = self.env
+        nil_value = runtime.nil_value
+        print_result = runtime.print_result
+        get_var = runtime.get_var
+        assign = runtime.assign
+
+        stack = []
+        frames = []  # (code, pc) of each caller
+        code = self.get_code("main", 0)
+        env.push_func(code.layout)
+        ops = code.ops
+        args = code.args
+        pc = 0
+        while True:
+            op = ops[pc]
+            arg = args[pc]
+            pc += 1
+            if op == LOAD_VAR:
+                stack.append(get_var(arg[0], arg[1]))
+            elif op == PUSH_INT:
+                stack.append(int_value(arg))
+            elif op == BINARY_OP:
+                right = stack.pop()
+                stack[-1] = arg[1](stack[-1], right)
+            elif op == STORE_VAR:
+                assign(arg[0], stack.pop(), arg[1])
+            elif op == INC_VAR:
+                name, slot, increment, add = arg
+                assign(name, add(get_var(name, slot), int_value(increment)), slot)
+            elif op == JUMP_IF_FALSE:
+                if not runtime.condition(stack.pop(), arg[1]):
+                    pc = arg[0]
+            elif op == JUMP:
+                pc = arg
+            elif op == PUSH_BLOCK:
+                env.push_block(arg)
+            elif op == POP_BLOCK:
+                env.pop_block()
+            elif op == RESOLVED:
+                stack.append((arg, {}))
+            elif op == RESOLVE:
+                # the function table doesn't change during a run, so the call
+                # site can keep its callee: the op becomes a RESOLVED of it
+                callee = self.get_code(arg[0], arg[1])
+                ops[pc - 1] = RESOLVED
+                args[pc - 1] = callee
+                stack.append((callee, {}))
+            elif op == BIND_ARG:
+                value = stack.pop()
+                callee, bound = stack[-1]
+                index, alias = arg
+                bound[callee.formal_names[index]] = runtime.bind_arg(callee.formal_types[index], value,
+                                                                     alias and callee.copy_args[index])
+            elif op == CALL:
+                callee, bound = stack.pop()
+                env.push_func(callee.layout)
+                for arg_name, value in bound.items():
+                    env.create(arg_name, value)
+                frames.append((code, pc))
+                code = callee
+                ops = code.ops
+                args = code.args
+                pc = 0
+            elif op == RETURN or op == RETURN_NIL or op == RETURN_END:
+                if op == RETURN:
+                    return_val = runtime.return_value(stack.pop(), arg)
+                elif op == RETURN_NIL:
+                    return_val = create_value_from_type(Type.NIL)
+                else:
+                    return_val = nil_value
+                env.pop_func()
+                return_val = code.coerce_return(return_val)
+                if not frames:
+                    return
+                code, pc = frames.pop()
+                ops = code.ops
+                args = code.args
+                stack.append(return_val)
+            elif op == POP:
+                stack.pop()
+            elif op == PUSH_STRING:
+                stack.append(Value(Type.STRING, arg))
+            elif op == PUSH_BOOL:
+                stack.append(bool_value(arg))
+            elif op == PUSH_NIL:
+                stack.append(nil_value)
+            elif op == NEG:
+                stack[-1] = runtime.neg(stack[-1])
+            elif op == NOT:
+                stack[-1] = runtime.logical_not(stack[-1])
+            elif op == NEW:
+                stack.append(runtime.new_struct(arg))
+            elif op == VAR_DEF:
+                runtime.var_def(arg[0], arg[1])
+            elif op == PRINT_START:
+                stack.append([])
+            elif op == PRINT_ARG:
+                value = stack.pop()
+                stack[-1].append(runtime.printable(value))
+            elif op == PRINT_END:
+                self.interpreter.output("".join(stack.pop()))
+                stack.append(print_result)
+            elif op == INPUT:
+                name, has_prompt = arg
+                prompt = stack.pop() if has_prompt else None
+                stack.append(runtime.read_input(name, prompt))
+            elif op == INPUT_ERROR:
+                runtime.check_input_args(arg)
+            elif op == TRACE:
+                print(arg)
@@ -0,0 +1,258 @@
+from intbase import InterpreterBase
+from runtimev3 import Runtime
+from type_valuev3 import SharedValue, Type, Value, create_value_from_type
+
+
+# A compiled Brewin function: the closure for its body plus everything a call
+# needs to know about the function, read once from the AST
+class CompiledFunc:
+    def __init__(self, func_ast, body, coerce_return):
+        self.name = func_ast.get("name")
+        self.formal_names = [arg.get("name") for arg in func_ast.get("args")]
+        self.layout = func_ast.get("layout")
+        self.formal_types = [arg.get("var_type") for arg in func_ast.get("args")]
+        self.copy_args = func_ast.get("copy_args")
+        self.return_type = func_ast.get("return_type")
+        self.coerce_return = coerce_return  # Runtime.return_coercion of the return type
+        self.body = body
+
+
+# Turns the AST into a tree of nested python closures, once per function, and
+# runs them. Every AST attribute is read at compile time, so running a closure
+# never compares node kinds or looks anything up on an Element.
+#
+# Statement closures return None to continue, or the Value being returned.
+# Expression closures return a Value.
+class ClosureCompiler:
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.trace_output = interpreter.trace_output
+        self.runtime = Runtime(interpreter)
+        self.env = interpreter.env
+        self.compiled_funcs = {}  # id(func_ast) -> CompiledFunc
+
+    def run(self):
+        self.__compile_call("main", [])()
+
+    def get_compiled_func(self, name, num_params):
+        func_ast = self.runtime.get_func_by_name(name, num_params)
+        compiled = self.compiled_funcs.get(id(func_ast))
+        if compiled is None:
+            compiled = CompiledFunc(func_ast, None, self.runtime.return_coercion(func_ast.get("return_type")))
+            self.compiled_funcs[id(func_ast)] = compiled
+            compiled.body = self.__compile_block(func_ast.get("statements"), func_ast.get("body_layout"))
+        return compiled
+
+    def __compile_block(self, statements, layout):
+        env = self.env
+        compiled = tuple(self.__compile_statement(s) for s in statements)
+        if self.trace_output:
+            compiled = tuple(self.__traced(s, c) for s, c in zip(statements, compiled))
+
+        def run_block():
+            env.push_block(layout)
+            for statement in compiled:
+                return_val = statement()
+                if return_val is not None:
+                    env.pop_block()
+                    return return_val
+            env.pop_block()
+            return None
+
+        return run_block
+
+    def __traced(self, statement_ast, statement):
+        def run_traced():
+            print(statement_ast)
+            return statement()
+
+        return run_traced
+
+    def __compile_statement(self, statement):
+        kind = statement.elem_type
+        if kind == InterpreterBase.FCALL_NODE:
+            call = self.__compile_expr(statement)
+
+            def run_call():
+                call()
+
+            return run_call
+        if kind == "=":
+            return self.__compile_assign(statement)
+        if kind == InterpreterBase.VAR_DEF_NODE:
+            var_def = self.runtime.var_def
+            var_name = statement.get("name")
+            var_type = statement.get("var_type")
+
+            def run_var_def():
+                var_def(var_name, var_type)
+
+            return run_var_def
+        if kind == InterpreterBase.RETURN_NODE:
+            return self.__compile_return(statement)
+        if kind == InterpreterBase.IF_NODE:
+            return self.__compile_if(statement)
+        if kind == InterpreterBase.FOR_NODE:
+            return self.__compile_for(statement)
+
+        # the tree walker ignores any other statement (e.g. a bare expression)
+        def run_nothing():
+            return None
+
+        return run_nothing
+
+    def __compile_assign(self, assign_ast):
+        assign = self.runtime.assign
+        var_name = assign_ast.get("name")
+        slot = assign_ast.get("slot")
+        expr = self.__compile_expr(assign_ast.get("expression"))
+
+        def run_assign():
+            assign(var_name, expr(), slot)
+
+        return run_assign
+
+    def __compile_return(self, return_ast):
+        expr_ast = return_ast.get("expression")
+        if expr_ast is None:
+            def run_return_nil():
+                return create_value_from_type(Type.NIL)
+
+            return run_return_nil
+        return_value = self.runtime.return_value
+        expr = self.__compile_expr(expr_ast)
+        shared = return_ast.get("copy")
+
+        def run_return():
+            return return_value(expr(), shared)
+
+        return run_return
+
+    def __compile_if(self, if_ast):
+        condition = self.runtime.condition
+        cond = self.__compile_expr(if_ast.get("condition"))
+        then_block = self.__compile_block(if_ast.get("statements"), if_ast.get("layout"))
+        else_statements = if_ast.get("else_statements")
+        if else_statements is None:
+            def run_if():
+                if condition(cond(), InterpreterBase.IF_NODE):
+                    return then_block()
+                return None
+
+            return run_if
+        else_block = self.__compile_block(else_statements, if_ast.get("else_layout"))
+
+        def run_if_else():
+            if condition(cond(), InterpreterBase.IF_NODE):
+                return then_block()
+            return else_block()
+
+        return run_if_else
+
+    def __compile_for(self, for_ast):
+        condition = self.runtime.condition
+        init = self.__compile_assign(for_ast.get("init"))
+        cond = self.__compile_expr(for_ast.get("condition"))
+        update = self.__compile_assign(for_ast.get("update"))
+        body = self.__compile_block(for_ast.get("statements"), for_ast.get("layout"))
+
+        def run_for():
+            init()
+            while condition(cond(), InterpreterBase.FOR_NODE):
+                return_val = body()
+                if return_val is not None:
+                    return return_val
+                update()
+            return None
+
+        return run_for
+
+    def __compile_expr(self, expr_ast):
+        kind = expr_ast.elem_type
+        if kind == InterpreterBase.NIL_NODE:
+            nil_value = self.runtime.nil_value
+            return lambda: nil_value
+        # a literal evaluates to the same shared value every time
+        if kind == InterpreterBase.INT_NODE:
+            value = SharedValue(Type.INT, expr_ast.get("val"))
+            return lambda: value
+        if kind == InterpreterBase.STRING_NODE:
+            value = SharedValue(Type.STRING, expr_ast.get("val"))
+            return lambda: value
+        if kind == InterpreterBase.BOOL_NODE:
+            value = SharedValue(Type.BOOL, expr_ast.get("val"))
+            return lambda: value
+        if kind == InterpreterBase.VAR_NODE:
+            var_name = expr_ast.get("name")
+            slot = expr_ast.get("slot")
+            if slot is not None and "." not in var_name:
+                # a plain variable the resolver found can always be read directly
+                get = self.env.get
+                return lambda: get(var_name, slot)
+            get_var = self.runtime.get_var
+            return lambda: get_var(var_name, slot)
+        if kind == InterpreterBase.FCALL_NODE:
+            return self.__compile_call(expr_ast.get("name"), expr_ast.get("args"), expr_ast.get("alias_args"))
+        if kind in self.interpreter.BIN_OPS:
+            binary_op = self.runtime.make_binary_op(kind)
+            left = self.__compile_expr(expr_ast.get("op1"))
+            right = self.__compile_expr(expr_ast.get("op2"))
+            return lambda: binary_op(left(), right())
+        if kind == InterpreterBase.NEG_NODE:
+            neg = self.runtime.neg
+            op1 = self.__compile_expr(expr_ast.get("op1"))
+            return lambda: neg(op1())
+        if kind == InterpreterBase.NOT_NODE:
+            logical_not = self.runtime.logical_not
+            op1 = self.__compile_expr(expr_ast.get("op1"))
+            return lambda: logical_not(op1())
+        if kind == InterpreterBase.NEW_NODE:
+            new_struct = self.runtime.new_struct
+            struct_name = expr_ast.get("var_type")
+            return lambda: new_struct(struct_name)
+        return lambda: None
+
+    def __compile_call(self, func_name, actual_args, alias_args=()):
+        runtime = self.runtime
+        args = tuple(self.__compile_expr(arg) for arg in actual_args)
+        if func_name == "print":
+            print_values = runtime.print_values
+            return lambda: print_values(arg() for arg in args)
+        if func_name == "inputi" or func_name == "inputs":
+            read_input = runtime.read_input
+            if len(args) == 0:
+                return lambda: read_input(func_name)
+            if len(args) == 1:
+                prompt = args[0]
+                return lambda: read_input(func_name, prompt())
+            check_input_args = runtime.check_input_args
+            return lambda: check_input_args(len(args))
+
+        env = self.env
+        bind_arg = runtime.bind_arg
+        get_compiled_func = self.get_compiled_func
+        nil_value = runtime.nil_value
+        num_args = len(args)
+        # the function this call calls and which of its arguments to copy, found
+        # on its first call; the function table doesn't change during a run
+        target = None
+
+        def run_call():
+            nonlocal target
+            if target is None:
+                func = get_compiled_func(func_name, num_args)
+                target = (func, tuple(bool(alias and copy_arg) for alias, copy_arg in zip(alias_args, func.copy_args)))
+            func, shared_args = target
+            bound = {}
+            for arg_name, arg_type, shared, arg in zip(func.formal_names, func.formal_types, shared_args, args):
+                bound[arg_name] = bind_arg(arg_type, arg(), shared)
+            env.push_func(func.layout)
+            for arg_name, value in bound.items():
+                env.create(arg_name, value)
+            return_val = func.body()
+            env.pop_func()
+            if return_val is None:
+                return_val = nil_value
+            return func.coerce_return(return_val)
+
+        return run_call
@@ -1,3 +1,6 @@
+import sys
+
+
 class Element:
     def __init__(self, elem_type, **kwargs):
         self.elem_type = elem_type
@@ -10,20 +13,119 @@ class Element:
             return None
         return self.dict[key]
 
+    def set(self, key, value):
+        self.dict[key] = value
+
     def __str__(self):
-        s = f"{self.elem_type}: "
-        for key, value in self.dict.items():
-            s += key + ": " + self.__val(value) + ", "
-        return s[0:-2]
-
-    def __val(self, v):
-        if isinstance(v, Element):
-            return "[" + str(v) + "]"
-        if isinstance(v, list):
-            s = ""
-            for i in v:
-                s += str(i) + ", "
-            if len(s) > 0:
-                return "[" + s[0:-2] + "]"
-            return "[" + s + "]"
-        return str(v)
+        return format_node(self.elem_type, self.dict.items())
+
+
+def format_node(elem_type, items):
+    s = f"{elem_type}: "
+    for key, value in items:
+        s += key + ": " + format_value(value) + ", "
+    return s[0:-2]
+
+
+def format_value(v):
+    if isinstance(v, (Element, Node)):
+        return "[" + str(v) + "]"
+    if isinstance(v, list):
+        s = ""
+        for i in v:
+            s += str(i) + ", "
+        if len(s) > 0:
+            return "[" + s[0:-2] + "]"
+        return "[" + s + "]"
+    return str(v)
+
+
+# Base of the typed AST nodes that brewparse generates with node_class. A node
+# keeps its syntax fields, and the annotations later passes attach to it, in
+# __slots__ instead of a per-instance dict; get(), set() and elem_type work as
+# they do for Element.
+class Node:
+    __slots__ = ()
+    _fields = ()
+    _annotations = ()
+
+    def get(self, key):
+        return getattr(self, key, None)
+
+    def set(self, key, value):
+        setattr(self, key, value)
+
+    # a snapshot of the fields and the annotations that have been set; annotate with set()
+    @property
+    def dict(self):
+        d = {key: getattr(self, key) for key in self._fields}
+        for key in self._annotations:
+            if getattr(self, key) is not None:
+                d[key] = getattr(self, key)
+        return d
+
+    def __str__(self):
+        return format_node(self.elem_type, self.dict.items())
+
+
+# Generates the node class for one node kind, with an __init__ that takes the
+# fields positionally. elem_type None means the kind varies between nodes of the
+# class (the binary operators) and is the first constructor argument.
+# kind_codes maps each elem_type to the small integer stored as node.kind.
+# module is the module the class will be a global of, so nodes can be pickled.
+def node_class(class_name, elem_type, fields, annotations, kind_codes, module):
+    if elem_type is not None:
+        params = fields
+        lines = [f"def __init__(self, {', '.join(params)}):" if params else "def __init__(self):"]
+    else:
+        params = ("elem_type", "kind") + fields
+        lines = [f"def __init__(self, {', '.join(('elem_type',) + fields)}):", "    self.kind = kind_codes[elem_type]"]
+    lines += [f"    self.{name} = {name}" for name in params if name != "kind"]
+    lines += [f"    self.{name} = None" for name in annotations]
+    if len(lines) == 1:
+        lines.append("    pass")
+    namespace = {"kind_codes": kind_codes}
+    exec("\n".join(lines), namespace)
+    attrs = {
+        "__slots__": params + annotations,
+        "__init__": namespace["__init__"],
+        "__module__": module,
+        "_fields": fields,
+        "_annotations": annotations,
+    }
+    if elem_type is not None:
+        attrs["elem_type"] = elem_type
+        attrs["kind"] = kind_codes[elem_type]
+    return type(class_name, (Node,), attrs)
+
+
+# The attribute a struct value keeps field name in (see
+# type_valuev3.struct_class). The prefix keeps field names from clashing with
+# python keywords and the attributes every object has; interning the result
+# lets attribute lookups with it hit the type's cache.
+def field_slot(name):
+    return sys.intern("f_" + name)
+
+
+# The name in a struct field access such as a.b.c. It is still the dotted
+# string, so it prints and compares as before, but the parser has already split
+# it into the base variable and a tuple of field names, and slots holds the
+# field_slot of each field name.
+class FieldPath(str):
+    def __new__(cls, base, fields):
+        path = super().__new__(cls, ".".join((base,) + fields))
+        path.base = base
+        path.fields = fields
+        path.slots = tuple(field_slot(name) for name in fields)
+        return path
+
+    def __getnewargs__(self):
+        return (self.base, self.fields)
+
+    # (base, fields) of any variable name, dotted or not
+    @staticmethod
+    def split(symbol):
+        if isinstance(symbol, FieldPath):
+            return symbol.base, symbol.fields
+        names = symbol.split(".")
+        return names[0], tuple(names[1:])
@@ -1,9 +1,22 @@
 from enum import Enum
+from element import FieldPath, field_slot
+from type_valuev3 import SharedValue, Struct, unshared
 class VariableError(Enum):
     TYPE_ERROR = 1
     NAME_ERROR = 2
     FAULT_ERROR = 3
     DEBUG_ERROR = 4
+
+# Each function's environment is a list of blocks, outermost (the parameters) first.
+# A block is a list: block[0] is its layout, a dict mapping each variable name to
+# its slot, and the variables' values follow in the order they were defined.
+# Layouts come from resolverv3.Resolver and are shared by every activation of a
+# block; variables whose names don't appear in the layout get a private one.
+# The resolver also gives each variable reference its (block depth, slot), so
+# get/set with a slot go straight to the value, without searching the blocks.
+# Every variable and field holds a Value of its own: create and set store a copy
+# of a type_valuev3.SharedValue, and get gives a field still holding its shared
+# default a copy of its own.
 class EnvironmentManager:
     def __init__(self):
         self.environment = []
@@ -11,158 +24,248 @@ class EnvironmentManager:
     def reset_env(self):
         self.environment = []
 
+    # returns the slot of symbol in block if it has been defined there, or None
+    @staticmethod
+    def __slot(block, symbol):
+        layout = block[0]
+        if layout is None:
+            return None
+        slot = layout.get(symbol)
+        if slot is not None and slot < len(block):
+            return slot
+        return None
+
     # We can define an error object here
 
     """
     1. Get variable from top level environment
     2. Get variable from strcut (the variable is defined in the struct)
     3. Get variable from struct in struct ... (here, the variable IS DEFINED IN THE STRUCT, no top level varialb)
-    
+
     Fault error if the field is not found, name error if the struct is not initalized?
     """
-    # TODO: need to re-write this for struct of structs
 
-    def get(self, symbol):
+    # slot, if given, is the (block depth, slot) of the variable symbol starts with.
+    # Dotted names come from the parser as FieldPaths, so field accesses walk the
+    # already split field names.
+    def get(self, symbol, slot=None):
+        if slot is None:
+            return self.__get(symbol)
+        value = self.environment[-1][slot[0]][slot[1]]
+        if symbol.__class__ is not FieldPath:
+            return value
+        for slot_name in symbol.slots:
+            struct = value.value()
+            if not isinstance(struct, Struct):
+                if struct is None:
+                    return VariableError.FAULT_ERROR
+                return VariableError.TYPE_ERROR
+            elif not struct.fields:
+                return VariableError.FAULT_ERROR
+            value = getattr(struct, slot_name, None)
+            if value is None:
+                # missing fields make the search go on through outer blocks
+                return self.__get(symbol)
+        if value.__class__ is SharedValue:
+            return self.__own_default(struct, slot_name, value)
+        return value
+
+    # A new struct's fields hold shared defaults (type_valuev3.struct_defaults)
+    # until they are assigned; one that is read first gets a Value of its own
+    # then, so every read after gives that same Value, as after an assignment.
+    @staticmethod
+    def __own_default(struct, slot_name, value):
+        if not struct.keeps_defaults:
+            return value
+        value = unshared(value)
+        setattr(struct, slot_name, value)
+        return value
+
+    def __get(self, symbol):
         cur_func_env = self.environment[-1]
-        var_name = symbol.split(".")
+        struct_name, field_names = FieldPath.split(symbol)
         # 1. This is just a variable in a top level environment
-        if len(var_name) == 0:
-            print("ERROR!", symbol)
-        elif len(var_name) == 1:
+        if len(field_names) == 0:
             for env in reversed(cur_func_env):
-                if symbol in env:
-                    return env[symbol]
+                slot = self.__slot(env, symbol)
+                if slot is not None:
+                    return env[slot]
             return VariableError.NAME_ERROR
-        
+
         # 2. This is a variable in a struct
-        elif len(var_name) == 2:
-            struct_name = var_name[0]
-            field_name = var_name[1]
+        elif len(field_names) == 1:
+            field_name = field_names[0]
             for env in reversed(cur_func_env):
-                if struct_name in env:
-                    struct = env[struct_name]
+                slot = self.__slot(env, struct_name)
+                if slot is not None:
+                    struct = env[slot]
                     struct = struct.value()
-                    if not isinstance(struct, dict):
+                    if not isinstance(struct, Struct):
                         if struct is None:
                             return VariableError.FAULT_ERROR
                         else:
                             return VariableError.TYPE_ERROR
-                    elif struct == {}: # this happens
+                    elif not struct.fields: # this happens
                         return VariableError.FAULT_ERROR
-                    if field_name in struct:
-                        return struct[field_name]
+                    slot_name = field_slot(field_name)
+                    value = getattr(struct, slot_name, None)
+                    if value is not None:
+                        if value.__class__ is SharedValue:
+                            return self.__own_default(struct, slot_name, value)
+                        return value
             return VariableError.NAME_ERROR
         else:
-            struct_name = var_name[0]
-            field_name = var_name[1]
+            last = len(field_names) - 1
             # Find the struct in the environment
             for env in reversed(cur_func_env):
                 # we found the struct, so let's find the field now
-                if struct_name in env:
-                    struct = env[struct_name].value()
-                    var_name.pop(0)
-                    while len(var_name) >= 1:
-                        if not isinstance(struct, dict):
+                slot = self.__slot(env, struct_name)
+                if slot is not None:
+                    struct = env[slot].value()
+                    i = 0
+                    while i <= last:
+                        if not isinstance(struct, Struct):
                             if struct is None:
                                 return VariableError.FAULT_ERROR
                             else:
                                 return VariableError.TYPE_ERROR
-                        elif struct == {}:
+                        elif not struct.fields:
                             return VariableError.FAULT_ERROR
-                        if field_name in struct:
-                            value = struct[field_name]
-                            if len(var_name) == 1:
+                        slot_name = field_slot(field_names[i])
+                        value = getattr(struct, slot_name, None)
+                        if value is not None:
+                            if i == last:
+                                if value.__class__ is SharedValue:
+                                    return self.__own_default(struct, slot_name, value)
                                 return value
                             struct = value.value()
-                            var_name.pop(0)
-                            field_name = var_name[0]
+                            i += 1
             return VariableError.NAME_ERROR
 
 
 
-    def set(self, symbol, value):
+    # slot, if given, is the (block depth, slot) of the variable symbol starts with
+    def set(self, symbol, value, slot=None):
+        if value.__class__ is SharedValue:
+            value = unshared(value)
+        if slot is None:
+            return self.__set(symbol, value)
+        block = self.environment[-1][slot[0]]
+        if symbol.__class__ is not FieldPath:
+            if block[slot[1]].type() == "struct":
+                value.s = block[slot[1]].s
+            block[slot[1]] = value
+            return
+        struct_value = block[slot[1]]
+        slot_names = symbol.slots
+        last = len(slot_names) - 1
+        for i in range(len(slot_names)):
+            struct = struct_value.value()
+            if not isinstance(struct, Struct):
+                if struct is None:
+                    return VariableError.FAULT_ERROR
+                return VariableError.TYPE_ERROR
+            elif not struct.fields:
+                return VariableError.FAULT_ERROR
+            field_value = getattr(struct, slot_names[i], None)
+            if field_value is None:
+                return self.__set(symbol, value)
+            if i == last:
+                setattr(struct, slot_names[i], value)
+                return
+            struct_value = field_value
+
+    def __set(self, symbol, value):
         cur_func_env = self.environment[-1]
-        var_name = symbol.split(".")
+        struct_name, field_names = FieldPath.split(symbol)
         # 1. This is just a variable in a top level environment
-        if len(var_name) == 0:
-            print("ERROR!", symbol)
-        elif len(var_name) == 1:
+        if len(field_names) == 0:
             for env in reversed(cur_func_env):
-                if symbol in env:
-                    if env[symbol].type() == "struct":
-                        value.s = env[symbol].s
-                    env[symbol] = value
+                slot = self.__slot(env, symbol)
+                if slot is not None:
+                    if env[slot].type() == "struct":
+                        value.s = env[slot].s
+                    env[slot] = value
                     return
             return VariableError.NAME_ERROR
-        
+
         # 2. This is a variable in a struct
-        elif len(var_name) == 2:
-            struct_name = var_name[0]
-            field_name = var_name[1]
+        elif len(field_names) == 1:
+            field_name = field_names[0]
             for env in reversed(cur_func_env):
-                if struct_name in env:
-                    struct = env[struct_name].value()
-                    if not isinstance(struct, dict):
+                slot = self.__slot(env, struct_name)
+                if slot is not None:
+                    struct = env[slot].value()
+                    if not isinstance(struct, Struct):
                         if struct is None:
                             return VariableError.FAULT_ERROR
                         else:
                             return VariableError.TYPE_ERROR
-                    elif struct == {}:
+                    elif not struct.fields:
                         return VariableError.FAULT_ERROR
-                    if field_name in struct:
-                        struct[field_name] = value
+                    slot_name = field_slot(field_name)
+                    if getattr(struct, slot_name, None) is not None:
+                        setattr(struct, slot_name, value)
                         return
                     return VariableError.FAULT_ERROR
             return VariableError.NAME_ERROR
-        
+
         else:
-            struct_name = var_name[0]
-            field_name = var_name[1]
+            last = len(field_names) - 1
             # Find the struct in the environment
             for env in reversed(cur_func_env):
                 # we found the struct, so let's find the field now
-                if struct_name in env:
-                    struct = env[struct_name].value()
-                    var_name.pop(0)
-                    while len(var_name) >= 1:
-                        if not isinstance(struct, dict):
+                slot = self.__slot(env, struct_name)
+                if slot is not None:
+                    struct = env[slot].value()
+                    i = 0
+                    while i <= last:
+                        if not isinstance(struct, Struct):
                             if struct is None:
                                 return VariableError.FAULT_ERROR
                             else:
                                 return VariableError.TYPE_ERROR
-                        elif struct == {}:
+                        elif not struct.fields:
                             return VariableError.FAULT_ERROR
-                        if field_name in struct:
-                            if len(var_name) == 1:
-                                struct[field_name] = value
+                        field_value = getattr(struct, field_slot(field_names[i]), None)
+                        if field_value is not None:
+                            if i == last:
+                                setattr(struct, field_slot(field_names[i]), value)
                                 return
-                            var_name.pop(0)
-                            struct = struct[field_name].value()
-                            field_name = var_name[0]
+                            struct = field_value.value()
+                            i += 1
             return VariableError.NAME_ERROR
-                            
+
 
     # create a new symbol in the top-most environment, regardless of whether that symbol exists
     # in a lower environment
     def create(self, symbol, value):
-        cur_func_env = self.environment[-1]
-        if symbol in cur_func_env[-1]:   # symbol already defined in current scope
+        if value.__class__ is SharedValue:
+            value = unshared(value)
+        block = self.environment[-1][-1]
+        layout = block[0]
+        slot = None if layout is None else layout.get(symbol)
+        if slot is not None and slot < len(block):   # symbol already defined in current scope
             return False
-        cur_func_env[-1][symbol] = value
-        self.set(symbol, value)
+        if slot != len(block):
+            # symbol isn't where the shared layout expects it: switch to a private layout
+            layout = {} if layout is None else dict(layout)
+            layout[symbol] = len(block)
+            block[0] = layout
+        block.append(value)
         return True
 
-    # used when we enter a new function - start with empty dictionary to hold parameters.
-    def push_func(self):
-        self.environment.append([{}])  # [[...]] -> [[...], [{}]]
+    # used when we enter a new function - start with a block to hold parameters.
+    def push_func(self, layout=None):
+        self.environment.append([[layout]])  # [[...]] -> [[...], [[layout]]]
 
-    def push_block(self):
+    def push_block(self, layout=None):
         cur_func_env = self.environment[-1]
-        cur_func_env.append({})  # [[...],[{....}] -> [[...],[{...}, {}]]
+        cur_func_env.append([layout])  # [[...],[[...]] -> [[...],[[...], [layout]]]
 
     def pop_block(self):
         cur_func_env = self.environment[-1]
-        cur_func_env.pop() 
+        cur_func_env.pop()
 
     # used when we exit a nested block to discard the environment for that block
     def pop_func(self):
@@ -170,5 +273,7 @@ class EnvironmentManager:
 
     def print_env(self):
         for env in self.environment:
-            print(env)
-            print("---")
\ No newline at end of file
+            for block in env:
+                layout = block[0] or {}
+                print({name: block[slot] for name, slot in layout.items() if slot < len(block)})
+            print("---")
@@ -0,0 +1,274 @@
+import mmap
+import struct
+import sys
+from array import array
+
+from brewparse import KIND_CODES, NODE_CLASSES, NODE_KINDS, BinOpNode
+from element import FieldPath, Node
+
+# A parsed program stored as flat columns instead of one python object per node.
+#
+# Nodes are numbered in post-order (children before their parent, the program
+# node last). For node i:
+#   kinds[i]                      its kind code (see brewparse.NODE_KINDS)
+#   operands[starts[i]:starts[i+1]]  its fields, in the order of its node class's
+#                                 _fields, each encoded as (value << 2) | tag:
+#     CONST   value is an index into the constants (names, types, literals)
+#     NODE    value is the index of the child node
+#     LIST    value is a count, and the next count operands are node indices
+#     NONE    the field is None
+# Constants are interned, so every name or literal is stored once.
+#
+# The binary format is a header followed by the kinds, starts, operands and
+# constant offsets columns and then the constants themselves, all little
+# endian. load() maps the file and reads the columns in place.
+CONST, NODE, LIST, NONE = range(4)
+
+MAGIC = b"BRAST"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<5sB2xIII")  # magic, version, nodes, operands, constants
+
+CONST_TAGS = {int: b"i", str: b"s", bool: b"b", FieldPath: b"p"}
+
+
+class FlatAST:
+    def __init__(self, kinds, starts, operands, const_offsets, const_data, mapped=None):
+        self.kinds = kinds
+        self.starts = starts
+        self.operands = operands
+        self.const_offsets = const_offsets
+        self.const_data = const_data
+        self.constants = [None] * (len(const_offsets) - 1)  # decoded on first use
+        self.mapped = mapped
+
+    @staticmethod
+    def from_tree(ast):
+        return Flattener().flatten(ast)
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def root(self):
+        return len(self.kinds) - 1
+
+    def elem_type(self, i):
+        return NODE_KINDS[self.kinds[i]]
+
+    def constant(self, index):
+        value = self.constants[index]
+        if value is None:
+            data = bytes(self.const_data[self.const_offsets[index]:self.const_offsets[index + 1]])
+            tag, payload = data[:1], data[1:].decode("utf-8")
+            if tag == b"i":
+                value = int(payload)
+            elif tag == b"b":
+                value = payload == "1"
+            elif tag == b"p":
+                value = FieldPath(*FieldPath.split(payload))
+            else:
+                value = payload
+            self.constants[index] = value
+        return value
+
+    # the field values of node i, with child nodes as node indices
+    def fields(self, i):
+        values = []
+        operands = self.operands
+        pos = self.starts[i]
+        end = self.starts[i + 1]
+        while pos < end:
+            operand = operands[pos]
+            pos += 1
+            tag = operand & 3
+            if tag == CONST:
+                values.append(self.constant(operand >> 2))
+            elif tag == NODE:
+                values.append(operand >> 2)
+            elif tag == LIST:
+                count = operand >> 2
+                values.append(list(operands[pos:pos + count]))
+                pos += count
+            else:
+                values.append(None)
+        return values
+
+    def get(self, i, key):
+        node_cls = NODE_CLASSES[self.elem_type(i)]
+        if key not in node_cls._fields:
+            return None
+        return self.fields(i)[node_cls._fields.index(key)]
+
+    # builds the node objects the interpreters run; post-order means one pass
+    # in node order, with no recursion, sees every child before its parent.
+    # It decodes the operands inline rather than through fields(), since it is
+    # all a cache hit or a parallel parse (see brewparallel) waits on.
+    def to_tree(self):
+        node_classes = [NODE_CLASSES[elem_type] for elem_type in NODE_KINDS]
+        operands = self.operands
+        starts = self.starts
+        constants = self.constants
+        nodes = []
+        for i, kind in enumerate(self.kinds):
+            values = []
+            pos = starts[i]
+            end = starts[i + 1]
+            while pos < end:
+                operand = operands[pos]
+                pos += 1
+                tag = operand & 3
+                if tag == NODE:
+                    values.append(nodes[operand >> 2])
+                elif tag == CONST:
+                    value = constants[operand >> 2]
+                    values.append(self.constant(operand >> 2) if value is None else value)
+                elif tag == LIST:
+                    count = operand >> 2
+                    values.append([nodes[child] for child in operands[pos:pos + count]])
+                    pos += count
+                else:
+                    values.append(None)
+            node_cls = node_classes[kind]
+            if node_cls is BinOpNode:
+                nodes.append(node_cls(NODE_KINDS[kind], *values))
+            else:
+                nodes.append(node_cls(*values))
+        return nodes[-1]
+
+    def save(self, path):
+        columns = [array("B", self.kinds), array("I", self.starts), array("I", self.operands),
+                   array("I", self.const_offsets)]
+        if sys.byteorder == "big":
+            for column in columns:
+                column.byteswap()
+        with open(path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(self.kinds), len(self.operands),
+                                len(self.constants)))
+            for column in columns:
+                data = column.tobytes()
+                f.write(data)
+                f.write(b"\0" * (-len(data) % 4))
+            f.write(bytes(self.const_data))
+
+    # maps a file written by save(); the columns are views into the mapping
+    @staticmethod
+    def load(path):
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, num_nodes, num_operands, num_constants = HEADER.unpack_from(mapped)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            mapped.close()
+            raise ValueError(f"{path} is not a version {FORMAT_VERSION} flat AST file")
+        view = memoryview(mapped)
+        pos = HEADER.size
+        columns = []
+        for typecode, length in (("B", num_nodes), ("I", num_nodes + 1), ("I", num_operands),
+                                 ("I", num_constants + 1)):
+            size = length * array(typecode).itemsize
+            column = view[pos:pos + size].cast(typecode)
+            if sys.byteorder == "big" and typecode != "B":
+                column = array(typecode, column)
+                column.byteswap()
+            columns.append(column)
+            pos += size + (-size % 4)
+        return FlatAST(*columns, view[pos:], mapped)
+
+    def close(self):
+        if self.mapped is not None:
+            self.kinds = self.starts = self.operands = self.const_offsets = self.const_data = None
+            self.mapped.close()
+            self.mapped = None
+
+
+class Flattener:
+    def __init__(self):
+        self.kinds = array("B")
+        self.starts = array("I")
+        self.operands = array("I")
+        self.const_index = {}
+        self.const_data = bytearray()
+        self.const_offsets = array("I", [0])
+        self.node_index = {}  # id(node) -> node index
+
+    def flatten(self, ast):
+        # iterative post-order walk, so deeply nested expressions don't hit the recursion limit
+        stack = [(ast, False)]
+        while stack:
+            node, children_done = stack.pop()
+            if id(node) in self.node_index:
+                continue
+            if children_done:
+                self.__emit(node)
+                continue
+            if not isinstance(node, Node):
+                raise TypeError(f"can't flatten {type(node).__name__}; parse with brewparse first")
+            stack.append((node, True))
+            for key in node._fields:
+                value = getattr(node, key)
+                if isinstance(value, list):
+                    stack.extend((child, False) for child in reversed(value))
+                elif isinstance(value, Node):
+                    stack.append((value, False))
+        self.starts.append(len(self.operands))
+        return FlatAST(self.kinds, self.starts, self.operands, self.const_offsets,
+                       self.const_data)
+
+    def __emit(self, node):
+        self.node_index[id(node)] = len(self.kinds)
+        self.kinds.append(KIND_CODES[node.elem_type])
+        self.starts.append(len(self.operands))
+        operands = self.operands
+        for key in node._fields:
+            value = getattr(node, key)
+            if value is None:
+                operands.append(NONE)
+            elif isinstance(value, Node):
+                operands.append(self.node_index[id(value)] << 2 | NODE)
+            elif isinstance(value, list):
+                operands.append(len(value) << 2 | LIST)
+                operands.extend(self.node_index[id(child)] for child in value)
+            else:
+                operands.append(self.__constant(value) << 2 | CONST)
+
+    def __constant(self, value):
+        key = (type(value), value)
+        index = self.const_index.get(key)
+        if index is None:
+            if type(value) is bool:
+                payload = "1" if value else "0"
+            else:
+                payload = str(value)
+            self.const_data += CONST_TAGS[type(value)] + payload.encode("utf-8")
+            self.const_offsets.append(len(self.const_data))
+            index = len(self.const_offsets) - 2
+            self.const_index[key] = index
+        return index
+
+
+# python flatast.py program.br [out.brast]: flattens a program, saves it,
+# loads it back and checks the rebuilt tree matches the parsed one
+if __name__ == "__main__":
+    import time
+    import tracemalloc
+
+    from brewparse import parse_program
+
+    with open(sys.argv[1]) as f:
+        source = f.read()
+    out_path = sys.argv[2] if len(sys.argv) > 2 else sys.argv[1] + "ast"
+
+    tracemalloc.start()
+    ast = parse_program(source)
+    tree_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    flat = FlatAST.from_tree(ast)
+    flat.save(out_path)
+
+    start = time.perf_counter()
+    loaded = FlatAST.load(out_path)
+    load_time = time.perf_counter() - start
+    with open(out_path, "rb") as f:
+        file_bytes = len(f.read())
+    print(f"{len(loaded)} nodes: tree {tree_bytes} bytes, flat file {file_bytes} bytes, "
+          f"load {load_time * 1000:.2f} ms")
+    print("round trip ok" if str(loaded.to_tree()) == str(ast) else "round trip MISMATCH")
+    loaded.close()
@@ -4,7 +4,7 @@
 from env_v1 import EnvironmentManager
 from type_valuev1 import Type, Value, create_value, get_printable
 from intbase import InterpreterBase, ErrorType
-from brewparse import parse_program
+from brewparse import dispatch_table, parse_program
 
 
 # Main interpreter class
@@ -17,6 +17,7 @@ class Interpreter(InterpreterBase):
         super().__init__(console_output, inp)
         self.trace_output = trace_output
         self.__setup_ops()
+        self.__setup_dispatch()
 
     # run a program that's provided in a string
     # usese the provided Parser found in brewparse.py to parse the program
@@ -43,12 +44,9 @@ class Interpreter(InterpreterBase):
         for statement in statements:
             if self.trace_output:
                 print(statement)
-            if statement.elem_type == InterpreterBase.FCALL_NODE:
-                self.__call_func(statement)
-            elif statement.elem_type == "=":
-                self.__assign(statement)
-            elif statement.elem_type == InterpreterBase.VAR_DEF_NODE:
-                self.__var_def(statement)
+            run_statement = self.statement_table[statement.kind]
+            if run_statement is not None:
+                run_statement(statement)
 
 
     def __call_func(self, call_node):
@@ -98,20 +96,14 @@ class Interpreter(InterpreterBase):
             )
 
     def __eval_expr(self, expr_ast):
-        if expr_ast.elem_type == InterpreterBase.INT_NODE:
-            return Value(Type.INT, expr_ast.get("val"))
-        if expr_ast.elem_type == InterpreterBase.STRING_NODE:
-            return Value(Type.STRING, expr_ast.get("val"))
-        if expr_ast.elem_type == InterpreterBase.VAR_NODE:
-            var_name = expr_ast.get("name")
-            val = self.env.get(var_name)
-            if val is None:
-                super().error(ErrorType.NAME_ERROR, f"Variable {var_name} not found")
-            return val
-        if expr_ast.elem_type == InterpreterBase.FCALL_NODE:
-            return self.__call_func(expr_ast)
-        if expr_ast.elem_type in Interpreter.BIN_OPS:
-            return self.__eval_op(expr_ast)
+        return self.expr_table[expr_ast.kind](expr_ast)
+
+    def __eval_var(self, expr_ast):
+        var_name = expr_ast.get("name")
+        val = self.env.get(var_name)
+        if val is None:
+            super().error(ErrorType.NAME_ERROR, f"Variable {var_name} not found")
+        return val
 
     def __eval_op(self, arith_ast):
         left_value_obj = self.__eval_expr(arith_ast.get("op1"))
@@ -129,6 +121,24 @@ class Interpreter(InterpreterBase):
         f = self.op_to_lambda[left_value_obj.type()][arith_ast.elem_type]
         return f(left_value_obj, right_value_obj)
 
+    # handlers indexed by node kind code; other kinds of statements are skipped
+    # and other kinds of expressions evaluate to None
+    def __setup_dispatch(self):
+        self.statement_table = dispatch_table({
+            InterpreterBase.FCALL_NODE: self.__call_func,
+            "=": self.__assign,
+            InterpreterBase.VAR_DEF_NODE: self.__var_def,
+        })
+        expr_handlers = {
+            InterpreterBase.INT_NODE: lambda expr_ast: Value(Type.INT, expr_ast.get("val")),
+            InterpreterBase.STRING_NODE: lambda expr_ast: Value(Type.STRING, expr_ast.get("val")),
+            InterpreterBase.VAR_NODE: self.__eval_var,
+            InterpreterBase.FCALL_NODE: self.__call_func,
+        }
+        for oper in Interpreter.BIN_OPS:
+            expr_handlers[oper] = self.__eval_op
+        self.expr_table = dispatch_table(expr_handlers, lambda expr_ast: None)
+
     def __setup_ops(self):
         self.op_to_lambda = {}
         # set up operations on integers
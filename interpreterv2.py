@@ -3,7 +3,7 @@
 import copy
 from enum import Enum
 
-from brewparse import parse_program
+from brewparse import dispatch_table, parse_program
 from env_v2 import EnvironmentManager
 from intbase import InterpreterBase, ErrorType
 from type_valuev2 import Type, Value, create_value, get_printable
@@ -26,6 +26,7 @@ class Interpreter(InterpreterBase):
         super().__init__(console_output, inp)
         self.trace_output = trace_output
         self.__setup_ops()
+        self.__setup_dispatch()
 
     # run a program that's provided in a string
     # usese the provided Parser found in brewparse.py to parse the program
@@ -70,22 +71,7 @@ class Interpreter(InterpreterBase):
         return (ExecStatus.CONTINUE, Interpreter.NIL_VALUE)
 
     def __run_statement(self, statement):
-        status = ExecStatus.CONTINUE
-        return_val = None
-        if statement.elem_type == InterpreterBase.FCALL_NODE:
-            self.__call_func(statement)
-        elif statement.elem_type == "=":
-            self.__assign(statement)
-        elif statement.elem_type == InterpreterBase.VAR_DEF_NODE:
-            self.__var_def(statement)
-        elif statement.elem_type == InterpreterBase.RETURN_NODE:
-            status, return_val = self.__do_return(statement)
-        elif statement.elem_type == Interpreter.IF_NODE:
-            status, return_val = self.__do_if(statement)
-        elif statement.elem_type == Interpreter.FOR_NODE:
-            status, return_val = self.__do_for(statement)
-
-        return (status, return_val)
+        return self.statement_table[statement.kind](statement)
     
     def __call_func(self, call_node):
         func_name = call_node.get("name")
@@ -160,28 +146,14 @@ class Interpreter(InterpreterBase):
             )
 
     def __eval_expr(self, expr_ast):
-        if expr_ast.elem_type == InterpreterBase.NIL_NODE:
-            return Interpreter.NIL_VALUE
-        if expr_ast.elem_type == InterpreterBase.INT_NODE:
-            return Value(Type.INT, expr_ast.get("val"))
-        if expr_ast.elem_type == InterpreterBase.STRING_NODE:
-            return Value(Type.STRING, expr_ast.get("val"))
-        if expr_ast.elem_type == InterpreterBase.BOOL_NODE:
-            return Value(Type.BOOL, expr_ast.get("val"))
-        if expr_ast.elem_type == InterpreterBase.VAR_NODE:
-            var_name = expr_ast.get("name")
-            val = self.env.get(var_name)
-            if val is None:
-                super().error(ErrorType.NAME_ERROR, f"Variable {var_name} not found")
-            return val
-        if expr_ast.elem_type == InterpreterBase.FCALL_NODE:
-            return self.__call_func(expr_ast)
-        if expr_ast.elem_type in Interpreter.BIN_OPS:
-            return self.__eval_op(expr_ast)
-        if expr_ast.elem_type == Interpreter.NEG_NODE:
-            return self.__eval_unary(expr_ast, Type.INT, lambda x: -1 * x)
-        if expr_ast.elem_type == Interpreter.NOT_NODE:
-            return self.__eval_unary(expr_ast, Type.BOOL, lambda x: not x)
+        return self.expr_table[expr_ast.kind](expr_ast)
+
+    def __eval_var(self, expr_ast):
+        var_name = expr_ast.get("name")
+        val = self.env.get(var_name)
+        if val is None:
+            super().error(ErrorType.NAME_ERROR, f"Variable {var_name} not found")
+        return val
 
     def __eval_op(self, arith_ast):
         left_value_obj = self.__eval_expr(arith_ast.get("op1"))
@@ -216,6 +188,38 @@ class Interpreter(InterpreterBase):
             )
         return Value(t, f(value_obj.value()))
 
+    # handlers indexed by node kind code. Statement handlers return (status,
+    # return value); other kinds of statements are skipped and other kinds of
+    # expressions evaluate to None.
+    def __setup_dispatch(self):
+        def continue_after(run):
+            def run_statement(statement):
+                run(statement)
+                return (ExecStatus.CONTINUE, None)
+            return run_statement
+
+        self.statement_table = dispatch_table({
+            InterpreterBase.FCALL_NODE: continue_after(self.__call_func),
+            "=": continue_after(self.__assign),
+            InterpreterBase.VAR_DEF_NODE: continue_after(self.__var_def),
+            InterpreterBase.RETURN_NODE: self.__do_return,
+            Interpreter.IF_NODE: self.__do_if,
+            Interpreter.FOR_NODE: self.__do_for,
+        }, lambda statement: (ExecStatus.CONTINUE, None))
+        expr_handlers = {
+            InterpreterBase.NIL_NODE: lambda expr_ast: Interpreter.NIL_VALUE,
+            InterpreterBase.INT_NODE: lambda expr_ast: Value(Type.INT, expr_ast.get("val")),
+            InterpreterBase.STRING_NODE: lambda expr_ast: Value(Type.STRING, expr_ast.get("val")),
+            InterpreterBase.BOOL_NODE: lambda expr_ast: Value(Type.BOOL, expr_ast.get("val")),
+            InterpreterBase.VAR_NODE: self.__eval_var,
+            InterpreterBase.FCALL_NODE: self.__call_func,
+            Interpreter.NEG_NODE: lambda expr_ast: self.__eval_unary(expr_ast, Type.INT, lambda x: -1 * x),
+            Interpreter.NOT_NODE: lambda expr_ast: self.__eval_unary(expr_ast, Type.BOOL, lambda x: not x),
+        }
+        for oper in Interpreter.BIN_OPS:
+            expr_handlers[oper] = self.__eval_op
+        self.expr_table = dispatch_table(expr_handlers, lambda expr_ast: None)
+
     def __setup_ops(self):
         self.op_to_lambda = {}
         # set up operations on integers
@@ -1,5 +1,5 @@
 from intbase import InterpreterBase, ErrorType
-from brewparse import parse_program
+from brewparse import dispatch_table, parse_program
 
 class Interpreter(InterpreterBase):
     def __init__(self, console_output=True, inp=None, trace_output=False):
@@ -8,6 +8,7 @@ class Interpreter(InterpreterBase):
         self.funcs = {} # {(name,n_args):element,}
         self.vars = [] # [({name:val,},bool),]
         self.bops = {'+', '-', '*', '/', '==', '!=', '>', '>=', '<', '<=', '||', '&&'}
+        self.setup_dispatch()
 
     def run(self, program):
         ast = parse_program(program)
@@ -136,89 +137,94 @@ class Interpreter(InterpreterBase):
         return None
 
     def run_statements(self, statements):
-        res, ret = None, False
-
         for statement in statements:
-            kind = statement.elem_type
-
-            if kind == 'vardef':
-                self.run_vardef(statement)
-            elif kind == '=':
-                self.run_assign(statement)
-            elif kind == 'fcall':
-                self.run_fcall(statement)
-            elif kind == 'if':
-                res, ret = self.run_if(statement)
-                if ret: break
-            elif kind == 'for':
-                res, ret = self.run_for(statement)
-                if ret: break
-            elif kind == 'return':
-                res = self.run_return(statement)
-                ret = True
-                break
+            res, ret = self.statement_table[statement.kind](statement)
+            if ret: return res, ret
 
-        return res, ret
+        return None, False
 
     def run_expr(self, expr):
-        kind = expr.elem_type
+        return self.expr_table[expr.kind](expr)
 
-        if kind == 'int' or kind == 'string' or kind == 'bool':
-            return expr.get('val')
-
-        elif kind == 'var':
-            var_name = expr.get('name')
-
-            for scope_vars, is_func in self.vars[::-1]:
-                if var_name in scope_vars:
-                    return scope_vars[var_name]
-
-                if is_func: break
-
-            super().error(ErrorType.NAME_ERROR, '')
+    def run_var(self, expr):
+        var_name = expr.get('name')
 
-        elif kind == 'fcall':
-            return self.run_fcall(expr)
-
-        elif kind in self.bops:
-            l, r = self.run_expr(expr.get('op1')), self.run_expr(expr.get('op2'))
-            tl, tr = type(l), type(r)
-
-            if kind == '==': return tl == tr and l == r
-            if kind == '!=': return not (tl == tr and l == r)
-
-            if tl == str and tr == str:
-                if kind == '+': return l + r
-
-            if tl == int and tr == int:
-                if kind == '+': return l + r
-                if kind == '-': return l - r
-                if kind == '*': return l * r
-                if kind == '/': return l // r
-                if kind == '<': return l < r
-                if kind == '<=': return l <= r
-                if kind == '>': return l > r
-                if kind == '>=': return l >= r
-            
-            if tl == bool and tr == bool:
-                if kind == '&&': return l and r
-                if kind == '||': return l or r
+        for scope_vars, is_func in self.vars[::-1]:
+            if var_name in scope_vars:
+                return scope_vars[var_name]
 
-            super().error(ErrorType.TYPE_ERROR, '')
+            if is_func: break
 
-        elif kind == 'neg':
-            o = self.run_expr(expr.get('op1'))
-            if type(o) == int: return -o
-            
-            super().error(ErrorType.TYPE_ERROR, '')
+        super().error(ErrorType.NAME_ERROR, '')
 
-        elif kind == '!':
-            o = self.run_expr(expr.get('op1'))
-            if type(o) == bool: return not o
+    def run_bop(self, expr):
+        kind = expr.elem_type
+        l, r = self.run_expr(expr.get('op1')), self.run_expr(expr.get('op2'))
+        tl, tr = type(l), type(r)
+
+        if kind == '==': return tl == tr and l == r
+        if kind == '!=': return not (tl == tr and l == r)
+
+        if tl == str and tr == str:
+            if kind == '+': return l + r
+
+        if tl == int and tr == int:
+            if kind == '+': return l + r
+            if kind == '-': return l - r
+            if kind == '*': return l * r
+            if kind == '/': return l // r
+            if kind == '<': return l < r
+            if kind == '<=': return l <= r
+            if kind == '>': return l > r
+            if kind == '>=': return l >= r
+        
+        if tl == bool and tr == bool:
+            if kind == '&&': return l and r
+            if kind == '||': return l or r
 
-            super().error(ErrorType.TYPE_ERROR, '')
+        super().error(ErrorType.TYPE_ERROR, '')
 
-        return None
+    def run_neg(self, expr):
+        o = self.run_expr(expr.get('op1'))
+        if type(o) == int: return -o
+        
+        super().error(ErrorType.TYPE_ERROR, '')
+
+    def run_not(self, expr):
+        o = self.run_expr(expr.get('op1'))
+        if type(o) == bool: return not o
+
+        super().error(ErrorType.TYPE_ERROR, '')
+
+    # handlers indexed by node kind code; statement handlers return (res, ret)
+    def setup_dispatch(self):
+        def no_return(run):
+            def run_statement(statement):
+                run(statement)
+                return None, False
+            return run_statement
+
+        self.statement_table = dispatch_table({
+            'vardef': no_return(self.run_vardef),
+            '=': no_return(self.run_assign),
+            'fcall': no_return(self.run_fcall),
+            'if': self.run_if,
+            'for': self.run_for,
+            'return': lambda statement: (self.run_return(statement), True),
+        }, lambda statement: (None, False))
+
+        expr_handlers = {
+            'int': lambda expr: expr.get('val'),
+            'string': lambda expr: expr.get('val'),
+            'bool': lambda expr: expr.get('val'),
+            'var': self.run_var,
+            'fcall': self.run_fcall,
+            'neg': self.run_neg,
+            '!': self.run_not,
+        }
+        for kind in self.bops:
+            expr_handlers[kind] = self.run_bop
+        self.expr_table = dispatch_table(expr_handlers, lambda expr: None)
 
 def main():
     interpreter = Interpreter()
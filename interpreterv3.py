@@ -1,30 +1,85 @@
 # document that we won't have a return inside the init/update of a for loop
 
-import copy
+import warnings
 from enum import Enum
 
-from brewparse import parse_program
-from env_v3 import EnvironmentManager, VariableError
+from brewlazy import load_body
+from brewparse import PARSERS, dispatch_table, parse_program, syntax_error_count
+from bytecodev3 import VM
+from compilerv3 import ClosureCompiler
+from resolverv3 import Resolver
+from runtimev3 import Runtime
+from structheap import StructHeap, heap_hazard
+from transpilerv3 import CodeCache, compile_program, run_code
+from typecheckv3 import TypeChecker
+from env_v3 import EnvironmentManager
 from intbase import InterpreterBase, ErrorType
-from type_valuev3 import Type, Value, create_value, get_printable, create_value_from_type
+from type_valuev3 import (
+    Type, Value, bool_value, create_value, create_value_from_type, int_value, struct_class,
+)
 
 
 class ExecStatus(Enum):
     CONTINUE = 1
     RETURN = 2
 
+
+# What a call site needs to call its function, read from the function's and the
+# call's AST on the site's first call. formals has (name, declared type, copy
+# the argument, the argument is already checked) for each formal;
+# coerce_return is Runtime.return_coercion of the declared return type, or None
+# if the type checker proved every return already has the type.
+class CallTarget:
+    def __init__(self, func_ast, actual_args, formals, coerce_return):
+        self.func_ast = func_ast
+        self.actual_args = actual_args
+        self.formals = formals
+        self.layout = func_ast.get("layout")
+        self.statements = func_ast.get("statements")
+        self.body_layout = func_ast.get("body_layout")
+        self.coerce_return = coerce_return
+
 # Main interpreter class
 class Interpreter(InterpreterBase):
     # constants
-    NIL_VALUE = create_value(InterpreterBase.NIL_DEF)
+    # a nil of its own rather than the shared one: assigning it to a struct
+    # variable gives it that variable's struct type, and every later nil literal
+    # evaluates to it with that type
+    NIL_VALUE = Value(Type.NIL, None)
     TRUE_VALUE = create_value(InterpreterBase.TRUE_DEF)
     BIN_OPS = {"+", "-", "*", "/", "==", "!=", ">", ">=", "<", "<=", "||", "&&"}
 
+    # execution engines that can run a parsed program; "tree" walks the AST directly
+    ENGINES = {"tree", "closure", "bytecode", "python"}
+
     # methods
-    def __init__(self, console_output=True, inp=None, trace_output=False):
+    # cache_dir is only used by the "python" engine, to keep compiled programs on disk
+    # static_check reports type errors found by the static type checker before the program runs
+    # parse_cache is an optional parsecache.ParseCache, shared between runs of the same programs
+    # parser picks the parser from brewparse.PARSERS
+    # lazy_parse parses each function body on the function's first call (see brewlazy)
+    # parse_workers is the number of processes to parse large programs with (see brewparallel)
+    # struct_heap keeps structs in a columnar structheap.StructHeap, for programs with very many structs
+    # (programs it could run differently are warned about and run without it)
+    def __init__(self, console_output=True, inp=None, trace_output=False, engine="tree", cache_dir=None,
+                 static_check=False, parse_cache=None, parser="lalr", lazy_parse=False, parse_workers=1,
+                 struct_heap=False):
         super().__init__(console_output, inp)
         self.trace_output = trace_output
+        self.static_check = static_check
+        if engine not in Interpreter.ENGINES:
+            raise ValueError(f"Unknown engine {engine}")
+        self.engine = engine
+        self.code_cache = CodeCache(cache_dir) if engine == "python" else None
+        self.parse_cache = parse_cache
+        if parser not in PARSERS:
+            raise ValueError(f"Unknown parser {parser}")
+        self.parser = parser
+        self.lazy_parse = lazy_parse
+        self.parse_workers = parse_workers
+        self.struct_heap = struct_heap
         self.__setup_ops()
+        self.__setup_dispatch()
 
     # run a program that's provided in a string
     # usese the provided Parser found in brewparse.py to parse the program
@@ -32,15 +87,60 @@ class Interpreter(InterpreterBase):
     def run(self, program):
         self.__setup_ops()
         self.struct_name_to_ast = {}
-        ast = parse_program(program)
-        self.__set_up_struct_table(ast)
-        self.__set_up_function_table(ast)
+        self.func_name_to_ast = {}
         self.env = EnvironmentManager()
         self.env.reset_env()
-        self.__call_func_aux("main", [])
+        # a struct type NIL_VALUE took in an earlier run isn't this program's
+        Interpreter.NIL_VALUE.s = None
+        self.heap = StructHeap(Interpreter.NIL_VALUE) if self.struct_heap else None
+        if self.engine == "python":
+            # a cached program was already parsed, checked and compiled by an earlier run
+            cache_key = CodeCache.key(program, self.trace_output, self.static_check)
+            code = self.code_cache.get(cache_key)
+            if code is not None:
+                run_code(self, code)
+                return
+        syntax_errors = syntax_error_count()
+        ast = parse_program(program, self.parse_cache, self.parser, self.lazy_parse, self.parse_workers)
+        self.__set_up_struct_table(ast)
+        self.__set_up_function_table(ast)
+        if self.engine == "python" or self.static_check or self.heap is not None:
+            # these need every function body up front
+            for func_ast in ast.get("functions"):
+                if func_ast.get("lazy_body") is not None:
+                    load_body(func_ast)
+        Resolver(self.func_name_to_ast).resolve()
+        if self.heap is not None and self.engine != "python":
+            # a compiled program carries the verdict, which run_code acts on
+            self.install_heap(heap_hazard(self.struct_name_to_ast, self.func_name_to_ast))
+        self.type_checker = None
+        if self.engine == "tree" or self.static_check:
+            self.type_checker = TypeChecker(self.struct_name_to_ast, self.func_name_to_ast)
+            type_errors = self.type_checker.check()
+            if self.static_check and type_errors:
+                super().error(ErrorType.TYPE_ERROR, type_errors[0])
+        if self.engine == "closure":
+            ClosureCompiler(self).run()
+        elif self.engine == "bytecode":
+            VM(self).run()
+        elif self.engine == "python":
+            code = compile_program(self)
+            if syntax_error_count() == syntax_errors:
+                # a cached program would run without printing the errors its parse printed
+                self.code_cache.put(cache_key, code)
+            run_code(self, code)
+        else:
+            # the type checks, coercions and operators are the other engines' too
+            self.runtime = Runtime(self)
+            self.binary_ops = {oper: self.runtime.make_binary_op(oper) for oper in Interpreter.BIN_OPS}
+            self.__call_func_aux("main", [])
 
     def __set_up_function_table(self, ast):
         self.func_name_to_ast = {}
+        # id(call node) -> CallTarget. A table is never changed once it is set
+        # up (a lazily parsed body is filled in in place), so a call site's
+        # target stays right until the next run sets up a new one.
+        self.call_targets = {}
         for func_def in ast.get("functions"):
             func_name = func_def.get("name")
             num_params = len(func_def.get("args"))
@@ -54,17 +154,13 @@ class Interpreter(InterpreterBase):
                 if arg.get("var_type") not in self.struct_name_to_ast and arg.get("var_type") not in [Type.INT, Type.STRING, Type.BOOL]:
                     super().error(ErrorType.TYPE_ERROR, f"Unknown argument type {arg.get('var_type')}")
 
-    def __get_func_by_name(self, name, num_params):
-        if name not in self.func_name_to_ast:
-            super().error(ErrorType.NAME_ERROR, f"Function {name} not found")
-        candidate_funcs = self.func_name_to_ast[name]
-        if num_params not in candidate_funcs:
-            super().error(
-                ErrorType.NAME_ERROR,
-                f"Function {name} taking {num_params} params not found",
-            )
-        return candidate_funcs[num_params]
-    
+    # parses, resolves and checks the body of a lazily parsed function
+    def load_func_body(self, func_ast):
+        load_body(func_ast)
+        Resolver(self.func_name_to_ast).resolve_func(func_ast)
+        if self.type_checker is not None:
+            self.type_checker.check_func(func_ast)
+
     def __set_up_struct_table(self, ast):
         self.struct_name_to_ast = {}
         for struct_def in ast.get("structs"):
@@ -72,13 +168,26 @@ class Interpreter(InterpreterBase):
             fields = struct_def.get("fields")
             if struct_name in self.struct_name_to_ast:
                 super().error(ErrorType.TYPE_ERROR, f"Duplicate struct definition: {struct_name}")
+            field_types = {field.get("name"): field.get("var_type") for field in fields}
             self.struct_name_to_ast[struct_name] = {
-                "fields": {field.get("name"): field.get("var_type") for field in fields},
-                "ast": struct_def
+                "fields": field_types,
+                "ast": struct_def,
+                "class": struct_class(struct_name, field_types),
             }
 
-    def __run_statements(self, statements):
-        self.env.push_block()
+    # puts the structs of the struct table in self.heap, or, if hazard (see
+    # structheap.heap_hazard) says the program could run differently there,
+    # warns and leaves them slotted
+    def install_heap(self, hazard):
+        if hazard is not None:
+            warnings.warn(f"struct_heap: {hazard}, so the program's structs are not kept in the columnar heap",
+                          RuntimeWarning)
+            self.heap = None
+            return
+        self.heap.install(self.struct_name_to_ast)
+
+    def __run_statements(self, statements, layout=None):
+        self.env.push_block(layout)
         for statement in statements:
             if self.trace_output:
                 print(statement)
@@ -90,456 +199,275 @@ class Interpreter(InterpreterBase):
         self.env.pop_block()
         return (ExecStatus.CONTINUE, Interpreter.NIL_VALUE)
 
+    # a statement that doesn't return gives NIL_VALUE, which is never a return value
     def __run_statement(self, statement):
-        status = ExecStatus.CONTINUE
-        return_val = Type.NIL
-        if statement.elem_type == InterpreterBase.FCALL_NODE:
-            self.__call_func(statement)
-        elif statement.elem_type == "=":
-            self.__assign(statement)
-        elif statement.elem_type == InterpreterBase.VAR_DEF_NODE:
-            self.__var_def(statement)
-        elif statement.elem_type == InterpreterBase.RETURN_NODE:
-            status, return_val = self.__do_return(statement)
-        elif statement.elem_type == Interpreter.IF_NODE:
-            status, return_val = self.__do_if(statement)
-        elif statement.elem_type == Interpreter.FOR_NODE:
-            status, return_val = self.__do_for(statement)
-
-        if return_val == Interpreter.NIL_VALUE:
-            return (status, create_value_from_type(Type.NIL))
-        return (status, return_val)
+        return self.statement_table[statement.kind](statement)
     
     def __call_func(self, call_node):
-        func_name = call_node.get("name")
-        actual_args = call_node.get("args")
-        return self.__call_func_aux(func_name, actual_args)
-
-    def __call_func_aux(self, func_name, actual_args):
+        target = self.call_targets.get(id(call_node))
+        if target is None:
+            func_name = call_node.get("name")
+            actual_args = call_node.get("args")
+            if func_name == "print":
+                return self.__call_print(actual_args)
+            if func_name == "inputi" or func_name == "inputs":
+                return self.__call_input(func_name, actual_args)
+            target = self.__prepare_call(func_name, actual_args, call_node.get("checked_args"),
+                                         call_node.get("alias_args"))
+            self.call_targets[id(call_node)] = target
+        return self.__run_call(target)
+
+    # checked_args flags the arguments the type checker proved already have the formal's type,
+    # and alias_args the ones that may share their Value with the caller (see resolverv3)
+    def __call_func_aux(self, func_name, actual_args, checked_args=None, alias_args=None):
         if func_name == "print":
             return self.__call_print(actual_args)
         if func_name == "inputi" or func_name == "inputs":
             return self.__call_input(func_name, actual_args)
+        return self.__run_call(self.__prepare_call(func_name, actual_args, checked_args, alias_args))
 
-        func_ast = self.__get_func_by_name(func_name, len(actual_args))
+    def __prepare_call(self, func_name, actual_args, checked_args, alias_args):
+        func_ast = self.runtime.get_func_by_name(func_name, len(actual_args))
         formal_args = func_ast.get("args")
-        expected_return_type = func_ast.get("return_type")
         if len(actual_args) != len(formal_args):
             super().error(
                 ErrorType.NAME_ERROR,
                 f"Function {func_ast.get('name')} with {len(actual_args)} args not found",
             )
+        copy_args = func_ast.get("copy_args")
+        formals = tuple(
+            (
+                formal_ast.get("name"),
+                formal_ast.get("var_type"),
+                bool(alias_args[index] and copy_args[index]),
+                bool(checked_args and checked_args[index]),
+            )
+            for index, formal_ast in enumerate(formal_args)
+        )
+        if func_ast.get("checked_return"):
+            return CallTarget(func_ast, actual_args, formals, None)
+        return CallTarget(func_ast, actual_args, formals, self.runtime.return_coercion(func_ast.get("return_type")))
 
+    def __run_call(self, target):
         # first evaluate all of the actual parameters and associate them with the formal parameter names
         args = {}
-        for formal_ast, actual_ast in zip(formal_args, actual_args):
-            result = copy.copy(self.__eval_expr(actual_ast))
-            result_type = None
-            
-            if result.type() == Type.STRUCT:
-                result_type = result.struct_type()
-            else: 
-                result_type = result.type()
-            if formal_ast.get("var_type") != result_type:
-                if formal_ast.get("var_type") == Type.BOOL and result_type == Type.INT:
-                    result = Value(Type.BOOL, result.value() != 0)
-                elif formal_ast.get("var_type") in self.struct_name_to_ast and result_type == Type.NIL:
-                    pass
-                else:
-                    super().error(
-                        ErrorType.TYPE_ERROR,
-                        f"Expected type {formal_ast.get('var_type')}, got {result_type}",
-                    )
-            
-            arg_name = formal_ast.get("name")
+        for (arg_name, formal_type, copy_arg, checked), actual_ast in zip(target.formals, target.actual_args):
+            result = self.__eval_expr(actual_ast)
+            if not checked:
+                result = self.runtime.bind_arg(formal_type, result, copy_arg)
+            elif copy_arg:
+                result = Value(result.t, result.v, result.s)
             args[arg_name] = result
 
         # then create the new activation record 
-        self.env.push_func()
+        self.env.push_func(target.layout)
         # and add the formal arguments to the activation record
         for arg_name, value in args.items():
           self.env.create(arg_name, value)
-        _, return_val = self.__run_statements(func_ast.get("statements"))
+        _, return_val = self.__run_statements(target.statements, target.body_layout)
         self.env.pop_func()
-
-        # Check if the expected return value is VOID. If it is, check that the return value is NIL.
-        # If the return value IS NIL, then return VOID (since there is special handling). 
-        # Otherwise, throw an error.
-
-
-        if expected_return_type == InterpreterBase.VOID_DEF:
-            if return_val == Interpreter.NIL_VALUE or return_val.type() == Type.NIL:
-                return create_value_from_type(Type.VOID, None)
-            else:
-                super().error(ErrorType.TYPE_ERROR, f"Expected return type {expected_return_type}, got {return_val.type()}")
-        if expected_return_type == Type.INT and return_val.type() == Type.NIL:
-            return Value(Type.INT, 0)
-        elif expected_return_type == Type.STRING and return_val.type() == Type.NIL:
-            return Value(Type.STRING, "")
-        elif expected_return_type == Type.BOOL and return_val.type() == Type.NIL:
-            return Value(Type.BOOL, False)
-        elif expected_return_type == Type.BOOL and return_val.type() == Type.INT:
-            return Value(Type.BOOL, return_val.value() != 0)
-        elif expected_return_type in self.struct_name_to_ast and return_val.struct_type() != expected_return_type and return_val.struct_type() != None:
-            super().error(
-                ErrorType.TYPE_ERROR,
-                f"Expected return type {expected_return_type}, got {return_val.struct_type()}",
-            )
-        elif expected_return_type in self.struct_name_to_ast and return_val.type() == Type.NIL:
-            return Value(Type.NIL, create_value_from_type(Type.NIL))
-        elif expected_return_type != return_val.type() and not (return_val.type() == Type.STRUCT and return_val.struct_type() == expected_return_type):
-            super().error(
-                ErrorType.TYPE_ERROR,
-                f"Expected return type {expected_return_type}, got {return_val.type()}",
-            )
-        elif expected_return_type not in self.struct_name_to_ast and return_val.type() == Type.STRUCT:
-            super().error(
-                ErrorType.TYPE_ERROR,
-                f"Expected return type {expected_return_type}, got {return_val.type()}",
-            )
-                
-        # If the expected return value is not VOID, then check that the return value is of the expected type.
-
-        return return_val
+        if target.coerce_return is None:
+            return return_val
+        return target.coerce_return(return_val)
 
     def __call_print(self, args):
-        output = ""
-        for arg in args:
-            result = self.__eval_expr(arg)  # result is a Value object
-            if result.type() == Type.VOID:
-                super().error(ErrorType.TYPE_ERROR, "Cannot print void value")
-            output = output + get_printable(result)
-        super().output(output)
-        return Interpreter.NIL_VALUE
+        return self.runtime.print_values(self.__eval_expr(arg) for arg in args)
 
     def __call_input(self, name, args):
-        if args is not None and len(args) == 1:
-            result = self.__eval_expr(args[0])
-            super().output(get_printable(result))
-        elif args is not None and len(args) > 1:
-            super().error(
-                ErrorType.NAME_ERROR, "No inputi() function that takes > 1 parameter"
-            )
-        inp = super().get_input()
-        if name == "inputi":
-            return Value(Type.INT, int(inp))
-        if name == "inputs":
-            return Value(Type.STRING, inp)
+        self.runtime.check_input_args(len(args))
+        if len(args) == 1:
+            return self.runtime.read_input(name, self.__eval_expr(args[0]))
+        return self.runtime.read_input(name)
 
     def __assign(self, assign_ast):
         var_name = assign_ast.get("name")
+        slot = assign_ast.get("slot")
         value_obj = self.__eval_expr(assign_ast.get("expression"))
         value_type = value_obj.type()
-        assign_variable = self.env.get(var_name)
-
-        # Handle the case where the variable is a field of a struct and it is not initalized
-        if assign_variable == VariableError.NAME_ERROR:
-            super().error(
-                ErrorType.NAME_ERROR, f"Undefined variable {var_name} in assignment"
-            )
-        elif assign_variable == VariableError.FAULT_ERROR:
-            super().error(
-                ErrorType.FAULT_ERROR, f"Attempt to access field of nil object"
-            )
-        elif assign_variable == VariableError.TYPE_ERROR:
-            super().error(
-                ErrorType.TYPE_ERROR, f"Attempt to access field of non-struct object"
-            )
-        assign_variable_type = assign_variable.type()
-
-        if assign_variable_type != value_type and (assign_variable_type != Type.STRUCT) and \
-            not (assign_variable_type == Type.BOOL and value_type == Type.INT) and \
-            not (assign_variable_type == Type.NIL and value_type == Type.STRUCT):
-            super().error(
-                ErrorType.TYPE_ERROR,
-                f"Expected type {assign_variable_type}, got {value_obj.type()}",
-            )
-        if assign_variable_type == Type.BOOL and value_type == Type.INT:
-            value_obj = Value(Type.BOOL, value_obj.value() != 0)
-
-        ret = self.env.set(var_name, value_obj)
-        if ret == VariableError.NAME_ERROR:
-            super().error(
-                ErrorType.NAME_ERROR, f"Undefined variable {var_name} in assignment"
-            )
-        elif ret == VariableError.FAULT_ERROR:
-            super().error(
-                ErrorType.FAULT_ERROR, f"Attempt to access field of nil object"
-            )
-        elif ret == VariableError.TYPE_ERROR:
-            super().error(
-                ErrorType.TYPE_ERROR, f"Attempt to access field of nil object"
-            )
-        elif ret == VariableError.DEBUG_ERROR:
-            print("DEBUG: ALPHA")
+        checked_type = assign_ast.get("checked")
+        if checked_type:
+            # the type checker proved var_name is a variable of type checked_type
+            if checked_type == Type.BOOL and value_type == Type.INT:
+                value_obj = bool_value(value_obj.value() != 0)
+            self.env.set(var_name, value_obj, slot)
+            return
+        self.runtime.assign(var_name, value_obj, slot)
 
     def __var_def(self, var_ast):
-        var_name = var_ast.get("name")
-        var_type = var_ast.get("var_type")
-        value = None
-
-        if var_type in self.struct_name_to_ast:
-            value = create_value_from_type(Type.STRUCT, var_type)
-        
-        elif var_type == Type.INT:
-            value = create_value_from_type(Type.INT)
-        elif var_type == Type.STRING:
-            value = create_value_from_type(Type.STRING)
-        elif var_type == Type.BOOL:
-            value = create_value_from_type(Type.BOOL)
-        else: # Unknown type 
-            super().error(
-                ErrorType.TYPE_ERROR, f"Unknown type {var_type} in variable definition"
-            )
+        self.runtime.var_def(var_ast.get("name"), var_ast.get("var_type"))
 
-        status = self.env.create(var_name, value)
-        if not status:
-            super().error(
-                ErrorType.NAME_ERROR, f"Duplicate definition for variable {var_name}"
-            )
-        
     def __eval_expr(self, expr_ast):
-        if expr_ast.elem_type == InterpreterBase.NIL_NODE:
-            return Interpreter.NIL_VALUE
-        if expr_ast.elem_type == InterpreterBase.INT_NODE:
-            return Value(Type.INT, expr_ast.get("val"))
-        if expr_ast.elem_type == InterpreterBase.STRING_NODE:
-            return Value(Type.STRING, expr_ast.get("val"))
-        if expr_ast.elem_type == InterpreterBase.BOOL_NODE:
-            return Value(Type.BOOL, expr_ast.get("val"))
-        if expr_ast.elem_type == InterpreterBase.VAR_NODE:
-            var_name = expr_ast.get("name")
-            val = self.env.get(var_name)
-            if val == VariableError.NAME_ERROR:
-                super().error(ErrorType.NAME_ERROR, f"Undefined variable {var_name}")
-            elif val == VariableError.FAULT_ERROR:
-                # if the field does not exist in that struct, it should fail out
-                super().error(ErrorType.FAULT_ERROR, f"Attempt to access field of nil object")
-            elif val == VariableError.TYPE_ERROR:
-                super().error(ErrorType.TYPE_ERROR, f"Attempt to access field of non-struct object")
-            elif val == VariableError.DEBUG_ERROR:
-                print("DBUG: BETA")
-            return val
-        if expr_ast.elem_type == InterpreterBase.FCALL_NODE:
-            return self.__call_func(expr_ast)
-        if expr_ast.elem_type in Interpreter.BIN_OPS:
-            return self.__eval_op(expr_ast)
-        if expr_ast.elem_type == Interpreter.NEG_NODE:
-            return self.__eval_neg_unary(expr_ast, Type.INT, lambda x: -1 * x)
-        if expr_ast.elem_type == Interpreter.NOT_NODE:
-            return self.__eval_not_unary(expr_ast, [Type.BOOL, Type.INT], lambda x: not x)
-        if expr_ast.elem_type == Interpreter.NEW_NODE:
-            struct_name = expr_ast.get("var_type")
-            if struct_name not in self.struct_name_to_ast:
-                super().error(ErrorType.TYPE_ERROR, f"Unknown struct type {struct_name}")
-            struct_def = self.struct_name_to_ast[struct_name]
-            fields = {}
-            for field_name, field_type in struct_def["fields"].items():
-                if field_type in self.struct_name_to_ast:
-                    fields[field_name] = create_value_from_type(Type.STRUCT, field_type)
-                else:
-                    fields[field_name] = create_value_from_type(field_type)
-            return Value(Type.STRUCT, fields, struct_name)
+        return self.expr_table[expr_ast.kind](expr_ast)
+
+    def __eval_var(self, expr_ast):
+        return self.runtime.get_var(expr_ast.get("name"), expr_ast.get("slot"))
+
+    def __eval_new(self, expr_ast):
+        return self.runtime.new_struct(expr_ast.get("var_type"))
 
     def __eval_op(self, arith_ast):
         left_value_obj = self.__eval_expr(arith_ast.get("op1"))
         right_value_obj = self.__eval_expr(arith_ast.get("op2"))
-        if not self.__compatible_types(
-            arith_ast.elem_type, left_value_obj, right_value_obj
-        ):
-            super().error(
-                ErrorType.TYPE_ERROR,
-                f"Incompatible types for {arith_ast.elem_type} operation",
-            )
-        if arith_ast.elem_type not in self.op_to_lambda[left_value_obj.type()]:
-            super().error(
-                ErrorType.TYPE_ERROR,
-                f"Incompatible operator {arith_ast.elem_type} for type {left_value_obj.type()}",
-            )
-        f = self.op_to_lambda[left_value_obj.type()][arith_ast.elem_type]
-        return f(left_value_obj, right_value_obj)
-
-    def __compatible_types(self, oper, obj1, obj2):
-        # DOCUMENT: allow comparisons ==/!= of anything against anything
-        
-        # TODO: Should I just return false here? 
-        if obj1 == Type.VOID or obj2 == Type.VOID:
-            return False
-
-        obj1_type = obj1.type()
-        obj2_type = obj2.type()
-        if oper == "==" or oper == "!=":
-            # Ints can be compared to other ints and bools (coercision)
-            if (obj1_type == Type.INT and obj2_type == Type.BOOL) or (obj1_type == Type.INT and obj2_type == Type.INT):
-                return True
-            # Strings can be compared to other strings
-            if (obj1_type == Type.STRING) and (obj2_type == Type.STRING):
-                return True
-            # Bools can be compared to other bools and ints (coercision)
-            if (obj1_type == Type.BOOL and obj2_type == Type.BOOL) or (obj1_type == Type.BOOL and obj2_type == Type.INT):
-                return True
-            # Structs can be compared to other structs and nil
-            if (obj1_type == Type.STRUCT and obj2_type == Type.STRUCT and obj1.value().keys() == obj2.value().keys()) \
-            or (obj1_type == Type.STRUCT and obj2_type == Type.NIL) \
-            or (obj1.type() == Type.STRUCT and obj2.type() == Type.STRUCT and obj1.struct_type() == obj2.struct_type()):
-                return True
-            # Nil can be compared to nil and structs
-            if (obj1_type == Type.NIL and obj2_type == Type.NIL) or (obj1_type == Type.NIL and obj2_type == Type.STRUCT):
-                return True
-            return False
-
-        if oper == "&&" or oper == "||":
-            if (obj1_type == Type.BOOL and obj2_type == Type.BOOL) or (obj1_type == Type.BOOL and obj2_type == Type.INT) or\
-                  (obj1_type == Type.INT and obj2_type == Type.BOOL) or (obj1_type == Type.INT and obj2_type == Type.INT):
-                return True
-            return False
-        
-        if oper in ["<", "<=", ">", ">=", "+", "-", "*", "/"]:
-            if (obj1_type == Type.INT and obj2_type == Type.INT) or (obj1_type == Type.STRING and obj2_type == Type.STRING):
-                return True
-            return False
-        
-        return False
-    
+        if arith_ast.get("checked"):
+            return self.op_to_lambda[left_value_obj.type()][arith_ast.elem_type](left_value_obj, right_value_obj)
+        return self.binary_ops[arith_ast.elem_type](left_value_obj, right_value_obj)
 
-    def __eval_neg_unary(self, arith_ast, t, f):
+    def __eval_neg_unary(self, arith_ast):
         value_obj = self.__eval_expr(arith_ast.get("op1"))
-        if value_obj.type() != t:
-            super().error(
-                ErrorType.TYPE_ERROR,
-                f"Incompatible type for {arith_ast.elem_type} operation",
-            )
-        return Value(t, f(value_obj.value()))
-
+        if arith_ast.get("checked"):
+            return int_value(-1 * value_obj.value())
+        return self.runtime.neg(value_obj)
 
-    def __eval_not_unary(self, arith_ast, t, f):
+    def __eval_not_unary(self, arith_ast):
         value_obj = self.__eval_expr(arith_ast.get("op1"))
-        if value_obj.type() not in t:
-            super().error(
-                ErrorType.TYPE_ERROR,
-                f"Incompatible type for {arith_ast.elem_type} operation",
-            )
-        if value_obj.type() == Type.INT:
-            value_obj = Value(Type.BOOL, value_obj.value() != 0)
-
-        return Value(Type.BOOL, f(value_obj.value()))
+        if arith_ast.get("checked"):
+            return bool_value(not value_obj.value())
+        return self.runtime.logical_not(value_obj)
+
+    # handlers indexed by node kind code. Statement handlers return (status,
+    # return value); other kinds of statements are skipped and other kinds of
+    # expressions evaluate to None.
+    def __setup_dispatch(self):
+        def continue_after(run):
+            def run_statement(statement):
+                run(statement)
+                return (ExecStatus.CONTINUE, Type.NIL)
+            return run_statement
+
+        self.statement_table = dispatch_table({
+            InterpreterBase.FCALL_NODE: continue_after(self.__call_func),
+            "=": continue_after(self.__assign),
+            InterpreterBase.VAR_DEF_NODE: continue_after(self.__var_def),
+            InterpreterBase.RETURN_NODE: self.__do_return,
+            Interpreter.IF_NODE: self.__do_if,
+            Interpreter.FOR_NODE: self.__do_for,
+        }, lambda statement: (ExecStatus.CONTINUE, Type.NIL))
+        expr_handlers = {
+            InterpreterBase.NIL_NODE: lambda expr_ast: Interpreter.NIL_VALUE,
+            InterpreterBase.INT_NODE: lambda expr_ast: int_value(expr_ast.get("val")),
+            InterpreterBase.STRING_NODE: lambda expr_ast: Value(Type.STRING, expr_ast.get("val")),
+            InterpreterBase.BOOL_NODE: lambda expr_ast: bool_value(expr_ast.get("val")),
+            InterpreterBase.VAR_NODE: self.__eval_var,
+            InterpreterBase.FCALL_NODE: self.__call_func,
+            Interpreter.NEG_NODE: self.__eval_neg_unary,
+            Interpreter.NOT_NODE: self.__eval_not_unary,
+            Interpreter.NEW_NODE: self.__eval_new,
+        }
+        for oper in Interpreter.BIN_OPS:
+            expr_handlers[oper] = self.__eval_op
+        self.expr_table = dispatch_table(expr_handlers, lambda expr_ast: None)
 
     def __setup_ops(self):
         self.op_to_lambda = {}
         # set up operations on integers
         self.op_to_lambda[Type.INT] = {}
-        self.op_to_lambda[Type.INT]["+"] = lambda x, y: Value(
-            x.type(), x.value() + y.value()
+        self.op_to_lambda[Type.INT]["+"] = lambda x, y: int_value(
+            x.value() + y.value()
         )
-        self.op_to_lambda[Type.INT]["-"] = lambda x, y: Value(
-            x.type(), x.value() - y.value()
+        self.op_to_lambda[Type.INT]["-"] = lambda x, y: int_value(
+            x.value() - y.value()
         )
-        self.op_to_lambda[Type.INT]["*"] = lambda x, y: Value(
-            x.type(), x.value() * y.value()
+        self.op_to_lambda[Type.INT]["*"] = lambda x, y: int_value(
+            x.value() * y.value()
         )
-        self.op_to_lambda[Type.INT]["/"] = lambda x, y: Value(
-            x.type(), x.value() // y.value()
+        self.op_to_lambda[Type.INT]["/"] = lambda x, y: int_value(
+            x.value() // y.value()
         )
-        self.op_to_lambda[Type.INT]["=="] = lambda x, y: Value(
-            Type.BOOL, x.type() == y.type() and x.value() == y.value()\
+        self.op_to_lambda[Type.INT]["=="] = lambda x, y: bool_value(
+            x.type() == y.type() and x.value() == y.value()\
                 or (y.type() == Type.BOOL and (x.value() != 0) == y.value())
         )
-        self.op_to_lambda[Type.INT]["!="] = lambda x, y: Value(
-            Type.BOOL, not (x.type() == y.type() and x.value() == y.value()\
+        self.op_to_lambda[Type.INT]["!="] = lambda x, y: bool_value(
+            not (x.type() == y.type() and x.value() == y.value()\
                 or (y.type() == Type.BOOL and (x.value() != 0) == y.value()))
 
         )
-        self.op_to_lambda[Type.INT]["<"] = lambda x, y: Value(
-            Type.BOOL, x.value() < y.value()
+        self.op_to_lambda[Type.INT]["<"] = lambda x, y: bool_value(
+            x.value() < y.value()
         )
-        self.op_to_lambda[Type.INT]["<="] = lambda x, y: Value(
-            Type.BOOL, x.value() <= y.value()
+        self.op_to_lambda[Type.INT]["<="] = lambda x, y: bool_value(
+            x.value() <= y.value()
         )
-        self.op_to_lambda[Type.INT][">"] = lambda x, y: Value(
-            Type.BOOL, x.value() > y.value()
+        self.op_to_lambda[Type.INT][">"] = lambda x, y: bool_value(
+            x.value() > y.value()
         )
-        self.op_to_lambda[Type.INT][">="] = lambda x, y: Value(
-            Type.BOOL, x.value() >= y.value()
+        self.op_to_lambda[Type.INT][">="] = lambda x, y: bool_value(
+            x.value() >= y.value()
         )
-        self.op_to_lambda[Type.INT]["||"] = lambda x, y: Value(
-            Type.BOOL, bool(x.value() or y.value())
+        self.op_to_lambda[Type.INT]["||"] = lambda x, y: bool_value(
+            bool(x.value() or y.value())
         )
-        self.op_to_lambda[Type.INT]["&&"] = lambda x, y: Value(
-            Type.BOOL, bool(x.value() and y.value())
+        self.op_to_lambda[Type.INT]["&&"] = lambda x, y: bool_value(
+            bool(x.value() and y.value())
         )
         #  set up operations on strings
         self.op_to_lambda[Type.STRING] = {}
         self.op_to_lambda[Type.STRING]["+"] = lambda x, y: Value(
             x.type(), x.value() + y.value()
         )
-        self.op_to_lambda[Type.STRING]["=="] = lambda x, y: Value(
-            Type.BOOL, x.value() == y.value()
+        self.op_to_lambda[Type.STRING]["=="] = lambda x, y: bool_value(
+            x.value() == y.value()
         )
-        self.op_to_lambda[Type.STRING]["!="] = lambda x, y: Value(
-            Type.BOOL, x.value() != y.value()
+        self.op_to_lambda[Type.STRING]["!="] = lambda x, y: bool_value(
+            x.value() != y.value()
         )
         #  set up operations on bools
         self.op_to_lambda[Type.BOOL] = {}
-        self.op_to_lambda[Type.BOOL]["&&"] = lambda x, y: Value(
-            x.type(), x.value() and y.value()
+        self.op_to_lambda[Type.BOOL]["&&"] = lambda x, y: bool_value(
+            x.value() and y.value()
         )
-        self.op_to_lambda[Type.BOOL]["||"] = lambda x, y: Value(
-            x.type(), x.value() or y.value()
+        self.op_to_lambda[Type.BOOL]["||"] = lambda x, y: bool_value(
+            x.value() or y.value()
         )
-        self.op_to_lambda[Type.BOOL]["=="] = lambda x, y: Value(
-            Type.BOOL, x.type() == y.type() and x.value() == y.value() \
+        self.op_to_lambda[Type.BOOL]["=="] = lambda x, y: bool_value(
+            x.type() == y.type() and x.value() == y.value() \
             or (y.type() == Type.INT and x.value() == (y.value() != 0) )
         )
-        self.op_to_lambda[Type.BOOL]["!="] = lambda x, y: Value(
-            Type.BOOL, not(x.type() == y.type() and x.value() == y.value() \
+        self.op_to_lambda[Type.BOOL]["!="] = lambda x, y: bool_value(
+            not(x.type() == y.type() and x.value() == y.value() \
             or (y.type() == Type.INT and x.value() == (y.value() != 0) ))
         )
 
         #  set up operations on nil
         self.op_to_lambda[Type.NIL] = {}
-        self.op_to_lambda[Type.NIL]["=="] = lambda x, y: Value(
-            Type.BOOL, x.type() == y.type() and x.value() == y.value() or (y.type() == Type.STRUCT and y.value() == {}) 
+        self.op_to_lambda[Type.NIL]["=="] = lambda x, y: bool_value(
+            x.type() == y.type() and x.value() == y.value() or (y.type() == Type.STRUCT and not y.value().fields) 
         )
-        self.op_to_lambda[Type.NIL]["!="] = lambda x, y: Value(
-            Type.BOOL, not(x.type() == y.type() and x.value() == y.value() or (y.type() == Type.STRUCT and y.value() == {}) )
+        self.op_to_lambda[Type.NIL]["!="] = lambda x, y: bool_value(
+            not(x.type() == y.type() and x.value() == y.value() or (y.type() == Type.STRUCT and not y.value().fields) )
         )
 
         #  set up operations on structs 
         # if x is a struct
         self.op_to_lambda[Type.STRUCT] = {}
-        self.op_to_lambda[Type.STRUCT]["=="] = lambda x, y: Value(
-            Type.BOOL, x.value() is y.value() or \
+        self.op_to_lambda[Type.STRUCT]["=="] = lambda x, y: bool_value(
+            x.value() is y.value() or \
             (x.value() == Type.NIL and y.value() == Type.NIL) or \
             (x.type() == Type.STRUCT and y.type() == Type.STRUCT and x.struct_type() == y.struct_type() and x.value() == y.value()) or \
-            (x.type() == Type.STRUCT and y.type() == Type.NIL and x.value() == {})
+            (x.type() == Type.STRUCT and y.type() == Type.NIL and not x.value().fields)
         )
-        self.op_to_lambda[Type.STRUCT]["!="] = lambda x, y: Value(
-            Type.BOOL, not (
+        self.op_to_lambda[Type.STRUCT]["!="] = lambda x, y: bool_value(
+            not (
                 x.value() is y.value() or \
                 (x.value() == Type.NIL and y.value() == Type.NIL) or \
                 (x.type() == Type.STRUCT and y.type() == Type.STRUCT and x.struct_type() == y.struct_type() and x.value() == y.value()) or \
-                (x.type() == Type.STRUCT and y.type() == Type.NIL and x.value() == {})
+                (x.type() == Type.STRUCT and y.type() == Type.NIL and not x.value().fields)
             )
         )
 
     def __do_if(self, if_ast):
         cond_ast = if_ast.get("condition")
         result = self.__eval_expr(cond_ast)
-        if result.type() != Type.BOOL and result.type() != Type.INT:
-            super().error(
-                ErrorType.TYPE_ERROR,
-                "Incompatible type for if condition",
-            )
-        if result.type() == Type.INT:
-            result = Value(Type.BOOL, result.value() != 0)
+        if not if_ast.get("checked"):
+            self.runtime.condition(result, "if")
         if result.value():
             statements = if_ast.get("statements")
-            status, return_val = self.__run_statements(statements)
+            status, return_val = self.__run_statements(statements, if_ast.get("layout"))
             return (status, return_val)
         else:
             else_statements = if_ast.get("else_statements")
             if else_statements is not None:
-                status, return_val = self.__run_statements(else_statements)
+                status, return_val = self.__run_statements(else_statements, if_ast.get("else_layout"))
                 return (status, return_val)
 
         return (ExecStatus.CONTINUE, Interpreter.NIL_VALUE)
@@ -553,14 +481,11 @@ class Interpreter(InterpreterBase):
         run_for = Interpreter.TRUE_VALUE
         while run_for.value():
             run_for = self.__eval_expr(cond_ast)  # check for-loop condition
-            if run_for.type() != Type.BOOL and run_for.type() != Type.INT:
-                super().error(
-                    ErrorType.TYPE_ERROR,
-                    "Incompatible type for for condition",
-                )
+            if not for_ast.get("checked"):
+                self.runtime.condition(run_for, "for")
             if run_for.value():
                 statements = for_ast.get("statements")
-                status, return_val = self.__run_statements(statements)
+                status, return_val = self.__run_statements(statements, for_ast.get("layout"))
                 if status == ExecStatus.RETURN:
                     return status, return_val
                 self.__run_statement(update_ast)  # update counter variable
@@ -570,11 +495,8 @@ class Interpreter(InterpreterBase):
     def __do_return(self, return_ast):
         expr_ast = return_ast.get("expression")
         if expr_ast is None:
-            return (ExecStatus.RETURN, Interpreter.NIL_VALUE)
-        value_obj = copy.copy(self.__eval_expr(expr_ast))
-        if value_obj.type() == Type.NIL:
-            super().error(ErrorType.TYPE_ERROR, "Cannot return nil")
-        return (ExecStatus.RETURN, value_obj)
+            return (ExecStatus.RETURN, create_value_from_type(Type.NIL))
+        return (ExecStatus.RETURN, self.runtime.return_value(self.__eval_expr(expr_ast), return_ast.get("copy")))
 
 
 if __name__ == "__main__":
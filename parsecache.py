@@ -0,0 +1,127 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from ply import yacc
+
+import brewparse
+from flatast import FORMAT_VERSION, FlatAST
+
+
+# the grammar signature ply compares against parsetab._lr_signature to decide
+# whether the parse tables are stale, computed from brewparse itself so it is
+# current even on the run that regenerates parsetab. In fast-start mode the
+# tables are used without that check, so their own signature is the one that
+# describes the trees being parsed.
+def grammar_signature():
+    global _signature
+    if _signature is None:
+        if brewparse.FAST_START:
+            import parsetab
+            _signature = parsetab._lr_signature
+        else:
+            pinfo = yacc.ParserReflect(vars(brewparse))
+            pinfo.get_all()
+            _signature = pinfo.signature()
+    return _signature
+
+
+_signature = None
+
+
+# Opt-in cache of parsed programs, keyed by a hash of the source and the
+# grammar, so a changed grammar never serves stale trees. Entries are kept as
+# FlatASTs, in memory with LRU eviction and, if cache_dir is given, as .brast
+# files there too. Every hit builds a fresh tree, since the interpreters
+# annotate the tree they run. A parse that printed syntax errors (the parser
+# recovered from them) isn't kept, so the errors are printed on every parse. A
+# cache can be shared between threads.
+#
+#   cache = ParseCache(cache_dir="...")
+#   ast = parse_program(source, cache)   # or cache.parse(source)
+class ParseCache:
+    def __init__(self, max_entries=128, cache_dir=None):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+        self.entries = OrderedDict()  # key -> FlatAST, least recently used first
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(program):
+        h = hashlib.sha256()
+        h.update(f"{FORMAT_VERSION}:".encode())
+        h.update(grammar_signature().encode())
+        h.update(b"\0")
+        h.update(program.encode())
+        return h.hexdigest()
+
+    def __path(self, key):
+        return os.path.join(self.cache_dir, key + ".brast")
+
+    # parser is the brewparse parser to use on a miss; they all build the same trees
+    def parse(self, program, parser="lalr"):
+        key = ParseCache.key(program)
+        with self.lock:
+            flat = self.entries.get(key)
+            if flat is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+        if flat is not None:
+            return flat.to_tree()
+        flat = self.__load(key)
+        if flat is not None:
+            with self.lock:
+                self.disk_hits += 1
+            self.__remember(key, flat)
+            return flat.to_tree()
+        with self.lock:
+            self.misses += 1
+        syntax_errors = brewparse.syntax_error_count()
+        ast = brewparse.parse_program(program, parser=parser)
+        if brewparse.syntax_error_count() != syntax_errors:
+            return ast
+        flat = FlatAST.from_tree(ast)
+        self.__remember(key, flat)
+        self.__store(key, flat)
+        return ast
+
+    def __remember(self, key, flat):
+        with self.lock:
+            self.entries[key] = flat
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def __load(self, key):
+        if self.cache_dir is None:
+            return None
+        try:
+            return FlatAST.load(self.__path(key))
+        except (OSError, ValueError):
+            return None
+
+    def __store(self, key, flat):
+        if self.cache_dir is None:
+            return
+        # write to a temporary file first so readers never see a partial entry
+        tmp_path = f"{self.__path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        flat.save(tmp_path)
+        os.replace(tmp_path, self.__path(key))
+
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self.entries),
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
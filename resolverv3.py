@@ -0,0 +1,117 @@
+from element import FieldPath
+from intbase import InterpreterBase
+
+
+# Resolves every variable reference to the block that defines it, once, before
+# the program runs. Brewin scopes are lexical within a function and a block's
+# variables are defined in statement order, so the innermost definition that
+# comes before a reference is the one the environment would find at runtime.
+#
+# Annotations (see env_v3 for the block layout):
+#   "layout" on func nodes (parameters), and "body_layout" on func nodes, "layout"
+#     and "else_layout" on if nodes, "layout" on for nodes: the name -> slot dict
+#     for that block
+#   "slot" on var and assignment nodes: (block depth, slot) of the variable the
+#     name starts with, or None if no definition is in scope
+#
+# It also finds where a call or return has to copy a Value. A variable or field
+# holds the Value assigned to it, not a copy, and assigning a Value to a struct
+# variable gives it that variable's struct type, so a callee's parameter or a
+# call's result must not be a Value the caller's variables or fields can reach
+# whenever the callee could keep or retype it. Other expressions (operators,
+# calls, new, literals) evaluate to a new or shared Value, and env_v3 copies a
+# shared one when it stores it. That is why print gives the shared nil rather
+# than the interpreter's NIL_VALUE (see Runtime.print_result).
+#   "copy_args" on func nodes: for each parameter, whether it is assigned to a
+#     variable or field anywhere in the body, so an argument it could share with
+#     the caller has to be copied
+#   "alias_args" on fcall nodes: for each argument, whether it is a variable or
+#     field (or nil, which is always the same Value), whose Value others hold
+#   "copy" on return nodes: whether the returned Value is a variable or field's
+class Resolver:
+    def __init__(self, func_name_to_ast):
+        self.func_name_to_ast = func_name_to_ast
+
+    # resolves every function whose body has been parsed (see brewlazy)
+    def resolve(self):
+        for overloads in self.func_name_to_ast.values():
+            for func_ast in overloads.values():
+                if func_ast.get("statements") is not None:
+                    self.resolve_func(func_ast)
+
+    def resolve_func(self, func_ast):
+        # the parameters go in the function's first block; a repeated name keeps its first slot
+        params = {}
+        for arg in func_ast.get("args"):
+            if arg.get("name") not in params:
+                params[arg.get("name")] = len(params) + 1
+        self.scopes = [params]
+        self.assigned = set()
+        func_ast.set("layout", params)
+        func_ast.set("body_layout", self.__resolve_block(func_ast.get("statements")))
+        func_ast.set("copy_args", tuple(arg.get("name") in self.assigned for arg in func_ast.get("args")))
+
+    def __resolve_block(self, statements):
+        layout = {}
+        self.scopes.append(layout)
+        for statement in statements:
+            self.__resolve_statement(statement)
+        self.scopes.pop()
+        return layout
+
+    def __lookup(self, symbol):
+        name, _ = FieldPath.split(symbol)
+        for depth in range(len(self.scopes) - 1, -1, -1):
+            slot = self.scopes[depth].get(name)
+            if slot is not None:
+                return (depth, slot)
+        return None
+
+    def __resolve_statement(self, statement):
+        kind = statement.elem_type
+        if kind == InterpreterBase.FCALL_NODE:
+            self.__resolve_expr(statement)
+        elif kind == "=":
+            self.__resolve_assign(statement)
+        elif kind == InterpreterBase.VAR_DEF_NODE:
+            # a duplicate definition fails at runtime, so it never takes a slot
+            layout = self.scopes[-1]
+            if statement.get("name") not in layout:
+                layout[statement.get("name")] = len(layout) + 1
+        elif kind == InterpreterBase.RETURN_NODE:
+            if statement.get("expression") is not None:
+                self.__resolve_expr(statement.get("expression"))
+                statement.set("copy", statement.get("expression").elem_type == InterpreterBase.VAR_NODE)
+        elif kind == InterpreterBase.IF_NODE:
+            self.__resolve_expr(statement.get("condition"))
+            statement.set("layout", self.__resolve_block(statement.get("statements")))
+            if statement.get("else_statements") is not None:
+                statement.set("else_layout", self.__resolve_block(statement.get("else_statements")))
+        elif kind == InterpreterBase.FOR_NODE:
+            self.__resolve_assign(statement.get("init"))
+            self.__resolve_expr(statement.get("condition"))
+            statement.set("layout", self.__resolve_block(statement.get("statements")))
+            self.__resolve_assign(statement.get("update"))
+
+    def __resolve_assign(self, assign_ast):
+        expr_ast = assign_ast.get("expression")
+        self.__resolve_expr(expr_ast)
+        if expr_ast.elem_type == InterpreterBase.VAR_NODE:
+            self.assigned.add(expr_ast.get("name"))
+        assign_ast.set("slot", self.__lookup(assign_ast.get("name")))
+
+    def __resolve_expr(self, expr_ast):
+        if expr_ast.elem_type == InterpreterBase.VAR_NODE:
+            expr_ast.set("slot", self.__lookup(expr_ast.get("name")))
+            return
+        for key in ("op1", "op2"):
+            operand = expr_ast.get(key)
+            if operand is not None:
+                self.__resolve_expr(operand)
+        args = expr_ast.get("args")
+        if args is not None:
+            for arg in args:
+                self.__resolve_expr(arg)
+            if expr_ast.elem_type == InterpreterBase.FCALL_NODE:
+                expr_ast.set("alias_args", tuple(arg.elem_type == InterpreterBase.VAR_NODE
+                                                 or arg.elem_type == InterpreterBase.NIL_NODE for arg in args))
@@ -0,0 +1,392 @@
+from env_v3 import VariableError
+from intbase import InterpreterBase, ErrorType
+from type_valuev3 import Type, Value, bool_value, get_printable, create_value_from_type, int_value, struct_defaults
+
+
+# Runtime holds the Brewin v3 semantics that don't depend on how the AST is
+# walked: type checks, coercions, operators, variable access and function
+# lookup. The alternative execution engines (closure compiler, bytecode VM,
+# python transpiler) share it so that they behave exactly like the tree
+# walking interpreter in interpreterv3.py.
+class Runtime:
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.error = interpreter.error
+        self.env = interpreter.env
+        self.struct_name_to_ast = interpreter.struct_name_to_ast
+        self.func_name_to_ast = interpreter.func_name_to_ast
+        self.op_to_lambda = interpreter.op_to_lambda
+        self.nil_value = interpreter.NIL_VALUE
+        # what print gives: the shared nil, which env_v3 copies when it stores
+        # it, and not nil_value, which a struct parameter it was bound to
+        # would retype for the whole program (see resolverv3)
+        self.print_result = create_value_from_type(Type.NIL)
+
+    def get_func_by_name(self, name, num_params):
+        if name not in self.func_name_to_ast:
+            self.error(ErrorType.NAME_ERROR, f"Function {name} not found")
+        candidate_funcs = self.func_name_to_ast[name]
+        if num_params not in candidate_funcs:
+            self.error(
+                ErrorType.NAME_ERROR,
+                f"Function {name} taking {num_params} params not found",
+            )
+        func_ast = candidate_funcs[num_params]
+        if func_ast.get("lazy_body") is not None:
+            self.interpreter.load_func_body(func_ast)
+        return func_ast
+
+    # type check (and coerce) an already evaluated actual parameter; shared is
+    # whether it may be a Value the caller holds that the callee could keep or
+    # retype, which the callee gets a copy of (see resolverv3)
+    def bind_arg(self, formal_type, result, shared=False):
+        if shared:
+            result = Value(result.t, result.v, result.s)
+        if result.type() == Type.STRUCT:
+            result_type = result.struct_type()
+        else:
+            result_type = result.type()
+        if formal_type != result_type:
+            if formal_type == Type.BOOL and result_type == Type.INT:
+                result = bool_value(result.value() != 0)
+            elif formal_type in self.struct_name_to_ast and result_type == Type.NIL:
+                pass
+            else:
+                self.error(
+                    ErrorType.TYPE_ERROR,
+                    f"Expected type {formal_type}, got {result_type}",
+                )
+        return result
+
+    # check the value produced by a function body against its declared return type
+    def coerce_return(self, expected_return_type, return_val):
+        if expected_return_type == InterpreterBase.VOID_DEF:
+            if return_val is self.nil_value or return_val.type() == Type.NIL:
+                return create_value_from_type(Type.VOID, None)
+            self.error(
+                ErrorType.TYPE_ERROR,
+                f"Expected return type {expected_return_type}, got {return_val.type()}",
+            )
+        return_type = return_val.type()
+        if expected_return_type == Type.INT and return_type == Type.NIL:
+            return create_value_from_type(Type.INT)
+        elif expected_return_type == Type.STRING and return_type == Type.NIL:
+            return create_value_from_type(Type.STRING)
+        elif expected_return_type == Type.BOOL and return_type == Type.NIL:
+            return create_value_from_type(Type.BOOL)
+        elif expected_return_type == Type.BOOL and return_type == Type.INT:
+            return bool_value(return_val.value() != 0)
+        elif expected_return_type in self.struct_name_to_ast and return_val.struct_type() != expected_return_type and return_val.struct_type() != None:
+            self.error(
+                ErrorType.TYPE_ERROR,
+                f"Expected return type {expected_return_type}, got {return_val.struct_type()}",
+            )
+        elif expected_return_type in self.struct_name_to_ast and return_type == Type.NIL:
+            # a new inner nil every time: == on nils compares their values by identity
+            return Value(Type.NIL, Value(Type.NIL, None))
+        elif expected_return_type != return_type and not (return_type == Type.STRUCT and return_val.struct_type() == expected_return_type):
+            self.error(
+                ErrorType.TYPE_ERROR,
+                f"Expected return type {expected_return_type}, got {return_type}",
+            )
+        elif expected_return_type not in self.struct_name_to_ast and return_type == Type.STRUCT:
+            self.error(
+                ErrorType.TYPE_ERROR,
+                f"Expected return type {expected_return_type}, got {return_type}",
+            )
+        return return_val
+
+    # coerce_return for one declared return type, which first lets through the
+    # return values that already have the type
+    def return_coercion(self, expected_return_type):
+        coerce_return = self.coerce_return
+        if expected_return_type in self.struct_name_to_ast:
+            def coerce(return_val):
+                if return_val.t == Type.STRUCT and return_val.s == expected_return_type:
+                    return return_val
+                return coerce_return(expected_return_type, return_val)
+        elif expected_return_type in (Type.INT, Type.STRING, Type.BOOL):
+            def coerce(return_val):
+                if return_val.t == expected_return_type:
+                    return return_val
+                return coerce_return(expected_return_type, return_val)
+        else:
+            def coerce(return_val):
+                return coerce_return(expected_return_type, return_val)
+        return coerce
+
+    # shared is the return node's "copy": whether value_obj is a variable or field's Value
+    def return_value(self, value_obj, shared=False):
+        if shared:
+            value_obj = Value(value_obj.t, value_obj.v, value_obj.s)
+        if value_obj.type() == Type.NIL:
+            self.error(ErrorType.TYPE_ERROR, "Cannot return nil")
+        return value_obj
+
+    def printable(self, result):
+        if result.type() == Type.VOID:
+            self.error(ErrorType.TYPE_ERROR, "Cannot print void value")
+        return get_printable(result)
+
+    def print_values(self, values):
+        output = ""
+        for result in values:
+            output = output + self.printable(result)
+        self.interpreter.output(output)
+        return self.print_result
+
+    def check_input_args(self, num_args):
+        if num_args > 1:
+            self.error(
+                ErrorType.NAME_ERROR, "No inputi() function that takes > 1 parameter"
+            )
+
+    def read_input(self, name, prompt=None):
+        if prompt is not None:
+            self.interpreter.output(get_printable(prompt))
+        inp = self.interpreter.get_input()
+        if name == "inputi":
+            return int_value(int(inp))
+        if name == "inputs":
+            return Value(Type.STRING, inp)
+
+    # slot is the variable's (block depth, slot) from resolverv3, if it has one
+    def get_var(self, var_name, slot=None):
+        val = self.env.get(var_name, slot)
+        if val == VariableError.NAME_ERROR:
+            self.error(ErrorType.NAME_ERROR, f"Undefined variable {var_name}")
+        elif val == VariableError.FAULT_ERROR:
+            self.error(ErrorType.FAULT_ERROR, f"Attempt to access field of nil object")
+        elif val == VariableError.TYPE_ERROR:
+            self.error(ErrorType.TYPE_ERROR, f"Attempt to access field of non-struct object")
+        return val
+
+    def assign(self, var_name, value_obj, slot=None):
+        value_type = value_obj.type()
+        assign_variable = self.env.get(var_name, slot)
+        if assign_variable == VariableError.NAME_ERROR:
+            self.error(
+                ErrorType.NAME_ERROR, f"Undefined variable {var_name} in assignment"
+            )
+        elif assign_variable == VariableError.FAULT_ERROR:
+            self.error(
+                ErrorType.FAULT_ERROR, f"Attempt to access field of nil object"
+            )
+        elif assign_variable == VariableError.TYPE_ERROR:
+            self.error(
+                ErrorType.TYPE_ERROR, f"Attempt to access field of non-struct object"
+            )
+        assign_variable_type = assign_variable.type()
+
+        if assign_variable_type != value_type and (assign_variable_type != Type.STRUCT) and \
+            not (assign_variable_type == Type.BOOL and value_type == Type.INT) and \
+            not (assign_variable_type == Type.NIL and value_type == Type.STRUCT):
+            self.error(
+                ErrorType.TYPE_ERROR,
+                f"Expected type {assign_variable_type}, got {value_type}",
+            )
+        if assign_variable_type == Type.BOOL and value_type == Type.INT:
+            value_obj = bool_value(value_obj.value() != 0)
+
+        ret = self.env.set(var_name, value_obj, slot)
+        if ret == VariableError.NAME_ERROR:
+            self.error(
+                ErrorType.NAME_ERROR, f"Undefined variable {var_name} in assignment"
+            )
+        elif ret == VariableError.FAULT_ERROR:
+            self.error(
+                ErrorType.FAULT_ERROR, f"Attempt to access field of nil object"
+            )
+        elif ret == VariableError.TYPE_ERROR:
+            self.error(
+                ErrorType.TYPE_ERROR, f"Attempt to access field of nil object"
+            )
+
+    def var_def(self, var_name, var_type):
+        if var_type in self.struct_name_to_ast:
+            value = create_value_from_type(Type.STRUCT, var_type)
+        elif var_type == Type.INT or var_type == Type.STRING or var_type == Type.BOOL:
+            value = create_value_from_type(var_type)
+        else:
+            self.error(
+                ErrorType.TYPE_ERROR, f"Unknown type {var_type} in variable definition"
+            )
+        if not self.env.create(var_name, value):
+            self.error(
+                ErrorType.NAME_ERROR, f"Duplicate definition for variable {var_name}"
+            )
+
+    def new_struct(self, struct_name):
+        if struct_name not in self.struct_name_to_ast:
+            self.error(ErrorType.TYPE_ERROR, f"Unknown struct type {struct_name}")
+        struct_def = self.struct_name_to_ast[struct_name]
+        defaults = struct_def.get("defaults")
+        if defaults is None:
+            # made on the first new, so a field of an unknown type is only an error then
+            defaults = struct_def["defaults"] = struct_defaults(struct_def["fields"], self.struct_name_to_ast)
+        return Value(Type.STRUCT, struct_def["class"](*defaults), struct_name)
+
+    # returns a function that applies oper to two Values; the operator class
+    # is resolved here, once, rather than on every evaluation
+    def make_binary_op(self, oper):
+        error = self.error
+        op_to_lambda = self.op_to_lambda
+        if oper == "==" or oper == "!=":
+            compatible = Runtime.__equality_compatible
+        elif oper == "&&" or oper == "||":
+            compatible = Runtime.__logical_compatible
+        else:
+            compatible = Runtime.__arith_compatible
+
+        def binary_op(left_value_obj, right_value_obj):
+            if not compatible(left_value_obj, right_value_obj):
+                error(
+                    ErrorType.TYPE_ERROR,
+                    f"Incompatible types for {oper} operation",
+                )
+            ops = op_to_lambda[left_value_obj.type()]
+            if oper not in ops:
+                error(
+                    ErrorType.TYPE_ERROR,
+                    f"Incompatible operator {oper} for type {left_value_obj.type()}",
+                )
+            return ops[oper](left_value_obj, right_value_obj)
+
+        return binary_op
+
+    @staticmethod
+    def __equality_compatible(obj1, obj2):
+        obj1_type = obj1.type()
+        obj2_type = obj2.type()
+        if obj1_type == Type.INT and (obj2_type == Type.BOOL or obj2_type == Type.INT):
+            return True
+        if obj1_type == Type.STRING and obj2_type == Type.STRING:
+            return True
+        if obj1_type == Type.BOOL and (obj2_type == Type.BOOL or obj2_type == Type.INT):
+            return True
+        if obj1_type == Type.STRUCT:
+            if obj2_type == Type.NIL:
+                return True
+            if obj2_type == Type.STRUCT and (obj1.value().field_set == obj2.value().field_set
+                                             or obj1.struct_type() == obj2.struct_type()):
+                return True
+        if obj1_type == Type.NIL and (obj2_type == Type.NIL or obj2_type == Type.STRUCT):
+            return True
+        return False
+
+    @staticmethod
+    def __logical_compatible(obj1, obj2):
+        obj1_type = obj1.type()
+        obj2_type = obj2.type()
+        return (obj1_type == Type.BOOL or obj1_type == Type.INT) and \
+            (obj2_type == Type.BOOL or obj2_type == Type.INT)
+
+    @staticmethod
+    def __arith_compatible(obj1, obj2):
+        obj1_type = obj1.type()
+        obj2_type = obj2.type()
+        return (obj1_type == Type.INT and obj2_type == Type.INT) or \
+            (obj1_type == Type.STRING and obj2_type == Type.STRING)
+
+    def neg(self, value_obj):
+        if value_obj.type() != Type.INT:
+            self.error(
+                ErrorType.TYPE_ERROR,
+                f"Incompatible type for {InterpreterBase.NEG_NODE} operation",
+            )
+        return int_value(-1 * value_obj.value())
+
+    def logical_not(self, value_obj):
+        value_type = value_obj.type()
+        if value_type != Type.BOOL and value_type != Type.INT:
+            self.error(
+                ErrorType.TYPE_ERROR,
+                f"Incompatible type for {InterpreterBase.NOT_NODE} operation",
+            )
+        if value_type == Type.INT:
+            return bool_value(not (value_obj.value() != 0))
+        return bool_value(not value_obj.value())
+
+    def condition(self, result, what):
+        if result.type() != Type.BOOL and result.type() != Type.INT:
+            self.error(
+                ErrorType.TYPE_ERROR,
+                f"Incompatible type for {what} condition",
+            )
+        return result.value()
+
+
+# python runtimev3.py [depth]: times recursive calls on every engine and counts
+# the Values made per call (arguments, returns and everything else)
+if __name__ == "__main__":
+    import sys
+    import time
+
+    from interpreterv3 import Interpreter
+
+    depth = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    rounds = 50
+    programs = {
+        "computed args": f"""
+func down(n : int, acc : int) : int {{
+  if (n == 0) {{ return acc; }}
+  return down(n - 1, acc + 1);
+}}
+func main() : void {{
+  var i : int;
+  for (i = 0; i < {rounds}; i = i + 1) {{ down({depth}, 0); }}
+  print(down({depth}, 0));
+}}
+""",
+        "variable args": f"""
+func down(n : int, flag : bool, name : string) : int {{
+  var m : int;
+  if (n == 0) {{ return n; }}
+  m = n - 1;
+  return down(m, flag, name);
+}}
+func main() : void {{
+  var i : int;
+  for (i = 0; i < {rounds}; i = i + 1) {{ down({depth}, true, "x"); }}
+  print(down({depth}, false, "y"));
+}}
+""",
+        "struct args": f"""
+struct node {{ val : int; next : node; }}
+func length(n : node, acc : int) : int {{
+  if (n == nil) {{ return acc; }}
+  return length(n.next, acc + 1);
+}}
+func main() : void {{
+  var head : node; var n : node; var i : int;
+  for (i = 0; i < {depth}; i = i + 1) {{ n = new node; n.next = head; head = n; }}
+  for (i = 0; i < {rounds}; i = i + 1) {{ length(head, 0); }}
+  print(length(head, 0));
+}}
+""",
+    }
+    engines = ("tree", "closure", "bytecode", "python")
+    calls = (rounds + 1) * (depth + 1)
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), depth * 20))
+    times = {}
+    for name, program in programs.items():
+        for engine in engines:
+            start = time.perf_counter()
+            Interpreter(console_output=False, engine=engine).run(program)
+            times[name, engine] = (time.perf_counter() - start) / calls
+
+    # counts every Value made from here on, including copy.copy's, which
+    # don't go through __init__
+    made = [0]
+
+    def counting_new(cls, *args):
+        made[0] += 1
+        return object.__new__(cls)
+
+    Value.__new__ = staticmethod(counting_new)
+    for name, program in programs.items():
+        for engine in engines:
+            made[0] = 0
+            Interpreter(console_output=False, engine=engine).run(program)
+            print(f"{name:14} {engine:8} {times[name, engine] * 1e6:6.2f} us per call, "
+                  f"{made[0] / calls:5.2f} Values made per call")
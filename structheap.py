@@ -0,0 +1,382 @@
+from array import array
+
+from element import FieldPath, field_slot
+from intbase import InterpreterBase
+from type_valuev3 import SHARED_EMPTY_STRING, Struct, Type, Value, bool_value, int_value
+
+# A columnar heap for structs, for programs that build very large object graphs
+# (Interpreter(struct_heap=True)). Each struct type with fields gets a row per
+# struct and a column per field, and a struct is its row number in its type's
+# columns:
+#
+#   int fields      array('q') of the ints
+#   bool fields     array('b'), 1 for true and 0 for false
+#   struct fields   array('q') of rows of the field's struct type, or NIL_ROW /
+#                   EMPTY_ROW for nil and a struct that was never given one
+#   other fields    a list of the field values (the str of a string)
+#
+# so a node with an int and a struct field takes 16 bytes of columns, where a
+# slotted struct instance and its field Values take well over a hundred. A
+# value a column can't hold (an int past 64 bits, a struct of another type, a
+# bool operator's int result, ...) is kept as it is in the column's overflow
+# dict, and the column holds an OVERFLOW marker for it.
+#
+# The struct object in a Value is a HeapStruct, which holds only the row; each
+# struct type has its own subclass, whose field slots are properties that read
+# and write the columns. env_v3 and the struct operators go through the same
+# getattr/setattr and Struct interface as with the slotted classes, so the
+# engines run unchanged. Reading a field makes its Value from the column, so
+# two reads of a field give equal Values rather than the same one; structs
+# compare equal only as the same row of the same type, and a struct Value read
+# from a field has the field struct's own type. With slotted structs two
+# structs whose fields hold the very same Values also compare equal, and a
+# field's struct Value can keep the type of a variable it was assigned to.
+# heap_hazard finds the programs that could tell the difference, and the
+# interpreter runs those with slotted structs instead.
+#
+# Rows are never freed: the heap suits programs that build their structures
+# and keep them.
+
+INT_MIN = -2 ** 63
+INT_MAX = 2 ** 63 - 1
+
+OVERFLOW_INT = INT_MIN
+OVERFLOW_BOOL = -1
+NIL_ROW = -1
+EMPTY_ROW = -2
+OVERFLOW_ROW = -3
+
+INT_FIELD = "int"
+BOOL_FIELD = "bool"
+STRUCT_FIELD = "struct"
+VALUE_FIELD = "value"
+
+
+class HeapStruct(Struct):
+    __slots__ = ("row",)
+    keeps_defaults = False  # each read makes a Value from the columns
+
+    def __eq__(self, other):
+        return self is other or (other.__class__ is self.__class__ and other.row == self.row)
+
+    __hash__ = None
+
+
+# the columns of a struct type and the class of its structs
+class StructColumns:
+    def __init__(self, name, field_types):
+        self.name = name
+        self.field_types = field_types
+        self.rows = 0
+        self.columns = []
+        self.overflows = []
+        self.kinds = []
+        self.cls = None
+
+
+class StructHeap:
+    # nil_value is the interpreter's NIL_VALUE, which a struct column keeps as NIL_ROW
+    def __init__(self, nil_value):
+        self.nil_value = nil_value
+        self.types = {}
+
+    # gives every struct type with fields in struct_name_to_ast a column store
+    # and puts its HeapStruct class in the type's "class" entry
+    def install(self, struct_name_to_ast):
+        self.types = {}
+        for name, struct_def in struct_name_to_ast.items():
+            if struct_def["fields"]:
+                self.types[name] = StructColumns(name, struct_def["fields"])
+        for columns in self.types.values():
+            self.__make_class(columns)
+        for name, columns in self.types.items():
+            struct_name_to_ast[name]["class"] = columns.cls
+
+    def __make_class(self, columns):
+        slots = tuple(field_slot(field) for field in columns.field_types)
+        attrs = {
+            "__slots__": (),
+            "fields": tuple(columns.field_types),
+            "slots": slots,
+            "field_set": frozenset(columns.field_types),
+        }
+        for slot, field_type in zip(slots, columns.field_types.values()):
+            overflow = {}
+            if field_type == Type.INT:
+                kind, column, accessors = INT_FIELD, array("q"), int_accessors
+            elif field_type == Type.BOOL:
+                kind, column, accessors = BOOL_FIELD, array("b"), bool_accessors
+            elif field_type in self.types:
+                kind, column = STRUCT_FIELD, array("q")
+                accessors = self.__struct_accessors(self.types[field_type])
+            else:
+                kind, column, accessors = VALUE_FIELD, [], value_accessors
+            columns.kinds.append(kind)
+            columns.columns.append(column)
+            columns.overflows.append(overflow)
+            attrs[slot] = property(*accessors(column, overflow))
+        setters = [attrs[slot].fset for slot in slots]
+        placeholders = [EMPTY_ROW if kind == STRUCT_FIELD else None if kind == VALUE_FIELD else 0
+                        for kind in columns.kinds]
+        new_row = list(zip(columns.columns, placeholders))
+
+        # a new struct: a row of placeholders, then the field values
+        def __init__(self, *values):
+            self.row = columns.rows
+            columns.rows += 1
+            for column, placeholder in new_row:
+                column.append(placeholder)
+            for setter, value in zip(setters, values):
+                setter(self, value)
+
+        attrs["__init__"] = __init__
+        columns.cls = type(columns.name, (HeapStruct,), attrs)
+
+    # the property of a field of struct type target
+    def __struct_accessors(self, target):
+        nil_value = self.nil_value
+        name = target.name
+
+        def accessors(column, overflow):
+            def get(self):
+                row = column[self.row]
+                if row >= 0:
+                    struct = object.__new__(target.cls)
+                    struct.row = row
+                    return Value(Type.STRUCT, struct, name)
+                if row == NIL_ROW:
+                    return nil_value
+                if row == EMPTY_ROW:
+                    return Value(Type.STRUCT, Struct(), name)
+                return overflow[self.row]
+
+            def set(self, value):
+                row = self.row
+                if column[row] == OVERFLOW_ROW:
+                    del overflow[row]
+                struct = value.v
+                if struct.__class__ is target.cls and value.s == name:
+                    column[row] = struct.row
+                elif value is nil_value:
+                    column[row] = NIL_ROW
+                elif struct.__class__ is Struct and value.t == Type.STRUCT and value.s == name:
+                    column[row] = EMPTY_ROW
+                else:
+                    column[row] = OVERFLOW_ROW
+                    overflow[row] = value
+
+            return get, set
+
+        return accessors
+
+
+# A description of the first thing in the program that could run differently
+# in a StructHeap, or None. That is a == or != whose operands could both be
+# structs, or assigning a variable or field to a struct variable of another
+# declared type, which gives the struct Value the variable's type (see
+# env_v3.set) and could give it to a field's Value too. Every function body
+# must have been parsed. The check goes by declared types, so it also stops
+# programs that never compare or retype structs at runtime.
+def heap_hazard(struct_name_to_ast, func_name_to_ast):
+    return HeapHazards(struct_name_to_ast, func_name_to_ast).find()
+
+
+class HeapHazards:
+    def __init__(self, struct_name_to_ast, func_name_to_ast):
+        self.struct_name_to_ast = struct_name_to_ast
+        self.func_name_to_ast = func_name_to_ast
+
+    def find(self):
+        for overloads in self.func_name_to_ast.values():
+            for func_ast in overloads.values():
+                self.func_name = func_ast.get("name")
+                self.scopes = [{arg.get("name"): arg.get("var_type") for arg in func_ast.get("args")}]
+                hazard = self.__block(func_ast.get("statements"))
+                if hazard is not None:
+                    return hazard
+        return None
+
+    def __block(self, statements):
+        self.scopes.append({})
+        hazard = None
+        for statement in statements:
+            hazard = self.__statement(statement)
+            if hazard is not None:
+                break
+        self.scopes.pop()
+        return hazard
+
+    def __statement(self, statement):
+        kind = statement.elem_type
+        if kind == InterpreterBase.VAR_DEF_NODE:
+            # a duplicate definition fails at runtime, so the first one stays in effect
+            self.scopes[-1].setdefault(statement.get("name"), statement.get("var_type"))
+            return None
+        if kind == "=":
+            return self.__assign(statement)
+        if kind == InterpreterBase.RETURN_NODE:
+            expr_ast = statement.get("expression")
+            return None if expr_ast is None else self.__expr(expr_ast)
+        if kind == InterpreterBase.IF_NODE:
+            return (self.__expr(statement.get("condition"))
+                    or self.__block(statement.get("statements"))
+                    or self.__block(statement.get("else_statements") or []))
+        if kind == InterpreterBase.FOR_NODE:
+            return (self.__assign(statement.get("init"))
+                    or self.__expr(statement.get("condition"))
+                    or self.__block(statement.get("statements"))
+                    or self.__assign(statement.get("update")))
+        return self.__expr(statement)
+
+    def __assign(self, assign_ast):
+        expr_ast = assign_ast.get("expression")
+        var_type = self.__declared_type(assign_ast.get("name"))
+        if "." not in assign_ast.get("name") and var_type in self.struct_name_to_ast \
+                and expr_ast.elem_type == InterpreterBase.VAR_NODE:
+            value_type = self.__declared_type(expr_ast.get("name"))
+            if value_type != var_type and (value_type is None or value_type in self.struct_name_to_ast):
+                return f"{self.func_name} assigns {expr_ast.get('name')} to a variable of type {var_type}"
+        return self.__expr(expr_ast)
+
+    def __expr(self, expr_ast):
+        kind = expr_ast.elem_type
+        if kind == "==" or kind == "!=":
+            if self.__may_be_struct(expr_ast.get("op1")) and self.__may_be_struct(expr_ast.get("op2")):
+                return f"{self.func_name} compares structs with {kind}"
+        if kind == InterpreterBase.FCALL_NODE:
+            for arg in expr_ast.get("args"):
+                hazard = self.__expr(arg)
+                if hazard is not None:
+                    return hazard
+            return None
+        for operand in ("op1", "op2"):
+            operand_ast = expr_ast.get(operand)
+            if operand_ast is not None:
+                hazard = self.__expr(operand_ast)
+                if hazard is not None:
+                    return hazard
+        return None
+
+    # whether the expression could give a struct that isn't a new one
+    def __may_be_struct(self, expr_ast):
+        kind = expr_ast.elem_type
+        if kind == InterpreterBase.VAR_NODE:
+            var_type = self.__declared_type(expr_ast.get("name"))
+            return var_type is None or var_type in self.struct_name_to_ast
+        if kind == InterpreterBase.FCALL_NODE:
+            func_ast = self.func_name_to_ast.get(expr_ast.get("name"), {}).get(len(expr_ast.get("args")))
+            return func_ast is not None and func_ast.get("return_type") in self.struct_name_to_ast
+        return False
+
+    # the declared type of a variable or field path, or None if it isn't known
+    def __declared_type(self, name):
+        base, fields = FieldPath.split(name)
+        var_type = None
+        for scope in reversed(self.scopes):
+            if base in scope:
+                var_type = scope[base]
+                break
+        for field in fields:
+            if var_type not in self.struct_name_to_ast:
+                return None
+            var_type = self.struct_name_to_ast[var_type]["fields"].get(field)
+        return var_type
+
+
+def int_accessors(column, overflow):
+    def get(self):
+        n = column[self.row]
+        if n == OVERFLOW_INT:
+            return overflow[self.row]
+        return int_value(n)
+
+    def set(self, value):
+        row = self.row
+        if column[row] == OVERFLOW_INT:
+            del overflow[row]
+        n = value.v
+        if value.t == Type.INT and n.__class__ is int and INT_MIN < n <= INT_MAX:
+            column[row] = n
+        else:
+            column[row] = OVERFLOW_INT
+            overflow[row] = value
+
+    return get, set
+
+
+def bool_accessors(column, overflow):
+    def get(self):
+        b = column[self.row]
+        if b == OVERFLOW_BOOL:
+            return overflow[self.row]
+        return bool_value(b == 1)
+
+    def set(self, value):
+        row = self.row
+        if column[row] == OVERFLOW_BOOL:
+            del overflow[row]
+        b = value.v
+        if value.t == Type.BOOL and (b is True or b is False):
+            column[row] = b
+        else:
+            column[row] = OVERFLOW_BOOL
+            overflow[row] = value
+
+    return get, set
+
+
+# the list column of a field of any other type; a string is kept as its str
+def value_accessors(column, overflow):
+    def get(self):
+        value = column[self.row]
+        if value.__class__ is str:
+            return Value(Type.STRING, value) if value else SHARED_EMPTY_STRING
+        return value
+
+    def set(self, value):
+        if value.t == Type.STRING and value.v.__class__ is str:
+            column[self.row] = value.v
+        else:
+            column[self.row] = value
+
+    return get, set
+
+
+# python structheap.py [nodes] [engine]: builds a linked list with and without
+# the columnar heap, checks they print the same, and compares memory and time
+if __name__ == "__main__":
+    import sys
+    import time
+    import tracemalloc
+
+    from interpreterv3 import Interpreter
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    engine = sys.argv[2] if len(sys.argv) > 2 else "tree"
+    program = f"""
+struct node {{ val : int; next : node; flag : bool; name : string; }}
+func main() : void {{
+  var head : node; var n : node; var i : int; var s : int;
+  for (i = 0; i < {count}; i = i + 1) {{
+    n = new node; n.val = i; n.flag = i > 5; n.next = head; head = n;
+  }}
+  s = 0;
+  for (n = head; n != nil; n = n.next) {{ if (n.flag) {{ s = s + n.val; }} }}
+  print(s);
+}}
+"""
+    outputs = []
+    for struct_heap in (False, True):
+        interpreter = Interpreter(console_output=False, engine=engine, struct_heap=struct_heap)
+        start = time.perf_counter()
+        interpreter.run(program)
+        elapsed = time.perf_counter() - start
+        interpreter = Interpreter(console_output=False, engine=engine, struct_heap=struct_heap)
+        tracemalloc.start()
+        interpreter.run(program)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        outputs.append(interpreter.get_output())
+        print(f"{'columnar' if struct_heap else 'slotted'} heap: {elapsed:.2f} s, "
+              f"{peak / count:.0f} bytes per node at peak")
+    print("same output" if outputs[0] == outputs[1] else f"DIFFERENT OUTPUT {outputs}")
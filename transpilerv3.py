@@ -0,0 +1,385 @@
+import hashlib
+import importlib.util
+import marshal
+import os
+import threading
+from collections import OrderedDict
+
+from element import FieldPath
+from intbase import InterpreterBase, ErrorType
+from runtimev3 import Runtime
+from structheap import heap_hazard
+from type_valuev3 import SHARED_FALSE, SHARED_TRUE, Type, Value, create_value_from_type, int_value, struct_class
+
+# bump whenever the generated code changes shape, so stale cache entries are ignored
+TRANSPILER_VERSION = 7
+
+# python identifiers for the binary operator helpers in the generated module
+OP_NAMES = {
+    "+": "add", "-": "sub", "*": "mul", "/": "div",
+    "==": "eq", "!=": "ne", "<": "lt", "<=": "le", ">": "gt", ">=": "ge",
+    "&&": "and", "||": "or",
+}
+
+# int/int operators that are emitted inline instead of going through Runtime
+INLINE_INT_OPS = {
+    "+": "int_value({l}.v + {r}.v)",
+    "-": "int_value({l}.v - {r}.v)",
+    "*": "int_value({l}.v * {r}.v)",
+    "/": "int_value({l}.v // {r}.v)",
+    "==": "TRUE if {l}.v == {r}.v else FALSE",
+    "!=": "TRUE if {l}.v != {r}.v else FALSE",
+    "<": "TRUE if {l}.v < {r}.v else FALSE",
+    "<=": "TRUE if {l}.v <= {r}.v else FALSE",
+    ">": "TRUE if {l}.v > {r}.v else FALSE",
+    ">=": "TRUE if {l}.v >= {r}.v else FALSE",
+}
+
+
+# Turns a Brewin v3 program into python source: one python function per
+# Brewin overload, named after its (name, arity) key in func_name_to_ast, with
+# the common type checks emitted inline and everything else delegated to the
+# shared Runtime. The generated module defines STRUCTS (the struct table),
+# HEAP_HAZARD (what structheap.heap_hazard says about the program) and run(),
+# which calls main.
+class PythonTranspiler:
+    def __init__(self, interpreter):
+        self.trace_output = interpreter.trace_output
+        self.struct_name_to_ast = interpreter.struct_name_to_ast
+        self.func_name_to_ast = interpreter.func_name_to_ast
+
+    @staticmethod
+    def func_ident(name, num_params):
+        return f"f_{name}_{num_params}"
+
+    def generate(self):
+        self.lines = []
+        self.num_layouts = 0
+        self.paths = {}
+        structs = {name: struct_def["fields"] for name, struct_def in self.struct_name_to_ast.items()}
+        self.__emit(0, f"STRUCTS = {structs!r}")
+        self.__emit(0, f"HEAP_HAZARD = {heap_hazard(self.struct_name_to_ast, self.func_name_to_ast)!r}")
+        for overloads in self.func_name_to_ast.values():
+            for func_ast in overloads.values():
+                self.__gen_func(func_ast)
+        self.__emit(0, "def run():")
+        self.__gen_call_target(1, "return ", "main", 0, [])
+        return "\n".join(self.lines) + "\n"
+
+    def __emit(self, indent, line):
+        self.lines.append("    " * indent + line)
+
+    # block layouts are module constants, so every activation shares one dict
+    def __layout(self, layout):
+        self.num_layouts += 1
+        name = f"LAYOUT_{self.num_layouts}"
+        self.lines.insert(1, f"{name} = {layout!r}")
+        return name
+
+    # the python expression for a variable name; field paths are module
+    # constants too, so the environment gets them already split
+    def __name(self, var_name):
+        if not isinstance(var_name, FieldPath):
+            return repr(var_name)
+        if var_name not in self.paths:
+            self.paths[var_name] = f"PATH_{len(self.paths) + 1}"
+            self.lines.insert(1, f"{self.paths[var_name]} = FieldPath({var_name.base!r}, {var_name.fields!r})")
+        return self.paths[var_name]
+
+    def __temp(self):
+        self.num_temps += 1
+        return f"_t{self.num_temps}"
+
+    def __gen_func(self, func_ast):
+        self.num_temps = 0
+        self.return_type = func_ast.get("return_type")
+        formal_names = [arg.get("name") for arg in func_ast.get("args")]
+        params = [f"a{i}" for i in range(len(formal_names))]
+        ident = self.func_ident(func_ast.get("name"), len(formal_names))
+        self.__emit(0, f"def {ident}({', '.join(params)}):")
+        self.__emit(1, f"env.push_func({self.__layout(func_ast.get('layout'))})")
+        # duplicate parameter names behave like the tree walker's args dict: last value wins
+        bound = {}
+        for name, param in zip(formal_names, params):
+            bound[name] = param
+        for name, param in bound.items():
+            self.__emit(1, f"env.create({name!r}, {param})")
+        self.__gen_block(1, func_ast.get("statements"), func_ast.get("body_layout"))
+        self.__emit(1, "env.pop_func()")
+        self.__emit(1, f"return coerce_return({self.return_type!r}, nil_value)")
+        self.__emit(0, "")
+
+    def __gen_block(self, indent, statements, layout):
+        self.__emit(indent, f"env.push_block({self.__layout(layout)})")
+        for statement in statements:
+            if self.trace_output:
+                self.__emit(indent, f"print({str(statement)!r})")
+            self.__gen_statement(indent, statement)
+        self.__emit(indent, "env.pop_block()")
+
+    def __gen_statement(self, indent, statement):
+        kind = statement.elem_type
+        if kind == InterpreterBase.FCALL_NODE:
+            self.__gen_expr(indent, statement)
+        elif kind == "=":
+            self.__gen_assign(indent, statement)
+        elif kind == InterpreterBase.VAR_DEF_NODE:
+            self.__emit(indent, f"var_def({statement.get('name')!r}, {statement.get('var_type')!r})")
+        elif kind == InterpreterBase.RETURN_NODE:
+            self.__gen_return(indent, statement)
+        elif kind == InterpreterBase.IF_NODE:
+            cond = self.__gen_condition(indent, statement.get("condition"), InterpreterBase.IF_NODE)
+            self.__emit(indent, f"if {cond}.v:")
+            self.__gen_block(indent + 1, statement.get("statements"), statement.get("layout"))
+            else_statements = statement.get("else_statements")
+            if else_statements is not None:
+                self.__emit(indent, "else:")
+                self.__gen_block(indent + 1, else_statements, statement.get("else_layout"))
+        elif kind == InterpreterBase.FOR_NODE:
+            self.__gen_assign(indent, statement.get("init"))
+            self.__emit(indent, "while True:")
+            cond = self.__gen_condition(indent + 1, statement.get("condition"), InterpreterBase.FOR_NODE)
+            self.__emit(indent + 1, f"if not {cond}.v:")
+            self.__emit(indent + 2, "break")
+            self.__gen_block(indent + 1, statement.get("statements"), statement.get("layout"))
+            self.__gen_assign(indent + 1, statement.get("update"))
+        # any other statement (e.g. a bare expression) is ignored, as in the tree walker
+
+    def __gen_condition(self, indent, cond_ast, what):
+        cond = self.__gen_expr(indent, cond_ast)
+        self.__emit(indent, f"if {cond}.t != BOOL and {cond}.t != INT:")
+        self.__emit(indent + 1, f"condition({cond}, {what!r})")
+        return cond
+
+    def __gen_assign(self, indent, assign_ast):
+        value = self.__gen_expr(indent, assign_ast.get("expression"))
+        self.__emit(indent, f"assign({self.__name(assign_ast.get('name'))}, {value}, {assign_ast.get('slot')!r})")
+
+    def __gen_return(self, indent, return_ast):
+        expr_ast = return_ast.get("expression")
+        if expr_ast is None:
+            self.__emit(indent, "env.pop_func()")
+            self.__emit(indent, f"return coerce_return({self.return_type!r}, create_value_from_type(NIL))")
+            return
+        value = self.__gen_expr(indent, expr_ast)
+        self.__emit(indent, f"{value} = return_value({value}{', True' if return_ast.get('copy') else ''})")
+        self.__emit(indent, "env.pop_func()")
+        if self.return_type in self.struct_name_to_ast:
+            self.__emit(indent, f"if {value}.t == STRUCT and {value}.s == {self.return_type!r}:")
+            self.__emit(indent + 1, f"return {value}")
+        elif self.return_type in (Type.INT, Type.STRING, Type.BOOL):
+            self.__emit(indent, f"if {value}.t == {self.return_type!r}:")
+            self.__emit(indent + 1, f"return {value}")
+        self.__emit(indent, f"return coerce_return({self.return_type!r}, {value})")
+
+    # emits the statements that evaluate expr_ast and returns the name of the
+    # python local holding the resulting Value
+    def __gen_expr(self, indent, expr_ast):
+        kind = expr_ast.elem_type
+        result = self.__temp()
+        if kind == InterpreterBase.NIL_NODE:
+            self.__emit(indent, f"{result} = nil_value")
+        elif kind == InterpreterBase.INT_NODE:
+            self.__emit(indent, f"{result} = int_value({expr_ast.get('val')!r})")
+        elif kind == InterpreterBase.STRING_NODE:
+            self.__emit(indent, f"{result} = Value(STRING, {expr_ast.get('val')!r})")
+        elif kind == InterpreterBase.BOOL_NODE:
+            self.__emit(indent, f"{result} = {'TRUE' if expr_ast.get('val') else 'FALSE'}")
+        elif kind == InterpreterBase.VAR_NODE:
+            var_name = expr_ast.get("name")
+            slot = expr_ast.get("slot")
+            if slot is not None and "." not in var_name:
+                self.__emit(indent, f"{result} = env.get({var_name!r}, {slot!r})")
+            else:
+                self.__emit(indent, f"{result} = get_var({self.__name(var_name)}, {slot!r})")
+        elif kind == InterpreterBase.FCALL_NODE:
+            self.__gen_call(indent, result, expr_ast.get("name"), expr_ast.get("args"), expr_ast.get("alias_args"))
+        elif kind in OP_NAMES:
+            left = self.__gen_expr(indent, expr_ast.get("op1"))
+            right = self.__gen_expr(indent, expr_ast.get("op2"))
+            if kind in INLINE_INT_OPS:
+                self.__emit(indent, f"if {left}.t == INT and {right}.t == INT:")
+                self.__emit(indent + 1, f"{result} = {INLINE_INT_OPS[kind].format(l=left, r=right)}")
+                self.__emit(indent, "else:")
+                self.__emit(indent + 1, f"{result} = binop_{OP_NAMES[kind]}({left}, {right})")
+            else:
+                self.__emit(indent, f"{result} = binop_{OP_NAMES[kind]}({left}, {right})")
+        elif kind == InterpreterBase.NEG_NODE:
+            operand = self.__gen_expr(indent, expr_ast.get("op1"))
+            self.__emit(indent, f"{result} = neg({operand})")
+        elif kind == InterpreterBase.NOT_NODE:
+            operand = self.__gen_expr(indent, expr_ast.get("op1"))
+            self.__emit(indent, f"{result} = logical_not({operand})")
+        elif kind == InterpreterBase.NEW_NODE:
+            self.__emit(indent, f"{result} = new_struct({expr_ast.get('var_type')!r})")
+        else:
+            self.__emit(indent, f"{result} = None")
+        return result
+
+    def __gen_call(self, indent, result, func_name, actual_args, alias_args):
+        if func_name == "print":
+            parts = []
+            for arg in actual_args:
+                value = self.__gen_expr(indent, arg)
+                self.__emit(indent, f"{value} = printable({value})")
+                parts.append(value)
+            self.__emit(indent, f"output({' + '.join(parts) or repr('')})")
+            self.__emit(indent, f"{result} = print_result")
+        elif func_name == "inputi" or func_name == "inputs":
+            if len(actual_args) > 1:
+                self.__emit(indent, f"{result} = check_input_args({len(actual_args)})")
+            elif len(actual_args) == 1:
+                prompt = self.__gen_expr(indent, actual_args[0])
+                self.__emit(indent, f"{result} = read_input({func_name!r}, {prompt})")
+            else:
+                self.__emit(indent, f"{result} = read_input({func_name!r})")
+        else:
+            self.__gen_call_target(indent, f"{result} = ", func_name, len(actual_args), actual_args, alias_args)
+
+    def __gen_call_target(self, indent, prefix, func_name, num_params, actual_args, alias_args=()):
+        if func_name not in self.func_name_to_ast:
+            self.__emit(indent, f"name_error({f'Function {func_name} not found'!r})")
+            return
+        if num_params not in self.func_name_to_ast[func_name]:
+            self.__emit(indent, f"name_error({f'Function {func_name} taking {num_params} params not found'!r})")
+            return
+        func_ast = self.func_name_to_ast[func_name][num_params]
+        values = []
+        for formal_ast, arg, alias, copy_arg in zip(func_ast.get("args"), actual_args, alias_args,
+                                                    func_ast.get("copy_args")):
+            value = self.__gen_expr(indent, arg)
+            formal_type = formal_ast.get("var_type")
+            shared = alias and copy_arg
+            # the common case is a value of exactly the declared type, which needs
+            # at most a copy (see resolverv3)
+            if formal_type in self.struct_name_to_ast:
+                exact = f"{value}.t == STRUCT and {value}.s == {formal_type!r}"
+            else:
+                exact = f"{value}.t == {formal_type!r}"
+            if shared:
+                self.__emit(indent, f"if {exact}:")
+                self.__emit(indent + 1, f"{value} = Value({value}.t, {value}.v, {value}.s)")
+                self.__emit(indent, "else:")
+                self.__emit(indent + 1, f"{value} = bind_arg({formal_type!r}, {value}, True)")
+            else:
+                self.__emit(indent, f"if not ({exact}):")
+                self.__emit(indent + 1, f"{value} = bind_arg({formal_type!r}, {value})")
+            values.append(value)
+        self.__emit(indent, f"{prefix}{self.func_ident(func_name, num_params)}({', '.join(values)})")
+
+
+# Keeps compiled code objects for transpiled programs, keyed by a hash of the
+# Brewin source. Entries are held in memory, shared by every cache in this
+# process, with LRU eviction past MAX_MEMORY_ENTRIES and, when a directory is
+# given, marshalled to disk so later processes can skip parsing and code
+# generation. A program whose parse printed syntax errors is never put in the
+# cache (see brewparse.report_syntax_error), so every run prints them.
+class CodeCache:
+    MAX_MEMORY_ENTRIES = 128
+    memory = OrderedDict()  # key -> code object, least recently used first
+    lock = threading.Lock()
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(program, trace_output=False, static_check=False):
+        h = hashlib.sha256()
+        h.update(importlib.util.MAGIC_NUMBER)
+        h.update(f"{TRANSPILER_VERSION}:{int(bool(trace_output))}:{int(bool(static_check))}:".encode())
+        h.update(program.encode())
+        return h.hexdigest()
+
+    def __path(self, key):
+        return os.path.join(self.cache_dir, key + ".brewc")
+
+    def get(self, key):
+        with CodeCache.lock:
+            code = CodeCache.memory.get(key)
+            if code is not None:
+                CodeCache.memory.move_to_end(key)
+        if code is not None or self.cache_dir is None:
+            return code
+        try:
+            with open(self.__path(key), "rb") as f:
+                code = marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        CodeCache.__remember(key, code)
+        return code
+
+    def put(self, key, code):
+        CodeCache.__remember(key, code)
+        if self.cache_dir is None:
+            return
+        # write to a temporary file first so readers never see a partial entry
+        tmp_path = f"{self.__path(key)}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            marshal.dump(code, f)
+        os.replace(tmp_path, self.__path(key))
+
+    @staticmethod
+    def __remember(key, code):
+        with CodeCache.lock:
+            CodeCache.memory[key] = code
+            CodeCache.memory.move_to_end(key)
+            if len(CodeCache.memory) > CodeCache.MAX_MEMORY_ENTRIES:
+                CodeCache.memory.popitem(last=False)
+
+
+def compile_program(interpreter):
+    source = PythonTranspiler(interpreter).generate()
+    return compile(source, "<brewin>", "exec")
+
+
+# executes a compiled program; if the struct table is empty (the code came out
+# of the cache and the program was never parsed) it is rebuilt from STRUCTS.
+# With struct_heap, HEAP_HAZARD decides whether the structs go in the heap.
+def run_code(interpreter, code):
+    namespace = {"FieldPath": FieldPath}
+    exec(code, namespace)
+    if not interpreter.struct_name_to_ast:
+        for name, fields in namespace["STRUCTS"].items():
+            interpreter.struct_name_to_ast[name] = {"fields": fields, "ast": None, "class": struct_class(name, fields)}
+    if interpreter.heap is not None:
+        interpreter.install_heap(namespace["HEAP_HAZARD"])
+    runtime = Runtime(interpreter)
+
+    def name_error(description):
+        interpreter.error(ErrorType.NAME_ERROR, description)
+
+    namespace.update(
+        Value=Value,
+        INT=Type.INT,
+        STRING=Type.STRING,
+        BOOL=Type.BOOL,
+        NIL=Type.NIL,
+        STRUCT=Type.STRUCT,
+        TRUE=SHARED_TRUE,
+        FALSE=SHARED_FALSE,
+        int_value=int_value,
+        create_value_from_type=create_value_from_type,
+        env=interpreter.env,
+        output=interpreter.output,
+        nil_value=runtime.nil_value,
+        print_result=runtime.print_result,
+        name_error=name_error,
+        assign=runtime.assign,
+        get_var=runtime.get_var,
+        var_def=runtime.var_def,
+        bind_arg=runtime.bind_arg,
+        return_value=runtime.return_value,
+        coerce_return=runtime.coerce_return,
+        condition=runtime.condition,
+        printable=runtime.printable,
+        read_input=runtime.read_input,
+        check_input_args=runtime.check_input_args,
+        neg=runtime.neg,
+        logical_not=runtime.logical_not,
+        new_struct=runtime.new_struct,
+    )
+    for oper, name in OP_NAMES.items():
+        namespace[f"binop_{name}"] = runtime.make_binary_op(oper)
+    namespace["run"]()
@@ -1,3 +1,4 @@
+from element import field_slot
 from intbase import InterpreterBase
 
 
@@ -14,6 +15,8 @@ class Type:
 
 # Represents a value, which has a type and its value
 class Value:
+    __slots__ = ("t", "v", "s")
+
     def __init__(self, type, value=None, struct_type=None):
         self.t = type
         self.v = value
@@ -29,17 +32,115 @@ class Value:
         return self.s
 
 
+# The value of a struct. Each struct type has its own subclass, made by
+# struct_class, whose instances keep the fields in __slots__ (so each field is
+# at a fixed offset in the instance) instead of a dict of field name to Value.
+# Struct() itself has no fields; it is what a struct variable holds until it
+# gets a struct, and like a struct of a type with no fields it counts as nil.
+class Struct:
+    __slots__ = ()
+    fields = ()  # the field names, in declaration order
+    slots = ()  # the field_slot of each field
+    field_set = frozenset()
+    keeps_defaults = True  # the fields hold the Values they are given
+
+    # the same field names holding the same Value objects, as == on the field
+    # dicts structs used to be compared. A field still holding its shared
+    # default (see struct_defaults) had a Value of its own in every struct.
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if not isinstance(other, Struct):
+            return NotImplemented
+        if self.field_set != other.field_set:
+            return False
+        for slot in self.slots:
+            value = getattr(self, slot)
+            if value is not getattr(other, slot) or value.__class__ is SharedValue:
+                return False
+        return True
+
+    __hash__ = None
+
+
+# The Struct subclass for a struct type with the given field names, with an
+# __init__ that takes the field values positionally. Field names that aren't
+# ASCII can't be written in generated code as they are, so a struct type with
+# one keeps its fields in an instance dict instead.
+def struct_class(name, fields):
+    slots = tuple(field_slot(field) for field in fields)
+    params = [f"v{i}" for i in range(len(slots))]
+    attrs = {"fields": tuple(fields), "slots": slots, "field_set": frozenset(fields)}
+    if all(slot.isascii() for slot in slots):
+        lines = [f"def __init__(self, {', '.join(params)}):" if params else "def __init__(self):"]
+        lines += [f"    self.{slot} = {param}" for slot, param in zip(slots, params)] or ["    pass"]
+        namespace = {}
+        exec("\n".join(lines), namespace)
+        attrs.update(__slots__=slots, __init__=namespace["__init__"])
+    else:
+        def __init__(self, *values):
+            for slot, value in zip(slots, values):
+                setattr(self, slot, value)
+        attrs.update(__slots__=("__dict__",), __init__=__init__)
+    return type(name, (Struct,), attrs)
+
+
+# A value that many expressions evaluate to at once: the constants below, the
+# values compiled literals evaluate to, and the defaults new structs start
+# with. Nothing may change one, and since env_v3 gives a value assigned to a
+# struct variable that variable's struct type, no variable may hold one
+# either: env_v3 stores a copy (see unshared). A field holds one only until it
+# is first assigned.
+class SharedValue(Value):
+    __slots__ = ()
+
+    def __copy__(self):
+        return Value(self.t, self.v, self.s)
+
+
+SMALL_INT_MIN = -128
+SMALL_INT_MAX = 1024
+SHARED_TRUE = SharedValue(Type.BOOL, True)
+SHARED_FALSE = SharedValue(Type.BOOL, False)
+SHARED_NIL = SharedValue(Type.NIL, None)
+SHARED_VOID = SharedValue(Type.VOID, None)
+SHARED_EMPTY_STRING = SharedValue(Type.STRING, "")
+SHARED_INTS = [SharedValue(Type.INT, n) for n in range(SMALL_INT_MIN, SMALL_INT_MAX)]
+
+
+def int_value(n):
+    if SMALL_INT_MIN <= n < SMALL_INT_MAX and n.__class__ is int:
+        return SHARED_INTS[n - SMALL_INT_MIN]
+    return Value(Type.INT, n)
+
+
+# the bool operators can give an int (e.g. true && 5), which stays as it is
+def bool_value(b):
+    if b is True:
+        return SHARED_TRUE
+    if b is False:
+        return SHARED_FALSE
+    return Value(Type.BOOL, b)
+
+
+# value itself, or a copy of its own if it is shared
+def unshared(value):
+    if value.__class__ is SharedValue:
+        return Value(value.t, value.v, value.s)
+    return value
+
+
 def create_value(val):
     if val == InterpreterBase.TRUE_DEF:
-        return Value(Type.BOOL, True)
+        return SHARED_TRUE
     elif val == InterpreterBase.FALSE_DEF:
-        return Value(Type.BOOL, False)
+        return SHARED_FALSE
     elif val == InterpreterBase.NIL_DEF:
-        return Value(Type.NIL, None)
+        return SHARED_NIL
     elif isinstance(val, str):
-        return Value(Type.STRING, val)
+        return SHARED_EMPTY_STRING if val == "" else Value(Type.STRING, val)
     elif isinstance(val, int):
-        return Value(Type.INT, val)
+        return int_value(val)
     elif isinstance(Type.VOID, val):
         return Value(Type.VOID, val)
     else:
@@ -47,21 +148,35 @@ def create_value(val):
     
 def create_value_from_type(val_type, struct_type=None):
     if val_type == Type.BOOL:
-        return Value(Type.BOOL, False)
+        return SHARED_FALSE
     elif val_type == Type.INT:
-        return Value(Type.INT, 0)
+        return SHARED_INTS[-SMALL_INT_MIN]
     elif val_type == Type.STRING:
-        return Value(Type.STRING, "")
+        return SHARED_EMPTY_STRING
     elif val_type == Type.NIL:
-        return Value(Type.NIL, None)
+        return SHARED_NIL
     elif val_type == Type.STRUCT:
-        return Value(Type.STRUCT, {}, struct_type)
+        return Value(Type.STRUCT, Struct(), struct_type)
     elif val_type == Type.VOID:
-        return Value(Type.VOID, None)
+        return SHARED_VOID
     else:
         raise ValueError("Unknown value type")
 
 
+# The field values every new struct of a type starts with, in field order: the
+# shared default of each field's type, and for a field of a struct type a
+# shared unset struct (which counts as nil) of that type. struct_names are the
+# struct types of the program.
+def struct_defaults(field_types, struct_names):
+    defaults = []
+    for field_type in field_types.values():
+        if field_type in struct_names:
+            defaults.append(SharedValue(Type.STRUCT, Struct(), field_type))
+        else:
+            defaults.append(create_value_from_type(field_type))
+    return tuple(defaults)
+
+
 def get_printable(val):
     if val.type() == Type.INT:
         return str(val.value())
@@ -0,0 +1,255 @@
+from intbase import InterpreterBase
+from type_valuev3 import Type
+
+PRIMITIVE_TYPES = (Type.INT, Type.STRING, Type.BOOL)
+COMPARISON_OPS = {"==", "!=", "<", "<=", ">", ">=", "&&", "||"}
+# operators each value type supports (the keys of Interpreter.op_to_lambda)
+OPS_BY_TYPE = {
+    Type.INT: {"+", "-", "*", "/", "==", "!=", "<", "<=", ">", ">=", "||", "&&"},
+    Type.STRING: {"+", "==", "!="},
+    Type.BOOL: {"&&", "||", "==", "!="},
+    Type.NIL: {"==", "!="},
+}
+
+
+# Static type checker for Brewin v3, run once over the AST after the struct and
+# function tables are set up.
+#
+# Every variable, parameter and return value has a declared type, and a
+# variable of primitive type can only ever hold a value of that type, so the
+# checker can often tell the runtime type of an expression ahead of time.
+# Whenever it proves a runtime check can't fail it marks the node, and the
+# interpreter skips that check:
+#   "checked" on an operator or if/for node: skip the type check
+#   "checked" on an assignment: the declared type of the (plain) variable being
+#     assigned; skip the lookup and type check, but still coerce int to bool
+#   "checked_args" on an fcall node: one flag per argument
+#   "checked_return" on a func node: every return yields exactly the declared type
+#
+# Struct-typed variables and field accesses are never proven, because v3 lets
+# them hold values of any type at runtime.
+#
+# Expressions whose check is certain to fail are collected in errors, so the
+# interpreter can optionally report them before the program runs.
+class TypeChecker:
+    def __init__(self, struct_name_to_ast, func_name_to_ast):
+        self.struct_name_to_ast = struct_name_to_ast
+        self.func_name_to_ast = func_name_to_ast
+        self.errors = []
+
+    # checks every function whose body has been parsed (see brewlazy)
+    def check(self):
+        for overloads in self.func_name_to_ast.values():
+            for func_ast in overloads.values():
+                if func_ast.get("statements") is not None:
+                    self.check_func(func_ast)
+        return self.errors
+
+    def __error(self, description):
+        self.errors.append(description)
+
+    def check_func(self, func_ast):
+        self.return_type = func_ast.get("return_type")
+        self.exact_returns = True
+        params = {}
+        for arg in func_ast.get("args"):
+            params[arg.get("name")] = arg.get("var_type")
+        self.scopes = [params]
+        self.__check_block(func_ast.get("statements"))
+        func_ast.set("checked_return", (
+            self.return_type in PRIMITIVE_TYPES
+            and self.exact_returns
+            and self.__always_returns(func_ast.get("statements"))
+        ))
+
+    def __always_returns(self, statements):
+        for statement in statements:
+            if statement.elem_type == InterpreterBase.RETURN_NODE:
+                return statement.get("expression") is not None
+            if statement.elem_type == InterpreterBase.IF_NODE:
+                else_statements = statement.get("else_statements")
+                if else_statements is not None and self.__always_returns(statement.get("statements")) \
+                        and self.__always_returns(else_statements):
+                    return True
+        return False
+
+    def __check_block(self, statements):
+        self.scopes.append({})
+        for statement in statements:
+            self.__check_statement(statement)
+        self.scopes.pop()
+
+    def __lookup(self, name):
+        for scope in reversed(self.scopes):
+            if name in scope:
+                return scope[name]
+        return None
+
+    # the type a plain variable is guaranteed to hold, or None
+    def __var_type(self, name):
+        var_type = self.__lookup(name)
+        if var_type in PRIMITIVE_TYPES:
+            return var_type
+        return None
+
+    def __check_statement(self, statement):
+        kind = statement.elem_type
+        if kind == InterpreterBase.FCALL_NODE:
+            self.__expr_type(statement)
+        elif kind == "=":
+            self.__check_assign(statement)
+        elif kind == InterpreterBase.VAR_DEF_NODE:
+            var_name = statement.get("name")
+            var_type = statement.get("var_type")
+            if var_type not in PRIMITIVE_TYPES and var_type not in self.struct_name_to_ast:
+                self.__error(f"Unknown type {var_type} in variable definition")
+            # a duplicate definition fails at runtime, so the first one stays in effect
+            if var_name not in self.scopes[-1]:
+                self.scopes[-1][var_name] = var_type
+        elif kind == InterpreterBase.RETURN_NODE:
+            self.__check_return(statement)
+        elif kind == InterpreterBase.IF_NODE:
+            self.__check_condition(statement, InterpreterBase.IF_NODE)
+            self.__check_block(statement.get("statements"))
+            if statement.get("else_statements") is not None:
+                self.__check_block(statement.get("else_statements"))
+        elif kind == InterpreterBase.FOR_NODE:
+            self.__check_assign(statement.get("init"))
+            self.__check_condition(statement, InterpreterBase.FOR_NODE)
+            self.__check_block(statement.get("statements"))
+            self.__check_assign(statement.get("update"))
+
+    def __check_condition(self, statement, what):
+        cond_type = self.__expr_type(statement.get("condition"))
+        if cond_type is not None and cond_type not in (Type.BOOL, Type.INT):
+            self.__error(f"Incompatible type for {what} condition")
+        statement.set("checked", cond_type in (Type.BOOL, Type.INT))
+
+    def __check_assign(self, assign_ast):
+        value_type = self.__expr_type(assign_ast.get("expression"))
+        var_name = assign_ast.get("name")
+        var_type = None if "." in var_name else self.__var_type(var_name)
+        checked = None
+        if var_type is not None and value_type is not None:
+            if value_type == var_type or (var_type == Type.BOOL and value_type == Type.INT):
+                checked = var_type
+            else:
+                self.__error(f"Expected type {var_type}, got {value_type}")
+        assign_ast.set("checked", checked)
+
+    def __check_return(self, return_ast):
+        expr_ast = return_ast.get("expression")
+        if expr_ast is None:
+            self.exact_returns = False
+            return
+        value_type = self.__expr_type(expr_ast)
+        if value_type != self.return_type:
+            self.exact_returns = False
+        if value_type is None or value_type == self.return_type:
+            return
+        if value_type == Type.NIL:
+            self.__error("Cannot return nil")
+            return
+        if self.return_type == Type.BOOL and value_type == Type.INT:
+            return
+        if self.return_type in PRIMITIVE_TYPES or self.return_type == InterpreterBase.VOID_DEF \
+                or (self.return_type in self.struct_name_to_ast and value_type != Type.NIL):
+            self.__error(f"Expected return type {self.return_type}, got {value_type}")
+
+    # returns the type the expression is guaranteed to evaluate to (if it
+    # evaluates without an error), or None if that can't be known statically
+    def __expr_type(self, expr_ast):
+        kind = expr_ast.elem_type
+        if kind == InterpreterBase.INT_NODE:
+            return Type.INT
+        if kind == InterpreterBase.STRING_NODE:
+            return Type.STRING
+        if kind == InterpreterBase.BOOL_NODE:
+            return Type.BOOL
+        if kind == InterpreterBase.NIL_NODE:
+            return Type.NIL
+        if kind == InterpreterBase.VAR_NODE:
+            var_name = expr_ast.get("name")
+            return None if "." in var_name else self.__var_type(var_name)
+        if kind == InterpreterBase.FCALL_NODE:
+            return self.__call_type(expr_ast)
+        if kind == InterpreterBase.NEG_NODE:
+            operand_type = self.__expr_type(expr_ast.get("op1"))
+            if operand_type is not None and operand_type != Type.INT:
+                self.__error(f"Incompatible type for {kind} operation")
+            expr_ast.set("checked", operand_type == Type.INT)
+            return Type.INT
+        if kind == InterpreterBase.NOT_NODE:
+            operand_type = self.__expr_type(expr_ast.get("op1"))
+            if operand_type is not None and operand_type not in (Type.BOOL, Type.INT):
+                self.__error(f"Incompatible type for {kind} operation")
+            expr_ast.set("checked", operand_type in (Type.BOOL, Type.INT))
+            return Type.BOOL
+        if kind in OPS_BY_TYPE[Type.INT]:
+            return self.__binary_op_type(expr_ast)
+        return None
+
+    def __binary_op_type(self, expr_ast):
+        oper = expr_ast.elem_type
+        left_type = self.__expr_type(expr_ast.get("op1"))
+        right_type = self.__expr_type(expr_ast.get("op2"))
+        checked = False
+        if left_type is not None and right_type is not None:
+            if self.__compatible_types(oper, left_type, right_type) and oper in OPS_BY_TYPE.get(left_type, ()):
+                checked = True
+            else:
+                self.__error(f"Incompatible types for {oper} operation")
+        expr_ast.set("checked", checked)
+        if oper in COMPARISON_OPS:
+            return Type.BOOL
+        if oper == "+":
+            if left_type in (Type.INT, Type.STRING):
+                return left_type
+            if right_type in (Type.INT, Type.STRING):
+                return right_type
+            return None
+        return Type.INT
+
+    # mirrors Interpreter.__compatible_types for values of known, non-struct types
+    def __compatible_types(self, oper, left_type, right_type):
+        if oper == "==" or oper == "!=":
+            if left_type in (Type.INT, Type.BOOL):
+                return right_type in (Type.INT, Type.BOOL)
+            if left_type == Type.STRING:
+                return right_type == Type.STRING
+            return left_type == Type.NIL and right_type == Type.NIL
+        if oper == "&&" or oper == "||":
+            return left_type in (Type.INT, Type.BOOL) and right_type in (Type.INT, Type.BOOL)
+        return left_type == right_type and left_type in (Type.INT, Type.STRING)
+
+    def __call_type(self, call_ast):
+        func_name = call_ast.get("name")
+        actual_args = call_ast.get("args")
+        arg_types = [self.__expr_type(arg) for arg in actual_args]
+        if func_name == "print":
+            if Type.VOID in arg_types:
+                self.__error("Cannot print void value")
+            return Type.NIL
+        if func_name == "inputi":
+            return Type.INT if len(actual_args) <= 1 else None
+        if func_name == "inputs":
+            return Type.STRING if len(actual_args) <= 1 else None
+        func_ast = self.func_name_to_ast.get(func_name, {}).get(len(actual_args))
+        if func_ast is None:
+            return None
+        checked_args = []
+        for formal_ast, arg_type in zip(func_ast.get("args"), arg_types):
+            formal_type = formal_ast.get("var_type")
+            checked_args.append(formal_type in PRIMITIVE_TYPES and arg_type == formal_type)
+            if arg_type is None or arg_type == formal_type:
+                continue
+            if formal_type == Type.BOOL and arg_type == Type.INT:
+                continue
+            if formal_type in self.struct_name_to_ast and arg_type == Type.NIL:
+                continue
+            self.__error(f"Expected type {formal_type}, got {arg_type}")
+        call_ast.set("checked_args", checked_args)
+        return_type = func_ast.get("return_type")
+        if return_type in PRIMITIVE_TYPES or return_type == InterpreterBase.VOID_DEF:
+            return return_type
+        return None